@@ -0,0 +1,146 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from contextlib import nullcontext
+from typing import Iterator, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, CachedAnswer
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_SIGNAL_CACHE = 'cache'
+
+
+def normalize_query(query: str) -> str:
+    """Case-folds and collapses whitespace so trivially different phrasings share an entry."""
+    return re.sub(r'\s+', ' ', query).strip().casefold()
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """
+    Persists complete NotebookLM answers in the app's SQLite database, keyed by
+    (notebook ID, normalized query).
+
+    Entries expire ``ttl`` seconds after they were stored; once more than ``max_entries``
+    are stored the least recently hit ones are evicted. Like ``db``, the cache is bound to
+    the Flask app with ``init_app`` so it can also be written from job worker threads.
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 1000, enabled: bool = True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.app = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.environ.get('ANSWER_CACHE_TTL', 86400)),
+            max_entries=int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 1000)),
+            enabled=os.environ.get('ANSWER_CACHE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+        )
+
+    def init_app(self, app):
+        self.app = app
+
+    def _app_context(self):
+        """Lets job worker threads, which run outside any request, use the database."""
+        return self.app.app_context() if self.app is not None else nullcontext()
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, notebook_id: Optional[str], query: str) -> Optional[str]:
+        """Returns the cached answer, or None on a miss."""
+        if not self.enabled or not notebook_id:
+            return None
+        with self._app_context():
+            return self._get(notebook_id, query)
+
+    def _get(self, notebook_id: str, query: str) -> Optional[str]:
+        entry = CachedAnswer.query.filter_by(notebook_id=notebook_id, query_hash=query_hash(query)).first()
+        now = time.time()
+        if entry is not None and now - entry.created_at > self.ttl:
+            db.session.delete(entry)
+            db.session.commit()
+            entry = None
+        if entry is None:
+            self._count(hit=False)
+            return None
+        entry.hit_count += 1
+        entry.last_hit_at = now
+        db.session.commit()
+        self._count(hit=True)
+        return entry.answer
+
+    def put(self, notebook_id: Optional[str], query: str, answer: str):
+        """Stores a complete answer, replacing any previous one, from any thread."""
+        if not self.enabled or not notebook_id or not answer or self.app is None:
+            return
+        with self._app_context():
+            key = query_hash(query)
+            now = time.time()
+            entry = CachedAnswer.query.filter_by(notebook_id=notebook_id, query_hash=key).first()
+            if entry is None:
+                db.session.add(CachedAnswer(notebook_id, key, normalize_query(query), answer, now))
+            else:
+                entry.answer = answer
+                entry.created_at = entry.last_hit_at = now
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another worker stored the same answer first.
+                db.session.rollback()
+                return
+            self._evict()
+            logger.info(f"Cached answer for notebook {notebook_id}.")
+
+    def _evict(self):
+        """Drops expired entries, then the least recently hit ones beyond ``max_entries``."""
+        CachedAnswer.query.filter(CachedAnswer.created_at < time.time() - self.ttl).delete()
+        excess = CachedAnswer.query.count() - self.max_entries
+        if excess > 0:
+            stale_ids = [row.id for row in CachedAnswer.query.order_by(CachedAnswer.last_hit_at).limit(excess)]
+            CachedAnswer.query.filter(CachedAnswer.id.in_(stale_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def clear(self):
+        CachedAnswer.query.delete()
+        db.session.commit()
+
+    def stats(self):
+        """Hit/miss counters and entry count. Must be called within an app context."""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': CachedAnswer.query.count() if self.enabled else 0,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': hits,
+            'misses': misses
+        }
+
+
+def replay_events(answer: str) -> Iterator[dict]:
+    """The events of a live query, minus the browser steps, for a cached answer."""
+    yield {"status": "cache_hit", "message": "Answer served from cache."}
+    yield {"status": "streaming"}
+    yield {"chunk": answer}
+    yield {"status": "complete", "completion_signal": COMPLETION_SIGNAL_CACHE}
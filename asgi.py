@@ -0,0 +1,347 @@
+"""
+ASGI serving mode.
+
+Run with ``SERVER_MODE=asgi python main.py`` or ``uvicorn asgi:create_app --factory``.
+
+The streaming endpoints (/api/process_query, /api/query_notebooklm, /api/batch_query and
+/api/jobs/<id>/events) are served as coroutines that follow their job's events on the event
+loop, so an open stream holds no thread while it waits. WebDriver work stays on the job
+scheduler's workers, one per browser session. Every other route is handed to the Flask app
+in a bounded thread pool, so /api/status and /api/users stay responsive under streaming load.
+Streaming /api/grok requests ("stream": true) also go to Flask, each on a thread of its own,
+since they wait on the upstream for the whole completion.
+"""
+import io
+import os
+import sys
+import json
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from urllib.parse import parse_qs
+
+from browser_broker import BrokerError
+from notebooklm import (JOB_KIND_BATCH, JOB_KIND_PROCESS, JOB_KIND_QUERY, browser_pool, format_sse_with_id,
+                        job_scheduler, query_history, release_job_stream, resume_index, start_query_stream,
+                        stream_format)
+
+logger = logging.getLogger(__name__)
+
+STREAM_ROUTES = {
+    '/api/process_query': JOB_KIND_PROCESS,
+    '/api/query_notebooklm': JOB_KIND_QUERY,
+    '/api/batch_query': JOB_KIND_BATCH,
+}
+JOB_EVENTS_PREFIX = '/api/jobs/'
+JOB_EVENTS_SUFFIX = '/events'
+GROK_PATH = '/api/grok'
+# Chunks of a Flask response buffered ahead of a slow client before the WSGI thread waits.
+WSGI_QUEUE_SIZE = 16
+
+
+class _ClientGone(Exception):
+    """Stops a WSGI response whose client is no longer being served."""
+
+
+class AsgiApp:
+    """Serves the streaming endpoints natively and everything else through the Flask (WSGI) app."""
+
+    def __init__(self, flask_app, threads=None):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads or int(os.environ.get('ASGI_THREADS', 32)),
+                                           thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        path, method = scope['path'], scope['method']
+        if method == 'POST' and path in STREAM_ROUTES:
+            await self._query_stream(STREAM_ROUTES[path], scope, receive, send)
+        elif method == 'GET' and path.startswith(JOB_EVENTS_PREFIX) and path.endswith(JOB_EVENTS_SUFFIX):
+            await self._job_events(path[len(JOB_EVENTS_PREFIX):-len(JOB_EVENTS_SUFFIX)], scope, receive, send)
+        elif method == 'POST' and path == GROK_PATH:
+            await self._grok(scope, receive, send)
+        else:
+            await self._wsgi(scope, receive, send)
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                logger.info("ASGI server shutting down. Closing browser pool...")
+                job_scheduler.shutdown()
+                await self._run_blocking(browser_pool.shutdown)
+                await self._run_blocking(query_history.shutdown)
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # --- Streaming endpoints ---
+
+    async def _query_stream(self, kind, scope, receive, send):
+        body = await _read_body(receive)
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            await _send_json(send, 400, {'error': 'Request body must be JSON'})
+            return
+        if data is not None and not isinstance(data, dict):
+            await _send_json(send, 400, {'error': 'Request body must be a JSON object'})
+            return
+        headers = _headers(scope)
+        client_id = (data or {}).get('client_id') or headers.get('x-client-id') or (scope.get('client') or ('',))[0]
+
+        # Validation, the cache lookup and job submission touch SQLite, so run them off the loop.
+        try:
+            error_response, job, cached_events = await self._run_blocking(start_query_stream, kind, data, client_id)
+        except BrokerError as e:
+            await _send_json(send, 503, {'error': str(e)})
+            return
+        if error_response:
+            await _send_json(send, error_response[1], error_response[0])
+            return
+        format_event, mimetype = stream_format(kind)
+        if cached_events is not None:
+            await _start_stream(send, mimetype)
+            for index, event in enumerate(cached_events):
+                await _send_chunk(send, format_event(index, event))
+            await _send_chunk(send, None)
+            return
+        await _relay_job(job, 0, format_event, mimetype, True, receive, send)
+
+    async def _job_events(self, job_id, scope, receive, send):
+        try:
+            job = await self._run_blocking(job_scheduler.get, job_id)
+        except BrokerError as e:
+            await _send_json(send, 503, {'error': str(e)})
+            return
+        if job is None:
+            await _send_json(send, 404, {'error': 'Job not found'})
+            return
+        last_event_id = _int_or_none(_headers(scope).get('last-event-id'))
+        from_values = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('from')
+        start = resume_index(last_event_id, _int_or_none(from_values[0]) if from_values else 0)
+        await _relay_job(job, start, format_sse_with_id, 'text/event-stream', False, receive, send)
+
+    async def _grok(self, scope, receive, send):
+        """
+        /api/grok is served by the Flask view, but a "stream": true request gets a thread of its own:
+        it waits on the upstream for as long as the completion streams, and must not hold one of
+        the ASGI_THREADS workers that every other route shares.
+        """
+        body = await _read_body(receive)
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        stream = isinstance(data, dict) and data.get('stream') is True
+        await self._wsgi(scope, receive, send, body=body, dedicated_thread=stream)
+
+    # --- Everything else: the Flask app ---
+
+    async def _wsgi(self, scope, receive, send, body=None, dedicated_thread=False):
+        """
+        Runs the Flask app for one request. The WSGI call and the iteration of its body run on
+        one executor thread (or a thread of its own with ``dedicated_thread``) inside one copied
+        context, so ``stream_with_context`` generators keep their app and request context while
+        they stream; the chunks are handed to the event loop through a bounded queue.
+        """
+        if body is None:
+            body = await _read_body(receive)
+        environ = _wsgi_environ(scope, body)
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=WSGI_QUEUE_SIZE)
+        stopped = threading.Event()
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start['status'] = int(status.split(' ', 1)[0])
+            response_start['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        def put(message):
+            try:
+                future = asyncio.run_coroutine_threadsafe(queue.put(message), loop)
+            except RuntimeError:  # The event loop has been closed.
+                raise _ClientGone()
+            while True:
+                try:
+                    return future.result(timeout=0.5)
+                except FutureTimeoutError:
+                    if stopped.is_set():
+                        future.cancel()
+                        raise _ClientGone()
+
+        def emit(kind, value=None):
+            # Some responses only call start_response once iterated, so the start goes with the first part.
+            if 'sent' not in response_start and kind != 'error':
+                response_start['sent'] = True
+                put(('start', (response_start['status'], response_start['headers'])))
+            put((kind, value))
+
+        def run():
+            result = None
+            try:
+                result = self.flask_app(environ, start_response)
+                for chunk in result:
+                    if stopped.is_set():
+                        return
+                    if chunk:
+                        emit('body', chunk)
+                emit('end')
+            except _ClientGone:
+                pass
+            except Exception as e:
+                try:
+                    put(('error', e))
+                except _ClientGone:
+                    pass
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        context = contextvars.copy_context()
+        if dedicated_thread:
+            threading.Thread(target=context.run, args=(run,), name='wsgi-stream', daemon=True).start()
+        else:
+            loop.run_in_executor(self.executor, context.run, run)
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == 'start':
+                    await send({'type': 'http.response.start', 'status': value[0], 'headers': value[1]})
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+                elif kind == 'end':
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                else:
+                    raise value
+        finally:
+            stopped.set()
+
+
+async def _relay_job(job, start, format_event, mimetype, cancel_on_disconnect, receive, send):
+    """Streams a job's events to the client, stopping early if the client disconnects."""
+    job.attach()
+    finished = False
+
+    async def relay():
+        await _start_stream(send, mimetype)
+        async for index, event in _aenumerate(job.aiter_events(start), start):
+            line = format_event(index, event)
+            if line is not None:
+                await _send_chunk(send, line)
+        await _send_chunk(send, None)
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    relay_task = asyncio.ensure_future(relay())
+    disconnect_task = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({relay_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        finished = relay_task.done() and not relay_task.cancelled() and relay_task.exception() is None
+        if not finished and not relay_task.done():
+            logger.info(f"Client disconnected from job {job.id}.")
+    finally:
+        for task in (relay_task, disconnect_task):
+            task.cancel()
+        release_job_stream(job, finished, cancel_on_disconnect)
+
+
+async def _aenumerate(aiterable, start=0):
+    index = start
+    async for item in aiterable:
+        yield index, item
+        index += 1
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return body
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _start_stream(send, mimetype):
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', f'{mimetype}; charset=utf-8'.encode()), (b'cache-control', b'no-cache')]})
+
+
+async def _send_chunk(send, text):
+    """Sends one piece of a streamed body; None ends the response."""
+    if text is None:
+        await send({'type': 'http.response.body', 'body': b''})
+    else:
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _wsgi_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('',))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name, value = raw_name.decode('latin-1').upper().replace('-', '_'), raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ[name] = value
+        elif name not in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    # The body has been read in full, so its length is known even for chunked requests.
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+def create_app():
+    """Factory for ``uvicorn asgi:create_app --factory``."""
+    from main import app
+    return AsgiApp(app)
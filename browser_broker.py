@@ -0,0 +1,318 @@
+"""
+Browser broker: one process owns every WebDriver session and runs the query jobs, and any
+number of app worker processes (e.g. gunicorn workers) submit jobs to it over a Unix socket.
+
+Start the broker with ``python browser_broker.py`` and run the app workers with
+``BROWSER_BROKER_SOCKET`` pointing at the same socket. The workers then use RemoteJobScheduler
+and RemoteBrowserPool, which mirror the JobScheduler and BrowserPool methods the endpoints use,
+so the HTTP tier can scale across cores without multiplying Chrome sessions or sharing a profile.
+
+Protocol: one connection per request. The client sends one JSON line ``{"op": ..., ...}``.
+The broker answers with one line ``{"ok": true, "result": ...}`` or ``{"ok": false, "error": ...}``;
+the ``events`` op instead streams ``{"event": ...}`` lines and ends with ``{"end": true}``.
+"""
+import os
+import json
+import stat
+import importlib
+import socket
+import tempfile
+import asyncio
+import logging
+import socketserver
+from typing import Iterator, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# In a directory only this user can enter: whoever can connect drives the logged-in browser session.
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), f'notebooklm-broker-{os.getuid()}', 'broker.sock')
+# Answers and batch records can be large; allow long lines when streaming events.
+MAX_LINE_BYTES = 64 * 1024 * 1024
+
+
+class BrokerError(Exception):
+    """The broker could not be reached or rejected a request."""
+
+
+# --- Broker side ---
+
+class _BrokerRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline(MAX_LINE_BYTES)
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            op = request.pop('op')
+            if op == 'events':
+                self._stream_events(**request)
+                return
+            result = getattr(self.server, f'op_{op}')(**request)
+            self._write({'ok': True, 'result': result})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            logger.error(f"Broker request failed: {e}", exc_info=True)
+            try:
+                self._write({'ok': False, 'error': str(e)})
+            except OSError:
+                pass
+
+    def _write(self, message):
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def _stream_events(self, job_id, start=0):
+        job = self.server.scheduler.get(job_id)
+        if job is None:
+            self._write({'ok': False, 'error': 'Job not found'})
+            return
+        try:
+            for event in job.iter_events(start):
+                self._write({'event': event})
+            self._write({'end': True})
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info(f"Worker stopped following job {job_id}.")
+
+
+def _prepare_socket_path(path):
+    """
+    Creates the socket's directory (0700) if needed and removes a stale socket of this user.
+    Refuses a default directory another user could enter, and any path that is not such a socket.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if path == DEFAULT_SOCKET_PATH:
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise PermissionError(f"{directory} must be a directory owned by this user with mode 0700.")
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} exists and is not a socket owned by this user; not removing it.")
+    os.unlink(path)
+
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves a JobScheduler and BrowserPool to app worker processes. Each connection gets a thread."""
+
+    daemon_threads = True
+
+    def __init__(self, path, scheduler, pool):
+        self.scheduler = scheduler
+        self.pool = pool
+        _prepare_socket_path(path)
+        # The socket is created readable and writable by this user only; the protocol has no authentication.
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(path, _BrokerRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def _job(self, job_id):
+        job = self.scheduler.get(job_id)
+        if job is None:
+            raise KeyError(f"Job {job_id} not found")
+        return job
+
+    def op_submit(self, kind, params, priority, client_id=None, coalesce_key=None, keep_alive=False):
+        # JSON turns the coalesce key tuple into a list; make it hashable again.
+        key = tuple(coalesce_key) if coalesce_key is not None else None
+        job = self.scheduler.submit(kind, params, priority, client_id, key, keep_alive=keep_alive)
+        return job.to_dict()
+
+    def op_get(self, job_id, include_result=False, wait=0):
+        job = self.scheduler.get(job_id)
+        if job is None:
+            return None
+        if wait:
+            job.wait(wait)
+        return job.to_dict(include_result=include_result)
+
+    def op_attach(self, job_id):
+        self._job(job_id).attach()
+
+    def op_detach(self, job_id):
+        return self._job(job_id).detach()
+
+    def op_cancel(self, job_id):
+        return self.scheduler.cancel(job_id)
+
+    def op_stats(self):
+        return self.scheduler.stats()
+
+    def op_pool_stats(self):
+        return self.pool.stats()
+
+    def op_close_idle(self):
+        return self.pool.close_idle()
+
+    def op_metrics(self):
+        return REGISTRY.snapshot()
+
+
+# --- App worker side ---
+
+class BrokerClient:
+    """Sends requests to the broker over its Unix socket."""
+
+    def __init__(self, path: str, connect_timeout: float = 5):
+        self.path = path
+        self.connect_timeout = connect_timeout
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise BrokerError(f"Browser broker not reachable at {self.path}: {e}")
+        sock.settimeout(None)
+        return sock
+
+    def call(self, op: str, **kwargs):
+        with self._connect() as sock, sock.makefile('rwb') as stream:
+            stream.write(json.dumps({'op': op, **kwargs}).encode('utf-8') + b'\n')
+            stream.flush()
+            line = stream.readline(MAX_LINE_BYTES)
+        if not line:
+            raise BrokerError(f"Browser broker closed the connection during '{op}'")
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise BrokerError(response.get('error', 'Unknown broker error'))
+        return response.get('result')
+
+    def iter_events(self, job_id: str, start: int = 0) -> Iterator[dict]:
+        with self._connect() as sock, sock.makefile('rwb') as stream:
+            stream.write(json.dumps({'op': 'events', 'job_id': job_id, 'start': start}).encode('utf-8') + b'\n')
+            stream.flush()
+            while True:
+                line = stream.readline(MAX_LINE_BYTES)
+                if not line:
+                    raise BrokerError(f"Browser broker closed the event stream of job {job_id}")
+                message = json.loads(line)
+                if 'event' in message:
+                    yield message['event']
+                elif message.get('end'):
+                    return
+                else:
+                    raise BrokerError(message.get('error', 'Unknown broker error'))
+
+    async def aiter_events(self, job_id: str, start: int = 0):
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_LINE_BYTES)
+        try:
+            writer.write(json.dumps({'op': 'events', 'job_id': job_id, 'start': start}).encode('utf-8') + b'\n')
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise BrokerError(f"Browser broker closed the event stream of job {job_id}")
+                message = json.loads(line)
+                if 'event' in message:
+                    yield message['event']
+                elif message.get('end'):
+                    return
+                else:
+                    raise BrokerError(message.get('error', 'Unknown broker error'))
+        finally:
+            writer.close()
+
+
+class RemoteJob:
+    """A job running in the broker; mirrors the QueryJob methods the endpoints use."""
+
+    def __init__(self, client: BrokerClient, data: dict):
+        self.client = client
+        self.id = data['job_id']
+        self._data = data
+
+    def attach(self):
+        self.client.call('attach', job_id=self.id)
+
+    def detach(self) -> bool:
+        return self.client.call('detach', job_id=self.id)
+
+    def iter_events(self, start: int = 0) -> Iterator[dict]:
+        return self.client.iter_events(self.id, start)
+
+    def aiter_events(self, start: int = 0):
+        return self.client.aiter_events(self.id, start)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        self._data = self.client.call('get', job_id=self.id, wait=timeout or 0) or self._data
+        return self._data['state'] in ('completed', 'failed', 'cancelled')
+
+    def to_dict(self, include_result: bool = False):
+        return self.client.call('get', job_id=self.id, include_result=include_result) or self._data
+
+
+class RemoteJobScheduler:
+    """Submits jobs to the broker; mirrors the JobScheduler methods the endpoints use."""
+
+    def __init__(self, client: BrokerClient):
+        self.client = client
+
+    def submit(self, kind, params, priority='normal', client_id=None, coalesce_key=None, keep_alive=False):
+        data = self.client.call('submit', kind=kind, params=params, priority=priority, client_id=client_id,
+                                coalesce_key=coalesce_key, keep_alive=keep_alive)
+        return RemoteJob(self.client, data)
+
+    def get(self, job_id):
+        data = self.client.call('get', job_id=job_id)
+        return RemoteJob(self.client, data) if data else None
+
+    def cancel(self, job_id):
+        return self.client.call('cancel', job_id=job_id)
+
+    def stats(self):
+        return self.client.call('stats')
+
+    def shutdown(self):
+        """The broker owns the workers; nothing to stop in an app worker."""
+
+
+class RemoteBrowserPool:
+    """The broker's browser pool as seen from an app worker."""
+
+    def __init__(self, client: BrokerClient):
+        self.client = client
+
+    def start(self):
+        """The broker starts the sessions."""
+
+    def stats(self):
+        return self.client.call('pool_stats')
+
+    def close_idle(self):
+        return self.client.call('close_idle')
+
+    def shutdown(self):
+        """The broker closes the sessions when it stops."""
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # The broker owns the browsers itself, so it must not connect to a broker.
+    path = os.environ.pop('BROWSER_BROKER_SOCKET', None) or DEFAULT_SOCKET_PATH
+    # Importing main sets up the database, binds the answer cache and starts the browser pool.
+    importlib.import_module('main')
+    from notebooklm import browser_pool, job_scheduler
+
+    server = BrokerServer(path, job_scheduler, browser_pool)
+    logger.info(f"Browser broker listening on {path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,477 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from selenium import webdriver
+from selenium.common.exceptions import NoSuchWindowException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from metrics import ERRORS_TOTAL, LEASE_WAIT_SECONDS, PHASE_SECONDS
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no browser session becomes available within the acquire timeout."""
+
+
+class PoolClosedError(Exception):
+    """Raised when a session is requested from a pool that has been shut down."""
+
+
+def _profile_dir_for_slot(slot: int) -> str:
+    """
+    Returns the Chrome user-data-dir for a pool slot. Chrome refuses to share a
+    user-data-dir between running instances, so every slot beyond the first gets
+    its own directory next to the base profile (e.g. /data, /data-1, /data-2).
+    """
+    base_dir = os.environ.get('CHROME_USER_DATA_DIR', '/data')
+    return base_dir if slot == 0 else f"{base_dir}-{slot}"
+
+
+def create_driver(slot: int = 0) -> WebDriver:
+    """
+    Creates a new WebDriver session for the WEBDRIVER_BACKEND setting:
+    ``remote`` (default) connects to the Selenium hub, ``local`` starts a headless Chrome
+    on this machine and ``fake`` returns the pure-Python driver from fake_notebooklm.py.
+    Raises on failure so the pool can release the slot it reserved.
+    """
+    backend = os.environ.get('WEBDRIVER_BACKEND', 'remote').lower()
+    if backend == 'fake':
+        from fake_notebooklm import FakeNotebookDriver
+        logger.info(f"Using the fake NotebookLM WebDriver (slot {slot}).")
+        return FakeNotebookDriver.from_env(slot)
+
+    chrome_options = Options()
+
+    # --- Anti-detection options ---
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-infobars")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--window-size=1920,1080")
+    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+
+    # Using a realistic or slightly future-dated User-Agent helps avoid bot detection.
+    # This is configurable via the CHROME_USER_AGENT environment variable.
+    default_user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/138.0.7204.157 Safari/537.36'
+    user_agent = os.environ.get('CHROME_USER_AGENT', default_user_agent)
+    chrome_options.add_argument(f'user-agent={user_agent}')
+
+    if backend == 'local':
+        chrome_options.add_argument("--headless=new")
+        # A local Chrome only uses a saved profile when one is configured explicitly.
+        if os.environ.get('CHROME_USER_DATA_DIR'):
+            chrome_options.add_argument(f"--user-data-dir={_profile_dir_for_slot(slot)}")
+        logger.info(f"Starting a local headless Chrome (slot {slot})")
+        driver = webdriver.Chrome(options=chrome_options)
+        driver.set_page_load_timeout(60)
+        return driver
+
+    # This points to the profile directory mounted inside the Selenium container
+    chrome_options.add_argument(f"--user-data-dir={_profile_dir_for_slot(slot)}")
+    chrome_options.add_argument("--profile-directory=Default")
+
+    # Use a remote WebDriver to connect to the Selenium container
+    selenium_hub_url = os.environ.get('SELENIUM_HUB_URL', 'http://localhost:4444/wd/hub')
+    logger.info(f"Attempting to connect to Selenium Hub at: {selenium_hub_url} (slot {slot})")
+    driver = webdriver.Remote(
+        command_executor=selenium_hub_url,
+        options=chrome_options
+    )
+    driver.set_page_load_timeout(60)
+    logger.info(f"WebDriver initialized successfully and connected to Selenium Hub (slot {slot}).")
+    return driver
+
+
+class NotebookTabCache:
+    """
+    Keeps several notebooks open in one browser session, one window handle per notebook.
+
+    Switching to a cached notebook is a single ``switch_to.window`` call instead of a full
+    page load. When more than ``capacity`` notebooks are open, the least recently used
+    tab is closed.
+    """
+
+    def __init__(self, driver: WebDriver, capacity: int = 3):
+        self.driver = driver
+        self.capacity = max(1, capacity)
+        self._tabs: "OrderedDict[str, str]" = OrderedDict()
+
+    def __contains__(self, notebook_id: str) -> bool:
+        return notebook_id in self._tabs
+
+    def __len__(self) -> int:
+        return len(self._tabs)
+
+    def activate(self, notebook_id: str) -> bool:
+        """Switches to the tab holding ``notebook_id``. Returns False on a cache miss."""
+        handle = self._tabs.get(notebook_id)
+        if handle is None:
+            return False
+        try:
+            self.driver.switch_to.window(handle)
+        except NoSuchWindowException:
+            logger.warning(f"Cached tab for notebook '{notebook_id}' is gone; dropping it.")
+            del self._tabs[notebook_id]
+            return False
+        self._tabs.move_to_end(notebook_id)
+        return True
+
+    def open(self, notebook_id: str, url: str):
+        """
+        Loads ``url`` for ``notebook_id`` in its own tab: the notebook's cached tab if there
+        is one, the current window when nothing is cached yet, or a new tab otherwise.
+        Evicts the least recently used tab if the cache is full.
+        """
+        if self.activate(notebook_id):
+            self.driver.get(url)
+            return
+        if self._tabs:
+            self.driver.switch_to.new_window('tab')
+        handle = self.driver.current_window_handle
+        self._tabs[notebook_id] = handle
+        self.driver.get(url)
+        while len(self._tabs) > self.capacity:
+            self._evict_lru(keep=handle)
+
+    def _evict_lru(self, keep: str):
+        notebook_id, handle = self._tabs.popitem(last=False)
+        logger.info(f"Evicting notebook tab '{notebook_id}' from the tab cache.")
+        try:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        except NoSuchWindowException:
+            pass
+        finally:
+            self.driver.switch_to.window(keep)
+
+    def notebook_ids(self) -> List[str]:
+        """Cached notebook IDs, least recently used first."""
+        return list(self._tabs)
+
+
+class BrowserSession:
+    """A single WebDriver session plus the bookkeeping the pool needs to manage it."""
+
+    def __init__(self, driver: WebDriver, slot: int, tab_cache_size: int = 3):
+        self.driver = driver
+        self.slot = slot
+        self.tabs = NotebookTabCache(driver, tab_cache_size)
+        self.healthy = True
+        self.in_use = False
+        self.retire_on_checkin = False
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+        self.request_count = 0
+        self.error_count = 0
+        self.last_error: Optional[str] = None
+        # Last URL observed by our own code; lets /status report without a WebDriver round trip.
+        self.current_url: Optional[str] = None
+
+    def is_alive(self) -> bool:
+        """Probes the remote session with a cheap command."""
+        try:
+            self.current_url = self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def record_error(self, error: Exception):
+        """Records a failure and re-checks whether the underlying session is still usable."""
+        self.error_count += 1
+        self.last_error = str(error)
+        ERRORS_TOTAL.inc(type=type(error).__name__)
+        self.healthy = self.is_alive()
+        if not self.healthy:
+            logger.warning(f"Browser session in slot {self.slot} is no longer responsive: {error}")
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.error(f"Error closing browser session in slot {self.slot}: {e}")
+
+    def to_dict(self):
+        return {
+            'slot': self.slot,
+            'healthy': self.healthy,
+            'in_use': self.in_use,
+            'current_url': self.current_url,
+            'open_notebooks': self.tabs.notebook_ids(),
+            'request_count': self.request_count,
+            'error_count': self.error_count,
+            'last_error': self.last_error,
+            'created_at': self.created_at,
+            'last_used_at': self.last_used_at,
+        }
+
+
+class BrowserPool:
+    """
+    A bounded pool of remote WebDriver sessions.
+
+    Sessions are created lazily up to ``max_size`` and handed out exclusively via
+    ``checkout``/``checkin`` (or the ``lease`` context manager). ``min_size`` sessions
+    are pre-warmed in the background by ``start``.
+
+    Sessions stay open between leases and are only recycled once they have been idle
+    for ``idle_ttl`` seconds, served ``max_requests`` queries or failed ``max_errors``
+    times. Each session keeps up to ``tab_cache_size`` notebooks open as separate tabs.
+    A reaper thread closes expired idle sessions and tops the pool back up to
+    ``min_size``. ``reuse_sessions`` tells one-shot callers such as /process_query
+    whether to keep their session warm or retire it when they are done.
+    """
+
+    def __init__(self, min_size: int = 1, max_size: int = 1, acquire_timeout: float = 300,
+                 driver_factory: Callable[[int], WebDriver] = create_driver,
+                 reuse_sessions: bool = True, idle_ttl: float = 600, max_requests: int = 100,
+                 max_errors: int = 3, tab_cache_size: int = 3):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.driver_factory = driver_factory
+        self.reuse_sessions = reuse_sessions
+        self.idle_ttl = idle_ttl
+        self.max_requests = max_requests
+        self.max_errors = max_errors
+        self.tab_cache_size = tab_cache_size
+
+        self._cond = threading.Condition()
+        self._sessions: Dict[int, BrowserSession] = {}
+        self._idle: List[BrowserSession] = []
+        self._free_slots: List[int] = list(range(max_size))
+        self._waiting = 0
+        self._closed = False
+        self._reaper: Optional[threading.Thread] = None
+        # The reaper sleeps on its own event: a wakeup meant for a waiting checkout()
+        # (which notify() hands to a single waiter on _cond) must never go to it.
+        self._reaper_stop = threading.Event()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Builds a pool sized by the BROWSER_POOL_* environment variables."""
+        return cls(
+            min_size=int(os.environ.get('BROWSER_POOL_MIN_SIZE', 1)),
+            max_size=int(os.environ.get('BROWSER_POOL_MAX_SIZE', 1)),
+            acquire_timeout=float(os.environ.get('BROWSER_POOL_ACQUIRE_TIMEOUT', 300)),
+            reuse_sessions=os.environ.get('BROWSER_POOL_REUSE', 'true').lower() in ('1', 'true', 'yes'),
+            idle_ttl=float(os.environ.get('BROWSER_POOL_IDLE_TTL', 600)),
+            max_requests=int(os.environ.get('BROWSER_POOL_MAX_REQUESTS', 100)),
+            max_errors=int(os.environ.get('BROWSER_POOL_MAX_ERRORS', 3)),
+            tab_cache_size=int(os.environ.get('BROWSER_TAB_CACHE_SIZE', 3)),
+            **kwargs
+        )
+
+    # --- Session lifecycle ---
+
+    def _create_session(self, slot: int) -> BrowserSession:
+        """Creates a session for a slot already reserved by the caller."""
+        started = time.monotonic()
+        try:
+            with tracer.span('browser_init', slot=slot):
+                driver = tracer.trace_webdriver(self.driver_factory(slot))
+        except Exception:
+            with self._cond:
+                self._free_slots.append(slot)
+                self._free_slots.sort()
+                self._cond.notify()
+            raise
+        PHASE_SECONDS.observe(time.monotonic() - started, phase='browser_init')
+        session = BrowserSession(driver, slot, self.tab_cache_size)
+        with self._cond:
+            self._sessions[slot] = session
+        return session
+
+    def _discard(self, session: BrowserSession):
+        """Quits a session and frees its slot. Must be called without holding the lock."""
+        session.quit()
+        with self._cond:
+            if self._sessions.get(session.slot) is session:
+                del self._sessions[session.slot]
+                self._free_slots.append(session.slot)
+                self._free_slots.sort()
+            self._cond.notify()
+        logger.info(f"Browser session in slot {session.slot} discarded.")
+
+    def _warm(self):
+        """Creates idle sessions until the pool holds at least ``min_size`` sessions."""
+        while True:
+            with self._cond:
+                if self._closed or not self._free_slots or len(self._sessions) >= self.min_size:
+                    return
+                slot = self._free_slots.pop(0)
+            try:
+                session = self._create_session(slot)
+            except Exception as e:
+                logger.error(f"Failed to initialize WebDriver: {e}", exc_info=True)
+                return
+            with self._cond:
+                self._idle.append(session)
+                self._cond.notify()
+
+    def start(self):
+        """
+        Pre-warms ``min_size`` sessions in a background thread so app startup is not blocked,
+        and starts the idle reaper.
+        """
+        thread = threading.Thread(target=self._warm, daemon=True)
+        thread.start()
+        if self.idle_ttl > 0 and self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_loop, daemon=True)
+            self._reaper.start()
+        return thread
+
+    def _reap_loop(self):
+        interval = max(1.0, min(self.idle_ttl / 2, 30.0))
+        while not self._reaper_stop.wait(interval):
+            try:
+                self.reap_idle()
+            except Exception as e:
+                logger.error(f"Error while reaping idle browser sessions: {e}", exc_info=True)
+
+    def reap_idle(self) -> int:
+        """Closes sessions idle for longer than ``idle_ttl`` and replaces them up to ``min_size``."""
+        cutoff = time.time() - self.idle_ttl
+        with self._cond:
+            expired = [s for s in self._idle if s.last_used_at < cutoff]
+            self._idle = [s for s in self._idle if s not in expired]
+        for session in expired:
+            logger.info(f"Recycling browser session in slot {session.slot} after {self.idle_ttl}s idle.")
+            self._discard(session)
+        if expired:
+            self._warm()
+        return len(expired)
+
+    def checkout(self, timeout: Optional[float] = None) -> BrowserSession:
+        """
+        Leases a session exclusively to the caller, creating one if the pool has room.
+        Raises PoolExhaustedError if none becomes available within ``timeout`` seconds.
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            slot = None
+            session = None
+            with self._cond:
+                self._waiting += 1
+                try:
+                    while True:
+                        if self._closed:
+                            raise PoolClosedError("Browser pool has been shut down.")
+                        if self._idle:
+                            session = self._idle.pop()
+                            session.in_use = True
+                            break
+                        if self._free_slots:
+                            slot = self._free_slots.pop(0)
+                            break
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise PoolExhaustedError(f"No browser session became available within {timeout}s.")
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            if session is None:
+                LEASE_WAIT_SECONDS.observe(time.monotonic() - started)
+                session = self._create_session(slot)
+                session.in_use = True
+                return session
+
+            if session.healthy:
+                LEASE_WAIT_SECONDS.observe(time.monotonic() - started)
+                return session
+            # An idle session went bad (e.g. the hub reaped it); drop it and try again.
+            self._discard(session)
+
+    def _should_recycle(self, session: BrowserSession) -> bool:
+        if not session.healthy or session.retire_on_checkin or self._closed:
+            return True
+        if self.max_requests and session.request_count >= self.max_requests:
+            logger.info(f"Recycling browser session in slot {session.slot} after {session.request_count} requests.")
+            return True
+        if self.max_errors and session.error_count >= self.max_errors:
+            logger.info(f"Recycling browser session in slot {session.slot} after {session.error_count} errors.")
+            return True
+        return False
+
+    def checkin(self, session: BrowserSession) -> bool:
+        """
+        Returns a leased session to the pool, discarding it if it is unhealthy, retired or
+        has reached its recycle limits. Returns True if the session was kept warm.
+        """
+        session.in_use = False
+        session.last_used_at = time.time()
+        if self._should_recycle(session):
+            self._discard(session)
+            return False
+        with self._cond:
+            self._idle.append(session)
+            self._cond.notify()
+        return True
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        """Context manager around checkout/checkin. Errors escaping the block mark the session."""
+        session = self.checkout(timeout)
+        session.request_count += 1
+        try:
+            yield session
+        except Exception as e:
+            session.record_error(e)
+            raise
+        finally:
+            self.checkin(session)
+
+    def close_idle(self) -> int:
+        """Quits all idle sessions and flags in-use ones to be closed when returned."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            for session in self._sessions.values():
+                if session.in_use:
+                    session.retire_on_checkin = True
+            busy = sum(1 for s in self._sessions.values() if s.in_use)
+        for session in idle:
+            self._discard(session)
+        return len(idle) + busy
+
+    def shutdown(self):
+        """Closes every session. Sessions still leased are closed when they are checked in."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._reaper_stop.set()
+        self.close_idle()
+
+    # --- Introspection ---
+
+    def sessions(self) -> List[BrowserSession]:
+        with self._cond:
+            return list(self._sessions.values())
+
+    def stats(self):
+        with self._cond:
+            sessions = list(self._sessions.values())
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'reuse_sessions': self.reuse_sessions,
+                'idle_ttl': self.idle_ttl,
+                'size': len(sessions),
+                'idle': len(self._idle),
+                'in_use': sum(1 for s in sessions if s.in_use),
+                'waiting': self._waiting,
+                'sessions': [s.to_dict() for s in sessions],
+            }
@@ -1,6 +1,10 @@
 #!/bin/bash
 
-# This script minifies CSS and JavaScript files for production.
+# This script builds the frontend assets for production:
+#   1. minifies CSS and JavaScript into static/dist,
+#   2. gives them content-hashed file names (style.min.<hash>.css) so they can be cached forever,
+#   3. writes static/dist/index.html pointing at the hashed files, and static/dist/manifest.json,
+#   4. writes gzip (.gz) and brotli (.br) variants that the server sends pre-compressed.
 
 # Exit immediately if a command exits with a non-zero status.
 set -e
@@ -9,8 +13,9 @@ set -e
 STATIC_DIR="static"
 DIST_DIR="static/dist"
 
-# Create the destination directory if it doesn't exist
+# Create the destination directory if it doesn't exist, without assets of earlier builds
 mkdir -p "$DIST_DIR"
+rm -f "$DIST_DIR"/*.min.*.css* "$DIST_DIR"/*.min.*.js* "$DIST_DIR"/index.html* "$DIST_DIR"/manifest.json
 
 # Minify CSS
 echo "Minifying CSS..."
@@ -20,4 +25,28 @@ cleancss -o "$DIST_DIR/style.min.css" "$STATIC_DIR/style.css"
 echo "Minifying JavaScript..."
 uglifyjs "$STATIC_DIR/script.js" -o "$DIST_DIR/script.min.js" -c -m
 
-echo "✅ Frontend assets have been minified."
+# Fingerprint: copy each minified file to a name containing the hash of its content
+echo "Fingerprinting assets..."
+cp "$STATIC_DIR/index.html" "$DIST_DIR/index.html"
+manifest=""
+for asset in style.min.css script.min.js; do
+    hash=$(sha256sum "$DIST_DIR/$asset" | cut -c1-10)
+    hashed="${asset%.*}.$hash.${asset##*.}"
+    cp "$DIST_DIR/$asset" "$DIST_DIR/$hashed"
+    sed -i "s#dist/$asset#dist/$hashed#g" "$DIST_DIR/index.html"
+    manifest="$manifest${manifest:+, }\"dist/$asset\": \"dist/$hashed\""
+done
+echo "{\"files\": {$manifest}}" > "$DIST_DIR/manifest.json"
+
+# Pre-compress: the server picks the variant the browser accepts
+echo "Compressing assets..."
+for file in "$DIST_DIR"/*.min.*.css "$DIST_DIR"/*.min.*.js "$DIST_DIR/index.html"; do
+    gzip -9 -n -k -f "$file"
+    if command -v brotli > /dev/null; then
+        brotli -q 11 -k -f "$file"
+    else
+        echo "brotli not found; skipping .br for $file"
+    fi
+done
+
+echo "✅ Frontend assets have been minified, fingerprinted and compressed."
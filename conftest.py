@@ -0,0 +1,68 @@
+"""
+Shared test setup. Keeps test runs from writing to database/ (the app database, traces and the
+selector cache) and provides the fake browser steps used by the query endpoint tests.
+"""
+import os
+import tempfile
+import threading
+
+import pytest
+
+# Set before the app modules are imported, since the engine, the tracer and the selector cache read them at import.
+_scratch = tempfile.mkdtemp(prefix='notebooklm-tests-')
+# Always overridden: tests clear the answer cache and write history rows, which must never hit a real database.
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_scratch, 'app.db')}"
+os.environ.setdefault('TRACE_FILE', os.path.join(_scratch, 'traces.jsonl'))
+os.environ.setdefault('SELECTOR_CACHE_PATH', os.path.join(_scratch, 'selector_cache.json'))
+
+
+class FakeSession:
+    slot = 0
+
+    def __init__(self):
+        self.errors = []
+
+    def record_error(self, error):
+        self.errors.append(error)
+
+
+@pytest.fixture
+def fake_browser(monkeypatch):
+    """
+    Replaces the browser steps of the query jobs: navigation succeeds, each question answers with
+    its own text ("fail" gets an error). Answers wait for ``gate``, which is open unless a test
+    clears it. Yields the calls made: {'navigate': n, 'asked': [...], 'gate': threading.Event}.
+    """
+    import notebooklm
+    from main import app
+
+    calls = {'navigate': 0, 'asked': [], 'gate': threading.Event()}
+    calls['gate'].set()
+
+    def navigate(session, url):
+        calls['navigate'] += 1
+        yield {"status": "browser_ready"}
+        return True
+
+    def ask(session, query_text, timeout, stream_mode, inactivity_timeout):
+        calls['asked'].append(query_text)
+        if query_text == 'fail':
+            yield {"error": "NotebookLM did not start generating a response in time."}
+            return
+        yield {"status": "waiting_for_response"}
+        calls['gate'].wait(5)
+        yield {"status": "streaming"}
+        yield {"chunk": f"Answer to {query_text}"}
+        yield {"status": "complete", "completion_signal": "send_button_enabled"}
+
+    monkeypatch.setattr(notebooklm, '_navigate_events', navigate)
+    monkeypatch.setattr(notebooklm, '_ask_events', ask)
+    monkeypatch.setattr(notebooklm, '_lease_session', lambda: (FakeSession(), None))
+    monkeypatch.setattr(notebooklm.browser_pool, 'checkin', lambda session: True)
+    yield calls
+    # Let the jobs finish while the fakes are still in place.
+    calls['gate'].set()
+    for job in list(notebooklm.job_scheduler._jobs.values()):
+        job.wait(5)
+    with app.app_context():
+        notebooklm.answer_cache.clear()
@@ -0,0 +1,441 @@
+"""
+An offline stand-in for NotebookLM, for benchmarks and local runs without a Google session.
+
+- ``FakeNotebookDriver`` is a pure-Python WebDriver simulating a notebook page
+  (``WEBDRIVER_BACKEND=fake``). It answers the scripts sent by notebooklm.py, selector_lookup.py
+  and response_stream.py. It also counts every call that would be a WebDriver round trip.
+- ``FakeNotebookServer`` serves the same page as real HTML, with answers typed out in the browser,
+  for a local headless Chrome (``WEBDRIVER_BACKEND=local``). Run ``python fake_notebooklm.py`` and
+  use http://127.0.0.1:8765/notebooklm.google.com/notebook/<id> as the notebook URL. The app
+  recognises NotebookLM pages by URL substring, so this path takes the same code path as the real site.
+
+Both generate answers token by token. The first token arrives after ``first_token_delay`` seconds,
+the rest at ``tokens_per_second``, configured by ``GenerationProfile`` (FAKE_NOTEBOOKLM_* variables).
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import NoSuchElementException, NoSuchWindowException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+
+from response_stream import (DRAIN_OBSERVER_SCRIPT, INSTALL_COMPLETION_SCRIPT, INSTALL_OBSERVER_SCRIPT,
+                             READ_TEXT_DELTA_SCRIPT, REMOVE_OBSERVER_SCRIPT, WAIT_FOR_RESPONSE_SCRIPT)
+from selector_lookup import FIND_FIRST_MATCH_SCRIPT
+
+DEFAULT_PORT = 8765
+RESPONSE_SELECTOR = (By.CSS_SELECTOR, '.message-content')
+
+# Selectors the fake page satisfies, by element. They mirror the markup of FAKE_NOTEBOOK_HTML.
+PAGE_ELEMENTS = {
+    (By.CSS_SELECTOR, '[data-testid="chat-input"]'): 'input',
+    (By.XPATH, "//textarea[contains(@placeholder, 'Start typing')]"): 'input',
+    (By.CSS_SELECTOR, 'button[data-testid="send-button"]'): 'send',
+    (By.CSS_SELECTOR, 'button[aria-label*="Send"]'): 'send',
+    (By.CSS_SELECTOR, 'div[aria-label="Sources"]'): 'sources',
+}
+
+
+class GenerationProfile:
+    """How fast fake answers are generated."""
+
+    def __init__(self, first_token_delay: float = 0.3, tokens_per_second: float = 40, answer_tokens: int = 60):
+        self.first_token_delay = first_token_delay
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            first_token_delay=float(os.environ.get('FAKE_NOTEBOOKLM_FIRST_TOKEN_MS', 300)) / 1000,
+            tokens_per_second=float(os.environ.get('FAKE_NOTEBOOKLM_TOKENS_PER_SECOND', 40)),
+            answer_tokens=int(os.environ.get('FAKE_NOTEBOOKLM_ANSWER_TOKENS', 60))
+        )
+
+    def to_dict(self):
+        return {'first_token_ms': self.first_token_delay * 1000, 'tokens_per_second': self.tokens_per_second,
+                'answer_tokens': self.answer_tokens}
+
+
+class FakeAnswer:
+    """An answer whose text is a function of the time since the question was submitted."""
+
+    def __init__(self, question: str, profile: GenerationProfile):
+        self.question = question
+        self.profile = profile
+        self.started_at = time.monotonic()
+        self.tokens = [f"word{i} " for i in range(profile.answer_tokens)]
+
+    def tokens_emitted(self, now: Optional[float] = None) -> int:
+        elapsed = (now or time.monotonic()) - self.started_at - self.profile.first_token_delay
+        if elapsed < 0:
+            return 0
+        return min(len(self.tokens), 1 + int(elapsed * self.profile.tokens_per_second))
+
+    def text(self) -> str:
+        return ''.join(self.tokens[:self.tokens_emitted()])
+
+    def done(self) -> bool:
+        return self.tokens_emitted() >= len(self.tokens)
+
+    def next_token_at(self) -> float:
+        emitted = self.tokens_emitted()
+        return self.started_at + self.profile.first_token_delay + emitted / self.profile.tokens_per_second
+
+
+class FakeElement:
+
+    def __init__(self, driver: 'FakeNotebookDriver', kind: str, answer: Optional[FakeAnswer] = None):
+        self.driver = driver
+        self.kind = kind
+        self.answer = answer
+
+    @property
+    def text(self) -> str:
+        self.driver._round_trip('getElementText')
+        return self.answer.text() if self.answer else ''
+
+    def is_displayed(self) -> bool:
+        self.driver._round_trip('isElementDisplayed')
+        return True
+
+    def is_enabled(self) -> bool:
+        self.driver._round_trip('isElementEnabled')
+        return True
+
+    def clear(self):
+        self.driver._round_trip('clearElement')
+        self.driver._typed = ''
+
+    def send_keys(self, *values):
+        self.driver._round_trip('sendKeysToElement')
+        text = ''.join(values)
+        if Keys.RETURN in text:
+            self.driver._typed += text.replace(Keys.RETURN, '')
+            self.driver._submit()
+        else:
+            self.driver._typed += text
+
+    def click(self):
+        self.driver._round_trip('clickElement')
+        if self.kind == 'send':
+            self.driver._submit()
+
+
+class _FakeSwitchTo:
+
+    def __init__(self, driver: 'FakeNotebookDriver'):
+        self.driver = driver
+
+    def window(self, handle: str):
+        self.driver._round_trip('switchToWindow')
+        if handle not in self.driver._pages:
+            raise NoSuchWindowException(handle)
+        self.driver.current_window_handle = handle
+
+    def new_window(self, kind: str = 'tab'):
+        self.driver._round_trip('newWindow')
+        self.driver._window_count += 1
+        handle = f"tab-{self.driver._window_count}"
+        self.driver._pages[handle] = {'url': 'about:blank', 'answers': []}
+        self.driver.current_window_handle = handle
+
+
+class FakeNotebookDriver:
+    """
+    A pure-Python WebDriver showing a fake NotebookLM notebook in each tab.
+
+    ``round_trips`` counts the calls a remote WebDriver would send to the browser, by command.
+    Each call sleeps for ``latency`` seconds to model the hub round trip.
+    """
+
+    def __init__(self, profile: Optional[GenerationProfile] = None, latency: float = 0.0):
+        self.profile = profile or GenerationProfile()
+        self.latency = latency
+        self.round_trips = Counter()
+        self._pages = {'tab-0': {'url': 'about:blank', 'answers': []}}
+        self._window_count = 0
+        self.current_window_handle = 'tab-0'
+        self.switch_to = _FakeSwitchTo(self)
+        self._typed = ''
+        self._completion = None
+        self._observer = None
+
+    @classmethod
+    def from_env(cls, slot: int = 0):
+        return cls(GenerationProfile.from_env(), float(os.environ.get('FAKE_WEBDRIVER_LATENCY_MS', 0)) / 1000)
+
+    def _round_trip(self, command: str):
+        self.round_trips[command] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def _page(self):
+        return self._pages[self.current_window_handle]
+
+    def _answers(self) -> List[FakeAnswer]:
+        return self._page['answers']
+
+    def _submit(self):
+        self._answers().append(FakeAnswer(self._typed, self.profile))
+        self._typed = ''
+
+    def _match(self, by: str, value: str) -> List[FakeElement]:
+        if (by, value) == RESPONSE_SELECTOR:
+            return [FakeElement(self, 'response', answer) for answer in self._answers()]
+        kind = PAGE_ELEMENTS.get((by, value))
+        return [FakeElement(self, kind)] if kind and self._page['url'] != 'about:blank' else []
+
+    # --- WebDriver API ---
+
+    @property
+    def current_url(self) -> str:
+        self._round_trip('getCurrentUrl')
+        return self._page['url']
+
+    @property
+    def window_handles(self) -> List[str]:
+        self._round_trip('getWindowHandles')
+        return list(self._pages)
+
+    def get(self, url: str):
+        self._round_trip('get')
+        self._pages[self.current_window_handle] = {'url': url, 'answers': []}
+
+    def find_elements(self, by=By.ID, value=None) -> List[FakeElement]:
+        self._round_trip('findElements')
+        return self._match(by, value)
+
+    def find_element(self, by=By.ID, value=None) -> FakeElement:
+        self._round_trip('findElement')
+        matches = self._match(by, value)
+        if not matches:
+            raise NoSuchElementException(f"{by}={value}")
+        return matches[0]
+
+    def set_page_load_timeout(self, seconds: float):
+        self._round_trip('setTimeouts')
+
+    def close(self):
+        self._round_trip('closeWindow')
+        del self._pages[self.current_window_handle]
+
+    def quit(self):
+        self._round_trip('quit')
+
+    def execute_script(self, script: str, *args):
+        self._round_trip('executeScript')
+        if script == FIND_FIRST_MATCH_SCRIPT:
+            selectors, _clickable = args
+            for index, (by, value) in enumerate(selectors):
+                matches = self._match(by, value)
+                if matches:
+                    return [matches[0], index]
+            return None
+        if script == INSTALL_COMPLETION_SCRIPT:
+            generating, finished = args
+            self._completion = {
+                'stop': next((name for name, css in generating if 'Stop' in css), None),
+                'copy': next((name for name, css in finished if 'Copy' in css), None),
+                'baseline': sum(1 for answer in self._answers() if answer.done()),
+                'seen': False,
+            }
+            self._check_completion()
+            return True
+        if script == INSTALL_OBSERVER_SCRIPT:
+            self._observer = {'sent': 0}
+            return True
+        if script == READ_TEXT_DELTA_SCRIPT:
+            _element, _selector, offset = args
+            answers = self._answers()
+            if not answers:
+                return None
+            text = answers[-1].text()
+            return {'delta': text[offset:], 'length': len(text),
+                    'element': FakeElement(self, 'response', answers[-1]), 'done': self._check_completion()}
+        if script == REMOVE_OBSERVER_SCRIPT:
+            self._observer = None
+            self._completion = None
+            return None
+        return None
+
+    def execute_async_script(self, script: str, *args):
+        self._round_trip('executeAsyncScript')
+        if script == WAIT_FOR_RESPONSE_SCRIPT:
+            return self._wait_for_response(*args[1:3])
+        if script != DRAIN_OBSERVER_SCRIPT:
+            return None
+        if self._observer is None:
+            return None
+        wait_ms, known_signal = args[0], args[1]
+        deadline = time.monotonic() + wait_ms / 1000
+        while True:
+            answers = self._answers()
+            text = answers[-1].text() if answers else ''
+            signal = self._check_completion()
+            if len(text) > self._observer['sent']:
+                delta = text[self._observer['sent']:]
+                self._observer['sent'] = len(text)
+                return {'delta': delta, 'done': signal}
+            if (signal and signal != known_signal) or time.monotonic() >= deadline:
+                return {'delta': '', 'done': signal}
+            wake_at = min(deadline, answers[-1].next_token_at() if answers and not answers[-1].done() else deadline)
+            time.sleep(max(0.001, wake_at - time.monotonic()))
+
+    def _wait_for_response(self, initial_count: int, wait_ms: int) -> Optional[FakeElement]:
+        deadline = time.monotonic() + wait_ms / 1000
+        while True:
+            answers = self._answers()
+            if len(answers) > initial_count:
+                answer = answers[-1]
+                if answer.text().strip():
+                    return FakeElement(self, 'response', answer)
+                wake_at = min(deadline, answer.next_token_at())
+            else:
+                wake_at = min(deadline, time.monotonic() + 0.01)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(max(0.001, wake_at - time.monotonic()))
+
+    def _check_completion(self) -> Optional[str]:
+        """The page's completion signal, as INSTALL_COMPLETION_SCRIPT's check() would report it."""
+        state = self._completion
+        if state is None:
+            return None
+        answers = self._answers()
+        if answers and not answers[-1].done():
+            state['seen'] = True
+            return None
+        if state['seen'] and state['stop']:
+            return f"{state['stop']}_gone"
+        if state['copy'] and sum(1 for answer in answers if answer.done()) > state['baseline']:
+            return state['copy']
+        return None
+
+
+# --- The same notebook as an HTML page, for a real (headless) Chrome ---
+
+FAKE_NOTEBOOK_HTML = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Fake NotebookLM</title></head>
+<body>
+<div aria-label="Sources">Fake sources</div>
+<div id="chat"></div>
+<textarea data-testid="chat-input" placeholder="Start typing..."></textarea>
+<button data-testid="send-button" aria-label="Send">Send</button>
+<script>
+var profile = __PROFILE__;
+var params = new URLSearchParams(location.search);
+['first_token_ms', 'tokens_per_second', 'answer_tokens'].forEach(function (key) {
+    if (params.has(key)) { profile[key] = Number(params.get(key)); }
+});
+var input = document.querySelector('[data-testid="chat-input"]');
+function ask() {
+    var chat = document.getElementById('chat');
+    var question = document.createElement('div');
+    question.className = 'question';
+    question.textContent = input.value;
+    chat.appendChild(question);
+    input.value = '';
+    var answer = document.createElement('div');
+    answer.className = 'message-content';
+    chat.appendChild(answer);
+    var stop = document.createElement('button');
+    stop.setAttribute('aria-label', 'Stop');
+    stop.textContent = 'Stop';
+    chat.appendChild(stop);
+    var emitted = 0;
+    function emit() {
+        answer.textContent += 'word' + emitted + ' ';
+        emitted += 1;
+        if (emitted < profile.answer_tokens) {
+            setTimeout(emit, 1000 / profile.tokens_per_second);
+        } else {
+            stop.remove();
+            var copy = document.createElement('button');
+            copy.setAttribute('aria-label', 'Copy');
+            copy.textContent = 'Copy';
+            chat.appendChild(copy);
+        }
+    }
+    setTimeout(emit, profile.first_token_ms);
+}
+document.querySelector('[data-testid="send-button"]').addEventListener('click', ask);
+input.addEventListener('keydown', function (e) {
+    if (e.key === 'Enter') { e.preventDefault(); ask(); }
+});
+</script>
+</body>
+</html>
+"""
+
+
+def render_page(profile: GenerationProfile) -> str:
+    return FAKE_NOTEBOOK_HTML.replace('__PROFILE__', json.dumps(profile.to_dict()))
+
+
+class _PageHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/favicon.ico':
+            self.send_error(404)
+            return
+        body = render_page(self.server.profile).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeNotebookServer(ThreadingHTTPServer):
+    """Serves the fake notebook page on every path. Per-request overrides go in the query string."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT, profile: Optional[GenerationProfile] = None):
+        self.profile = profile or GenerationProfile.from_env()
+        super().__init__((host, port), _PageHandler)
+
+    def notebook_url(self, notebook_id: str = 'bench') -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/notebooklm.google.com/notebook/{notebook_id}"
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name='fake-notebooklm', daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake NotebookLM notebook page.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--first-token-ms', type=float, default=300)
+    parser.add_argument('--tokens-per-second', type=float, default=40)
+    parser.add_argument('--answer-tokens', type=int, default=60)
+    args = parser.parse_args()
+    profile = GenerationProfile(args.first_token_ms / 1000, args.tokens_per_second, args.answer_tokens)
+    server = FakeNotebookServer(args.host, args.port, profile)
+    print(f"Fake NotebookLM notebook at {server.notebook_url()}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
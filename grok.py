@@ -1,35 +1,350 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tracing import tracer
 
 grok_bp = Blueprint('grok', __name__)
 
+GROK_API_URL = os.environ.get('GROK_API_URL', 'https://api.x.ai/v1/chat/completions')
+# Seconds to establish the connection, and to wait between bytes of the response.
+GROK_CONNECT_TIMEOUT = float(os.environ.get('GROK_CONNECT_TIMEOUT', 5))
+GROK_READ_TIMEOUT = float(os.environ.get('GROK_READ_TIMEOUT', 120))
+# Connection failures are retried; a request that reached the upstream is never resent.
+GROK_CONNECT_RETRIES = int(os.environ.get('GROK_CONNECT_RETRIES', 2))
+GROK_POOL_SIZE = int(os.environ.get('GROK_POOL_SIZE', 10))
+# Most completions /grok/batch runs at once, and the most it accepts per call.
+GROK_BATCH_CONCURRENCY = int(os.environ.get('GROK_BATCH_CONCURRENCY', 8))
+GROK_BATCH_MAX_REQUESTS = int(os.environ.get('GROK_BATCH_MAX_REQUESTS', 100))
+
+# Filter out CORS headers from the upstream response to avoid conflicts
+EXCLUDED_HEADERS = ['content-encoding', 'content-length', 'transfer-encoding', 'connection', 'access-control-allow-origin', 'access-control-allow-methods', 'access-control-allow-headers']
+
+class GrokResponseCache:
+    """
+    In-memory cache of complete upstream responses, keyed on a canonical hash of the request
+    JSON and scoped per Authorization credential, so one key's answers are never served to another.
+
+    Only deterministic requests are cached (see ``is_cacheable``). Entries expire after ``ttl``
+    seconds; the least recently used are evicted beyond ``max_entries`` or ``max_bytes``.
+    """
+
+    def __init__(self, enabled=False, ttl=3600, max_entries=500, max_bytes=50 * 1024 * 1024):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.environ.get('GROK_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+            ttl=float(os.environ.get('GROK_CACHE_TTL', 3600)),
+            max_entries=int(os.environ.get('GROK_CACHE_MAX_ENTRIES', 500)),
+            max_bytes=int(os.environ.get('GROK_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+        )
+
+    @staticmethod
+    def is_cacheable(data):
+        """
+        Deterministic requests only: an explicit temperature of 0, a single choice and no
+        streaming. Without a temperature the upstream samples, so the request is bypassed.
+        """
+        if not isinstance(data, dict) or data.get('stream'):
+            return False
+        return data.get('temperature') == 0 and data.get('n', 1) == 1
+
+    @staticmethod
+    def key(data, auth_header):
+        """Canonical hash of the request JSON (model, messages, parameters) plus the credential."""
+        canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        scope = hashlib.sha256(auth_header.encode('utf-8')).hexdigest()
+        return hashlib.sha256(f"{scope}:{canonical}".encode('utf-8')).hexdigest()
+
+    def count_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def get(self, key):
+        """Returns (content, status_code, headers) or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry['stored_at'] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['content'], entry['status_code'], entry['headers']
+
+    def put(self, key, content, status_code, headers):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {'content': content, 'status_code': status_code, 'headers': headers,
+                                  'stored_at': time.time()}
+            self._bytes += len(content)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        """Caller holds the lock."""
+        self._bytes -= len(self._entries.pop(key)['content'])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0
+            }
+
+grok_cache = GrokResponseCache.from_env()
+
+def _build_session():
+    """A keep-alive session, so calls reuse pooled TCP+TLS connections to the upstream."""
+    session = requests.Session()
+    retry = Retry(total=GROK_CONNECT_RETRIES, connect=GROK_CONNECT_RETRIES, read=0, status=0, other=0,
+                  backoff_factor=0.2, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GROK_POOL_SIZE, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+grok_session = _build_session()
+
+def _passthrough_headers(response):
+    return [(k, v) for k, v in response.headers.items() if k.lower() not in EXCLUDED_HEADERS]
+
+def _stream_upstream(response, trace=None):
+    """
+    Relays the upstream body as it arrives, and returns the connection to the pool at the end.
+    The request's trace, if any, is finished once the body has been relayed.
+    """
+    chunks = 0
+    status = 'cancelled'
+    try:
+        with tracer.activate(trace), tracer.span('grok.stream'):
+            for chunk in response.iter_content(chunk_size=None):
+                if chunk:
+                    chunks += 1
+                    yield chunk
+        status = 'ok'
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Grok stream interrupted: {e}")
+        status = 'error'
+    finally:
+        response.close()
+        tracer.finish(trace, status=status, chunks=chunks)
+
+def _post_upstream(data, auth_header, stream=False, read_timeout=GROK_READ_TIMEOUT):
+    return grok_session.post(
+        GROK_API_URL,
+        json=data,
+        headers={
+            'Content-Type': 'application/json',
+            'Authorization': auth_header
+        },
+        timeout=(GROK_CONNECT_TIMEOUT, read_timeout),
+        stream=stream
+    )
+
+def _complete(data, auth_header, read_timeout=GROK_READ_TIMEOUT, refresh=False):
+    """
+    A buffered completion, answered from the cache when possible.
+    Returns (content, status_code, headers, cache_status); cache_status is 'HIT', 'MISS',
+    or None for requests that are not cached. ``refresh`` skips the lookup but stores the result.
+    """
+    cache_key = None
+    if grok_cache.enabled:
+        if grok_cache.is_cacheable(data):
+            cache_key = grok_cache.key(data, auth_header)
+            if not refresh:
+                with tracer.span('grok.cache_lookup'):
+                    cached = grok_cache.get(cache_key)
+                if cached:
+                    content, status_code, headers = cached
+                    return content, status_code, headers, 'HIT'
+        else:
+            grok_cache.count_bypass()
+
+    with tracer.span('grok.upstream'):
+        response = _post_upstream(data, auth_header, read_timeout=read_timeout)
+    headers = _passthrough_headers(response)
+    if cache_key and response.status_code == 200:
+        grok_cache.put(cache_key, response.content, response.status_code, headers)
+    return response.content, response.status_code, headers, 'MISS' if cache_key else None
+
 @grok_bp.route('/grok', methods=['POST', 'OPTIONS'])
 def proxy_grok():
     if request.method == 'OPTIONS':
         return jsonify({'status': 'ok'}), 200
 
+    trace = None
     try:
         data = request.json
         auth_header = request.headers.get('Authorization')
-        
+
         if not auth_header:
             return jsonify({"error": "Missing Authorization header"}), 401
 
-        response = requests.post(
-            'https://api.x.ai/v1/chat/completions',
-            json=data,
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': auth_header
-            }
-        )
-        
-        # Filter out CORS headers from the upstream response to avoid conflicts
-        excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection', 'access-control-allow-origin', 'access-control-allow-methods', 'access-control-allow-headers']
-        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in excluded_headers]
+        # The trace ID is returned in X-Trace-Id, for GET /api/debug/trace/<id>.
+        stream = isinstance(data, dict) and data.get('stream') is True
+        trace = tracer.start_trace('grok', model=data.get('model') if isinstance(data, dict) else None,
+                                   stream=stream)
+        trace_headers = [('X-Trace-Id', trace.id)] if trace else []
+
+        with tracer.activate(trace):
+            # With "stream": true the upstream answers with SSE; pass it through chunk by chunk.
+            if stream:
+                if grok_cache.enabled:
+                    grok_cache.count_bypass()
+                with tracer.span('grok.upstream_connect'):
+                    response = _post_upstream(data, auth_header, stream=True)
+                headers = _passthrough_headers(response) + trace_headers
+                # Ask a fronting proxy (e.g. Nginx) not to buffer the stream either.
+                headers.append(('X-Accel-Buffering', 'no'))
+                return Response(stream_with_context(_stream_upstream(response, trace)), status=response.status_code,
+                                headers=headers)
 
-        return (response.content, response.status_code, headers)
+            # Deterministic requests can be answered from the cache; "Cache-Control: no-cache" skips the lookup.
+            refresh = 'no-cache' in request.headers.get('Cache-Control', '')
+            content, status_code, headers, cache_status = _complete(data, auth_header, refresh=refresh)
+        tracer.finish(trace, status_code=status_code, cache=cache_status)
+        if cache_status:
+            headers = headers + [('X-Cache', cache_status)]
+        return (content, status_code, headers + trace_headers)
+    except requests.exceptions.Timeout as e:
+        logging.error(f"Grok proxy timeout: {e}")
+        tracer.finish(trace, status='error', error=str(e))
+        return jsonify({"error": f"Grok API timed out: {e}"}), 504
+    except requests.exceptions.ConnectionError as e:
+        logging.error(f"Grok proxy connection error: {e}")
+        tracer.finish(trace, status='error', error=str(e))
+        return jsonify({"error": f"Could not connect to Grok API: {e}"}), 502
     except Exception as e:
         logging.error(f"Grok proxy error: {e}")
+        tracer.finish(trace, status='error', error=str(e))
         return jsonify({"error": str(e)}), 500
+
+def _batch_item(index, data, auth_header, read_timeout):
+    """Runs one completion of a batch; failures are reported in the result instead of raised."""
+    started = time.time()
+    result = {'index': index}
+    try:
+        content, status_code, headers, cache_status = _complete(data, auth_header, read_timeout=read_timeout)
+        result['status_code'] = status_code
+        try:
+            result['response'] = json.loads(content)
+        except ValueError:
+            result['response'] = content.decode('utf-8', errors='replace')
+        if cache_status:
+            result['cache'] = cache_status
+    except requests.exceptions.Timeout as e:
+        result.update(status_code=504, error=f"Grok API timed out: {e}")
+    except requests.exceptions.ConnectionError as e:
+        result.update(status_code=502, error=f"Could not connect to Grok API: {e}")
+    except Exception as e:
+        logging.error(f"Grok batch item {index} failed: {e}")
+        result.update(status_code=500, error=str(e))
+    result['elapsed_seconds'] = time.time() - started
+    return result
+
+@grok_bp.route('/grok/batch', methods=['POST'])
+def proxy_grok_batch():
+    """
+    Runs several completion requests concurrently against the upstream.
+    Body: {"requests": [...], "max_concurrency": n, "timeout": seconds, "stream_results": bool}.
+    "max_concurrency" is capped at GROK_BATCH_CONCURRENCY. "timeout" is the read timeout of each
+    upstream call, i.e. the longest wait for the next bytes of a response (at most GROK_READ_TIMEOUT),
+    not a deadline for the whole request.
+    Returns {"results": [...]} in input order, or with "stream_results": true streams NDJSON
+    records as they finish. Each result carries its index, status_code and response (or error).
+    """
+    data = request.json
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+    items = (data or {}).get('requests')
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        return jsonify({"error": '"requests" must be a non-empty list of completion requests'}), 400
+    if len(items) > GROK_BATCH_MAX_REQUESTS:
+        return jsonify({"error": f"At most {GROK_BATCH_MAX_REQUESTS} requests are allowed per batch"}), 400
+    if any(item.get('stream') for item in items):
+        return jsonify({"error": 'Batch requests cannot use "stream": true'}), 400
+
+    try:
+        concurrency = int(data.get('max_concurrency', GROK_BATCH_CONCURRENCY))
+        read_timeout = float(data.get('timeout', GROK_READ_TIMEOUT))
+    except (TypeError, ValueError):
+        return jsonify({"error": '"max_concurrency" and "timeout" must be numbers'}), 400
+    if concurrency < 1 or not read_timeout > 0:
+        return jsonify({"error": '"max_concurrency" and "timeout" must be positive'}), 400
+    concurrency = min(concurrency, GROK_BATCH_CONCURRENCY, len(items))
+    read_timeout = min(read_timeout, GROK_READ_TIMEOUT)
+    started = time.time()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='grok-batch')
+    futures = [executor.submit(_batch_item, index, item, auth_header, read_timeout)
+               for index, item in enumerate(items)]
+
+    if data.get('stream_results'):
+        def generate():
+            try:
+                for future in as_completed(futures):
+                    yield json.dumps(future.result()) + '\n'
+            finally:
+                # Stop queued calls if the client went away.
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        results = [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return jsonify({'results': results, 'elapsed_seconds': time.time() - started})
+
+@grok_bp.route('/grok/cache', methods=['GET'])
+def grok_cache_stats():
+    """Hit/miss counters and size of the Grok response cache."""
+    return jsonify(grok_cache.stats())
+
+@grok_bp.route('/grok/cache', methods=['DELETE'])
+def clear_grok_cache():
+    grok_cache.clear()
+    return jsonify({'success': True})
@@ -0,0 +1,410 @@
+"""
+Load generator for the streaming endpoints: /api/process_query, /api/query_notebooklm and /api/grok.
+
+Requests follow an arrival pattern:
+
+- ``closed``: ``--concurrency`` clients each send their next request when the previous one ends.
+- ``constant``: ``--rate`` requests per second, evenly spaced.
+- ``poisson``: ``--rate`` requests per second on average, with exponential gaps.
+- ``burst``: ``--burst-size`` requests at once, every ``--burst-size / --rate`` seconds.
+
+In the open patterns at most ``--concurrency`` requests are in flight. Latencies are measured
+from the scheduled arrival time, so time spent waiting for a free client counts too.
+The SSE events are parsed as they arrive. The summary is printed as JSON: throughput, error and
+timeout rates, and p50/p95/p99 of the time to first chunk and to completion, per endpoint and overall.
+
+``--offline`` runs everything in this process: the app is served on a free local port,
+with the fake NotebookLM WebDriver (fake_notebooklm.py) and a stub Grok API.
+
+    python loadtest.py --offline --endpoint process_query --endpoint grok --concurrency 4 --requests 40
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import threading
+import itertools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional
+
+import requests
+
+from fake_notebooklm import GenerationProfile
+
+ENDPOINT_PATHS = {
+    'process_query': '/api/process_query',
+    'query_notebooklm': '/api/query_notebooklm',
+    'grok': '/api/grok',
+}
+ARRIVAL_PATTERNS = ('closed', 'constant', 'poisson', 'burst')
+DEFAULT_NOTEBOOK_URL = 'https://notebooklm.google.com/notebook/loadtest'
+
+OUTCOME_OK = 'ok'
+OUTCOME_ERROR = 'error'
+OUTCOME_TIMEOUT = 'timeout'
+
+
+# --- Arrival patterns ---
+
+def arrival_offsets(pattern: str, count: int, rate: float, burst_size: int = 10,
+                    rng: Optional[random.Random] = None) -> Iterator[float]:
+    """Seconds from the start at which each of ``count`` requests is sent (open patterns only)."""
+    rng = rng or random.Random()
+    offset = 0.0
+    for n in range(count):
+        if pattern == 'constant':
+            offset = n / rate
+        elif pattern == 'poisson':
+            offset += rng.expovariate(rate) if n else 0.0
+        elif pattern == 'burst':
+            offset = (n // burst_size) * burst_size / rate
+        else:
+            raise ValueError(f"Not an open arrival pattern: {pattern}")
+        yield offset
+
+
+# --- Requests ---
+
+class Result:
+
+    __slots__ = ('endpoint', 'outcome', 'error', 'first_chunk', 'completion', 'chunks')
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.outcome = OUTCOME_ERROR
+        self.error = None
+        self.first_chunk = None
+        self.completion = None
+        self.chunks = 0
+
+
+def iter_sse_data(lines: Iterator[str]) -> Iterator[str]:
+    """The ``data:`` payloads of an SSE stream, one per event (multi-line data is joined)."""
+    data = []
+    for line in lines:
+        if line.startswith('data:'):
+            data.append(line[5:].lstrip(' '))
+        elif not line and data:
+            yield '\n'.join(data)
+            data = []
+    if data:
+        yield '\n'.join(data)
+
+
+def _notebook_event(result: Result, payload: str) -> bool:
+    """Applies one /process_query or /query_notebooklm event; True once the stream is finished."""
+    event = json.loads(payload)
+    if 'chunk' in event:
+        result.chunks += 1
+        return False
+    if 'error' in event:
+        result.outcome, result.error = OUTCOME_ERROR, event['error']
+        return True
+    if event.get('status') == 'complete':
+        result.outcome = OUTCOME_OK
+        return True
+    if event.get('status') == 'timeout':
+        result.outcome, result.error = OUTCOME_TIMEOUT, 'NotebookLM answer timed out'
+        return True
+    return False
+
+
+def _grok_event(result: Result, payload: str) -> bool:
+    """Applies one OpenAI-style streaming event relayed by /grok; True at ``[DONE]``."""
+    if payload.strip() == '[DONE]':
+        result.outcome = OUTCOME_OK
+        return True
+    event = json.loads(payload)
+    if 'error' in event:
+        result.outcome, result.error = OUTCOME_ERROR, str(event['error'])
+        return True
+    if any((choice.get('delta') or {}).get('content') for choice in event.get('choices', [])):
+        result.chunks += 1
+    return False
+
+
+class LoadTest:
+
+    def __init__(self, base_url: str, endpoints: List[str], concurrency: int = 4, requests_count: int = 20,
+                 pattern: str = 'closed', rate: float = 1.0, burst_size: int = 10, timeout: float = 120,
+                 notebook_url: str = DEFAULT_NOTEBOOK_URL, query: str = 'Load test question {n}',
+                 bypass_cache: bool = True, grok_key: str = 'loadtest', grok_model: str = 'grok-3-mini',
+                 seed: Optional[int] = None):
+        self.base_url = base_url.rstrip('/')
+        self.endpoints = endpoints
+        self.concurrency = concurrency
+        self.requests_count = requests_count
+        self.pattern = pattern
+        self.rate = rate
+        self.burst_size = burst_size
+        self.timeout = timeout
+        self.notebook_url = notebook_url
+        self.query = query
+        self.bypass_cache = bypass_cache
+        self.grok_key = grok_key
+        self.grok_model = grok_model
+        self.seed = seed
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        """One keep-alive session per client thread; sessions are not shared between threads."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _request(self, endpoint: str, n: int):
+        question = self.query.format(n=n)
+        if endpoint == 'grok':
+            return {
+                'json': {'model': self.grok_model, 'stream': True,
+                         'messages': [{'role': 'user', 'content': question}]},
+                'headers': {'Authorization': f'Bearer {self.grok_key}'} if self.grok_key else {}
+            }, _grok_event
+        return {
+            'json': {'notebooklm_url': self.notebook_url, 'query': question, 'bypass_cache': self.bypass_cache,
+                     'client_id': f'loadtest-{n}'}
+        }, _notebook_event
+
+    def run_one(self, endpoint: str, n: int, scheduled_at: Optional[float] = None) -> Result:
+        """Sends request ``n`` and follows its stream. Times are measured from ``scheduled_at``."""
+        start = scheduled_at or time.monotonic()
+        deadline = start + self.timeout
+        result = Result(endpoint)
+        kwargs, apply_event = self._request(endpoint, n)
+        try:
+            with self._session().post(self.base_url + ENDPOINT_PATHS[endpoint], stream=True,
+                                      timeout=(5, self.timeout), **kwargs) as response:
+                if response.status_code != 200:
+                    result.error = f'HTTP {response.status_code}: {response.text[:200]}'
+                    return result
+                result.error = 'Stream ended before completion'
+                for payload in iter_sse_data(response.iter_lines(decode_unicode=True)):
+                    chunks = result.chunks
+                    finished = apply_event(result, payload)
+                    if result.chunks > chunks and result.first_chunk is None:
+                        result.first_chunk = time.monotonic() - start
+                    if finished:
+                        break
+                    if time.monotonic() > deadline:
+                        result.outcome, result.error = OUTCOME_TIMEOUT, f'No completion within {self.timeout}s'
+                        break
+        except requests.exceptions.Timeout as e:
+            result.outcome, result.error = OUTCOME_TIMEOUT, str(e)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            result.outcome, result.error = OUTCOME_ERROR, str(e)
+        if result.outcome == OUTCOME_OK:
+            result.error = None
+            result.completion = time.monotonic() - start
+        return result
+
+    def run(self) -> dict:
+        rng = random.Random(self.seed)
+        targets = itertools.cycle(self.endpoints)
+        plan = [(n, next(targets)) for n in range(self.requests_count)]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='loadtest') as pool:
+            if self.pattern == 'closed':
+                # Requests are handed out in order, so each worker sends its next one when free.
+                futures = [pool.submit(self.run_one, endpoint, n) for n, endpoint in plan]
+            else:
+                futures = []
+                offsets = arrival_offsets(self.pattern, self.requests_count, self.rate, self.burst_size, rng)
+                for (n, endpoint), offset in zip(plan, offsets):
+                    scheduled_at = started + offset
+                    time.sleep(max(0.0, scheduled_at - time.monotonic()))
+                    futures.append(pool.submit(self.run_one, endpoint, n, scheduled_at))
+            results = [future.result() for future in futures]
+        return summarize(results, time.monotonic() - started, self.config())
+
+    def config(self) -> dict:
+        return {
+            'base_url': self.base_url,
+            'endpoints': self.endpoints,
+            'pattern': self.pattern,
+            'concurrency': self.concurrency,
+            'requests': self.requests_count,
+            'rate': None if self.pattern == 'closed' else self.rate,
+            'timeout': self.timeout
+        }
+
+
+# --- Summary ---
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (``q`` in 0-100) of ``values``; None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _latency(values: List[float]) -> dict:
+    summary = {f'p{q}': percentile(values, q) for q in (50, 95, 99)}
+    summary['max'] = max(values) if values else None
+    return {key: round(value, 4) if value is not None else None for key, value in summary.items()}
+
+
+def _summarize_group(results: List[Result], duration: float) -> dict:
+    outcomes = Counter(result.outcome for result in results)
+    total = len(results)
+    errors = Counter(result.error for result in results if result.error)
+    return {
+        'requests': total,
+        'completed': outcomes[OUTCOME_OK],
+        'errors': outcomes[OUTCOME_ERROR],
+        'timeouts': outcomes[OUTCOME_TIMEOUT],
+        'error_rate': round(outcomes[OUTCOME_ERROR] / total, 4) if total else 0,
+        'timeout_rate': round(outcomes[OUTCOME_TIMEOUT] / total, 4) if total else 0,
+        'throughput_rps': round(outcomes[OUTCOME_OK] / duration, 4) if duration else 0,
+        'first_chunk_seconds': _latency([r.first_chunk for r in results if r.first_chunk is not None]),
+        'completion_seconds': _latency([r.completion for r in results if r.completion is not None]),
+        'top_errors': [{'error': error, 'count': count} for error, count in errors.most_common(5)]
+    }
+
+
+def summarize(results: List[Result], duration: float, config: Optional[dict] = None) -> dict:
+    endpoints = {}
+    for result in results:
+        endpoints.setdefault(result.endpoint, []).append(result)
+    return {
+        'config': config or {},
+        'duration_seconds': round(duration, 3),
+        'overall': _summarize_group(results, duration),
+        'endpoints': {name: _summarize_group(group, duration) for name, group in endpoints.items()}
+    }
+
+
+# --- Offline backend ---
+
+class _StubGrokHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        profile = self.server.profile
+        words = [f"word{i} " for i in range(profile.answer_tokens)]
+        if not body.get('stream'):
+            self._send_json({'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(words)}}]})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            time.sleep(profile.first_token_delay)
+            for word in words:
+                self._write_chunk(f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': word}}]})}\n\n")
+                time.sleep(1 / profile.tokens_per_second)
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (e.g. a load-test timeout).
+            self.close_connection = True
+
+    def _write_chunk(self, text: str):
+        data = text.encode('utf-8')
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _send_json(self, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubGrokServer(ThreadingHTTPServer):
+    """A chat completions API that streams a fixed answer at the rate of a GenerationProfile."""
+
+    daemon_threads = True
+
+    def __init__(self, profile: GenerationProfile, host: str = '127.0.0.1', port: int = 0):
+        self.profile = profile
+        super().__init__((host, port), _StubGrokHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='stub-grok', daemon=True).start()
+        return self
+
+
+def start_offline_backend(profile: GenerationProfile) -> str:
+    """
+    Serves the app on a free local port with the fake NotebookLM WebDriver and a stub Grok API.
+    Environment defaults are set before the app is imported; returns the app's base URL.
+    """
+    from werkzeug.serving import make_server
+
+    os.environ['WEBDRIVER_BACKEND'] = 'fake'
+    scratch = tempfile.mkdtemp(prefix='notebooklm-loadtest-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(scratch, 'app.db')}")
+    os.environ.setdefault('TRACE_FILE', os.path.join(scratch, 'traces.jsonl'))
+    os.environ.setdefault('SELECTOR_CACHE_PATH', os.path.join(scratch, 'selector_cache.json'))
+    import grok
+    from main import app
+
+    grok.GROK_API_URL = StubGrokServer(profile).start().url
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='loadtest-app', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the streaming endpoints and print a JSON summary.")
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--endpoint', action='append', choices=sorted(ENDPOINT_PATHS),
+                        help="Endpoint to load; repeat to mix endpoints (default: process_query).")
+    parser.add_argument('--concurrency', type=int, default=4, help="Most requests in flight.")
+    parser.add_argument('--requests', type=int, default=20, help="Total requests to send.")
+    parser.add_argument('--arrival', choices=ARRIVAL_PATTERNS, default='closed')
+    parser.add_argument('--rate', type=float, default=1.0, help="Requests per second for open arrival patterns.")
+    parser.add_argument('--burst-size', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=120, help="Seconds before a request counts as timed out.")
+    parser.add_argument('--notebooklm-url', default=DEFAULT_NOTEBOOK_URL)
+    parser.add_argument('--query', default='Load test question {n}', help="Query text; {n} is the request number.")
+    parser.add_argument('--use-cache', action='store_true', help="Allow answers from the answer cache.")
+    parser.add_argument('--grok-key', default=os.environ.get('GROK_API_KEY', 'loadtest'))
+    parser.add_argument('--grok-model', default='grok-3-mini')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--offline', action='store_true',
+                        help="Serve the app in this process against the fake NotebookLM and a stub Grok API.")
+    parser.add_argument('--output', help="Also write the JSON summary to this file.")
+    args = parser.parse_args(argv)
+
+    base_url = args.base_url
+    if args.offline:
+        base_url = start_offline_backend(GenerationProfile.from_env())
+    load_test = LoadTest(base_url, args.endpoint or ['process_query'], concurrency=args.concurrency,
+                         requests_count=args.requests, pattern=args.arrival, rate=args.rate,
+                         burst_size=args.burst_size, timeout=args.timeout, notebook_url=args.notebooklm_url,
+                         query=args.query, bypass_cache=not args.use_cache, grok_key=args.grok_key,
+                         grok_model=args.grok_model, seed=args.seed)
+    summary = load_test.run()
+    output = json.dumps(summary, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    return 0 if summary['overall']['completed'] == summary['overall']['requests'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
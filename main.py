@@ -2,12 +2,16 @@ import os
 import threading
 import signal
 import logging
-from flask import Flask, send_from_directory
+from flask import Flask, request
 from flask_cors import CORS
 from models import db
+from db_config import init_db
 from user import user_bp
-from notebooklm import notebooklm_bp, browser_instance, browser_lock, start_browser_initialization_thread
+from notebooklm import (notebooklm_bp, browser_pool, job_scheduler, answer_cache, query_history,
+                        start_browser_initialization_thread)
 from grok import grok_bp
+from metrics import metrics_bp
+from static_assets import StaticAssets
 
 # Configure logging for the application
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -31,28 +35,31 @@ else:
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(notebooklm_bp, url_prefix='/api')
 app.register_blueprint(grok_bp, url_prefix='/api')
+# Prometheus scrapes /metrics at the root, outside the API prefix.
+app.register_blueprint(metrics_bp)
 
 # Ensure the database directory exists
 db_path = os.path.join(os.path.dirname(__file__), 'database')
 os.makedirs(db_path, exist_ok=True)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(db_path, 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
+# SQLite in WAL mode by default; DATABASE_URL selects a database server (see db_config.py).
+init_db(app, db, os.path.join(db_path, 'app.db'))
+answer_cache.init_app(app)
+query_history.init_app(app)
 with app.app_context(): # Creates tables if they don't exist
     db.create_all()
 
 # Graceful shutdown handler
 def graceful_shutdown(signum, frame):
-    """Ensures the browser is closed cleanly on app termination."""
-    logging.info("Shutdown signal received. Closing browser instance...")
-    with browser_lock:
-        if browser_instance:
-            try:
-                browser_instance.quit()
-                logging.info("Browser instance closed successfully.")
-            except Exception as e:
-                logging.error(f"Error during browser cleanup: {e}")
+    """Ensures the browser sessions are closed cleanly on app termination."""
+    logging.info("Shutdown signal received. Closing browser pool...")
+    try:
+        job_scheduler.shutdown()
+        browser_pool.shutdown()
+        query_history.shutdown()
+        logging.info("Browser pool closed successfully.")
+    except Exception as e:
+        logging.error(f"Error during browser cleanup: {e}")
     exit(0)
 
 signal.signal(signal.SIGINT, graceful_shutdown)
@@ -61,17 +68,13 @@ signal.signal(signal.SIGTERM, graceful_shutdown)
 # Start browser initialization in a background thread
 start_browser_initialization_thread()
 
+# The frontend is read into memory once; see static_assets.py and build-static.sh.
+static_assets = StaticAssets(app.static_folder)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    static_folder_path = app.static_folder
-    if path is None:
-        return send_from_directory(static_folder_path, 'index.html')
-    if isinstance(path, str) and path:
-        full_path = os.path.join(static_folder_path, path)
-        if os.path.exists(full_path):
-            return send_from_directory(static_folder_path, path)
-    return send_from_directory(static_folder_path, 'index.html')
+    return static_assets.response(path, request)
 
 
 if __name__ == '__main__':
@@ -79,5 +82,12 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     # The debug flag should be False in a production environment
     debug = os.environ.get('FLASK_ENV') != 'production'
-    logging.info(f"Starting server on host 0.0.0.0, port {port}, debug={debug}")
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    # SERVER_MODE=asgi serves the streaming endpoints as coroutines under uvicorn (see asgi.py).
+    if os.environ.get('SERVER_MODE', 'flask').lower() == 'asgi':
+        import uvicorn
+        from asgi import AsgiApp
+        logging.info(f"Starting ASGI server on host 0.0.0.0, port {port}")
+        uvicorn.run(AsgiApp(app), host='0.0.0.0', port=port, timeout_keep_alive=75)
+    else:
+        logging.info(f"Starting server on host 0.0.0.0, port {port}, debug={debug}")
+        app.run(host='0.0.0.0', port=port, debug=debug)
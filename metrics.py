@@ -0,0 +1,202 @@
+"""
+Prometheus metrics, served in the text exposition format at GET /metrics.
+
+Counters and histograms are plain thread-safe tallies updated where the work happens;
+gauges (queue depth, browser sessions) are read from the job scheduler and browser pool
+when scraped. In broker mode the browser work runs in the broker process, so an app
+worker merges the broker's counters and histograms into its own output.
+"""
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, Iterable, Tuple
+
+from flask import Blueprint, Response
+
+logger = logging.getLogger(__name__)
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Seconds; browser phases range from tens of milliseconds to minutes (login waits, long answers).
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+
+    type = 'counter'
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, extra_snapshots: Iterable[list] = ()):
+        values = {}
+        for snapshot in [self.snapshot(), *extra_snapshots]:
+            for key, value in snapshot:
+                values[tuple(key)] = values.get(tuple(key), 0) + value
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class Histogram:
+
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, last is +Inf), sum, count].
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(counts), total, count]]
+                    for key, (counts, total, count) in self._values.items()]
+
+    def render(self, extra_snapshots: Iterable[list] = ()):
+        values = {}
+        for snapshot in [self.snapshot(), *extra_snapshots]:
+            for key, (counts, total, count) in snapshot:
+                merged = values.setdefault(tuple(key), [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                labels = _format_labels(self.labels, key, 'le="' + le + '"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Gauge:
+    """A value read when scraped. ``collect`` returns a number, or {label values tuple: number}."""
+
+    type = 'gauge'
+
+    def __init__(self, name: str, description: str, collect: Callable, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.collect = collect
+
+    def render(self, extra_snapshots: Iterable[list] = ()):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._sources = []
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()) -> Counter:
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def gauge(self, name, description, collect, labels=()) -> Gauge:
+        return self._register(Gauge(name, description, collect, labels))
+
+    def add_source(self, snapshot_func: Callable[[], dict]):
+        """Merges another process's ``snapshot()`` (e.g. the broker's) into every render."""
+        self._sources.append(snapshot_func)
+
+    def snapshot(self) -> dict:
+        """Counter and histogram values, JSON-serializable, for merging into another process."""
+        return {name: metric.snapshot() for name, metric in self._metrics.items() if hasattr(metric, 'snapshot')}
+
+    def render(self) -> str:
+        snapshots = []
+        for source in self._sources:
+            try:
+                snapshots.append(source())
+            except Exception as e:
+                logger.warning(f"Could not collect remote metrics: {e}")
+        lines = []
+        for name, metric in self._metrics.items():
+            try:
+                samples = metric.render([s[name] for s in snapshots if name in s])
+            except Exception as e:
+                logger.warning(f"Could not collect metric {name}: {e}")
+                continue
+            lines.append(f'# HELP {name} {metric.description}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+PHASE_SECONDS = REGISTRY.histogram(
+    'notebooklm_phase_seconds',
+    'Duration of each phase of a NotebookLM query: browser_init, navigation, login_wait, input_lookup, '
+    'submit, first_chunk, streaming, completion_tail.',
+    labels=('phase',))
+LEASE_WAIT_SECONDS = REGISTRY.histogram(
+    'notebooklm_browser_lease_wait_seconds', 'Time spent waiting for a free browser session.')
+JOB_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    'notebooklm_job_queue_wait_seconds', 'Time a job spent queued before a worker started it.', labels=('kind',))
+ERRORS_TOTAL = REGISTRY.counter(
+    'notebooklm_errors_total', 'Errors while serving NotebookLM queries, by type.', labels=('type',))
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
@@ -1,4 +1,10 @@
+import logging
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
 
 db = SQLAlchemy()
 
@@ -17,3 +23,97 @@ class User(db.Model):
             'username': self.username,
             'email': self.email
         }
+
+class CachedAnswer(db.Model):
+    """A NotebookLM answer cached per (notebook ID, normalized query)."""
+    __tablename__ = 'cached_answer'
+    __table_args__ = (db.UniqueConstraint('notebook_id', 'query_hash', name='uq_cached_answer_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    notebook_id = db.Column(db.String(120), nullable=False)
+    query_hash = db.Column(db.String(64), nullable=False)
+    query_text = db.Column(db.Text, nullable=False)
+    answer = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Float, nullable=False)
+    last_hit_at = db.Column(db.Float, nullable=False, index=True)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, notebook_id: str, query_hash: str, query_text: str, answer: str, created_at: float):
+        self.notebook_id = notebook_id
+        self.query_hash = query_hash
+        self.query_text = query_text
+        self.answer = answer
+        self.created_at = created_at
+        self.last_hit_at = created_at
+        self.hit_count = 0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'notebook_id': self.notebook_id,
+            'query': self.query_text,
+            'created_at': self.created_at,
+            'last_hit_at': self.last_hit_at,
+            'hit_count': self.hit_count
+        }
+
+class QueryHistory(db.Model):
+    """One NotebookLM query and its outcome, written in batches by query_history.QueryHistoryStore."""
+    __tablename__ = 'query_history'
+
+    id = db.Column(db.Integer, primary_key=True)
+    notebook_id = db.Column(db.String(120), index=True)
+    notebook_url = db.Column(db.Text)
+    kind = db.Column(db.String(16), nullable=False)
+    query_text = db.Column(db.Text, nullable=False)
+    answer = db.Column(db.Text, nullable=False, default='')
+    status = db.Column(db.String(16), nullable=False)
+    error = db.Column(db.Text)
+    cached = db.Column(db.Boolean, nullable=False, default=False)
+    duration = db.Column(db.Float)
+    first_chunk_seconds = db.Column(db.Float)
+    created_at = db.Column(db.Float, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'notebook_id': self.notebook_id,
+            'notebook_url': self.notebook_url,
+            'kind': self.kind,
+            'query': self.query_text,
+            'answer': self.answer,
+            'status': self.status,
+            'error': self.error,
+            'cached': self.cached,
+            'duration': self.duration,
+            'first_chunk_seconds': self.first_chunk_seconds,
+            'created_at': self.created_at
+        }
+
+# Full-text index over queries and answers (SQLite FTS5), kept in sync by triggers so the
+# batched inserts of the history writer need no extra statements.
+QUERY_HISTORY_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS query_history_fts USING fts5("
+    "query_text, answer, content='query_history', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS query_history_ai AFTER INSERT ON query_history BEGIN "
+    "INSERT INTO query_history_fts(rowid, query_text, answer) VALUES (new.id, new.query_text, new.answer); END",
+    "CREATE TRIGGER IF NOT EXISTS query_history_ad AFTER DELETE ON query_history BEGIN "
+    "INSERT INTO query_history_fts(query_history_fts, rowid, query_text, answer) "
+    "VALUES ('delete', old.id, old.query_text, old.answer); END",
+]
+
+@event.listens_for(QueryHistory.__table__, 'after_create')
+def _create_query_history_fts(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    try:
+        for statement in QUERY_HISTORY_FTS_DDL:
+            connection.exec_driver_sql(statement)
+    except OperationalError as e:
+        # SQLite built without FTS5: history search falls back to LIKE.
+        logger.warning(f"Full-text index for query history not created: {e}")
+
+@event.listens_for(QueryHistory.__table__, 'before_drop')
+def _drop_query_history_fts(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql("DROP TABLE IF EXISTS query_history_fts")
@@ -1,26 +1,60 @@
 import os
 import time
 import logging
-import threading
 import json
 from typing import Optional
+from urllib.parse import urlparse
 
 from flask import Blueprint, jsonify, request, Response, stream_with_context
-from selenium.webdriver.remote.webdriver import WebDriver
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException
-from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException, WebDriverException
+
+from browser_pool import BrowserPool, PoolClosedError, PoolExhaustedError
+from response_stream import (END_REASON_INACTIVITY, STREAM_MODE_OBSERVER, STREAM_MODES, install_completion_detector,
+                             open_response_stream, wait_for_new_response)
+from selector_lookup import BATCHABLE_STRATEGIES, SelectorOrderCache, find_first_match
+from query_jobs import DEFAULT_PRIORITY, PRIORITIES, JobScheduler
+from answer_cache import AnswerCache, normalize_query, replay_events
+from query_history import QueryHistoryStore
+from browser_broker import BrokerClient, BrokerError, RemoteBrowserPool, RemoteJobScheduler
+from metrics import ERRORS_TOTAL, PHASE_SECONDS, REGISTRY
+from tracing import tracer
 
 notebooklm_bp = Blueprint('notebooklm', __name__)
 logger = logging.getLogger(__name__)
 
 # --- Global State Management for Selenium ---
-# A single, shared browser instance and a lock to ensure thread safety.
-browser_instance: Optional[WebDriver] = None
-browser_lock = threading.Lock()
+# A pool of browser sessions. Each query leases one session exclusively, so concurrent
+# queries scale with BROWSER_POOL_MAX_SIZE instead of queueing behind a single lock.
+# With BROWSER_BROKER_SOCKET set this process is an app worker: the sessions and the job
+# queue live in the broker process (browser_broker.py) and are used over its Unix socket.
+BROKER_SOCKET = os.environ.get('BROWSER_BROKER_SOCKET')
+broker_client = BrokerClient(BROKER_SOCKET) if BROKER_SOCKET else None
+browser_pool = RemoteBrowserPool(broker_client) if broker_client else BrowserPool.from_env()
+
+# Complete answers, persisted per (notebook ID, normalized query). Bound to the app in main.py.
+answer_cache = AnswerCache.from_env()
+
+# Every query and its outcome, written in batches by a background thread. Bound to the app in main.py.
+query_history = QueryHistoryStore.from_env()
+
+# Learned selector order, persisted so the selector that matched last is tried first after a restart.
+selector_cache = SelectorOrderCache.from_env()
+
+# How answers are streamed out of the page: 'observer' pushes text deltas from an injected
+# MutationObserver, 'poll' re-reads the element text every 0.2s. Overridable per request.
+STREAM_MODE = os.environ.get('NOTEBOOKLM_STREAM_MODE', 'observer')
+
+# Fallback end-of-answer detection: seconds without new text after which a stream is treated
+# as complete when the page gave no completion signal.
+INACTIVITY_TIMEOUT = 6
+QUERY_INACTIVITY_TIMEOUT = 10
+
+# The notebook most recently opened via /open_notebooklm. /query_notebooklm falls back to
+# it when the leased session is not already on a notebook page.
+last_opened_url: Optional[str] = None
 
 # --- Constants for Selenium Selectors ---
 CHAT_INPUT_SELECTORS = [
@@ -40,6 +74,21 @@ SUBMIT_BUTTON_SELECTORS = [
 
 RESPONSE_CONTENT_SELECTOR = (By.CSS_SELECTOR, '.message-content')
 
+# Page state used to detect that an answer has finished generating, as (signal name, CSS selector).
+# Indicators visible while NotebookLM is generating; their disappearance ends the stream.
+GENERATING_INDICATOR_SELECTORS = [
+    ('stop_button', 'button[aria-label*="Stop"]'),
+    ('streaming_cursor', '.streaming-cursor, .blinking-cursor'),
+    ('loading_indicator', '.loading-indicator, .thinking-indicator'),
+]
+# Controls that NotebookLM adds to an answer once it is complete.
+RESPONSE_DONE_SELECTORS = [
+    ('copy_button', 'button[aria-label*="Copy"]'),
+    ('feedback_buttons', 'button[aria-label*="Good response"], button[aria-label*="Thumbs up"]'),
+    ('citations', 'button.citation-marker, [data-testid="citation"]'),
+]
+COMPLETION_SELECTORS = (GENERATING_INDICATOR_SELECTORS, RESPONSE_DONE_SELECTORS)
+
 NOTEBOOKLM_LOAD_INDICATORS = [
     (By.CSS_SELECTOR, '[data-testid="chat-input"]'), # Chat input is a good sign of readiness
     (By.CSS_SELECTOR, 'div[aria-label="Sources"]'), # Sources panel
@@ -47,281 +96,759 @@ NOTEBOOKLM_LOAD_INDICATORS = [
 ]
 
 
-def initialize_browser():
+def start_browser_initialization_thread():
+    """Starts pre-warming the browser pool in a background thread to not block app startup."""
+    return browser_pool.start()
+
+def _lease_session():
     """
-    Initializes the shared browser instance. This should be called once at application startup.
+    Leases a browser session from the pool.
+    Returns (session, None) on success or (None, error_message) on failure.
     """
-    global browser_instance
-    
-    # Use a remote WebDriver to connect to the Selenium container
-    selenium_hub_url = os.environ.get('SELENIUM_HUB_URL', 'http://localhost:4444/wd/hub')
-    
-    logger.info(f"Attempting to connect to Selenium Hub at: {selenium_hub_url}")
-    
-    chrome_options = Options()
-    
-    # --- Anti-detection options ---
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--disable-infobars")
-    chrome_options.add_argument("--disable-extensions")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--window-size=1920,1080")
-    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    
-    # Using a realistic or slightly future-dated User-Agent helps avoid bot detection.
-    # This is configurable via the CHROME_USER_AGENT environment variable.
-    default_user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/138.0.7204.157 Safari/537.36'
-    user_agent = os.environ.get('CHROME_USER_AGENT', default_user_agent)
-    chrome_options.add_argument(f'user-agent={user_agent}')
-
-    # This points to the profile directory mounted inside the Selenium container
-    chrome_options.add_argument("--user-data-dir=/data")
-    chrome_options.add_argument("--profile-directory=Default")
-
     try:
-        browser_instance = webdriver.Remote(
-            command_executor=selenium_hub_url,
-            options=chrome_options
-        )
-        browser_instance.set_page_load_timeout(60)
-        logger.info("WebDriver initialized successfully and connected to Selenium Hub.")
-        return True
+        with tracer.span('browser_lease'):
+            session = browser_pool.checkout()
+    except (PoolExhaustedError, PoolClosedError) as e:
+        logger.error(f"Could not lease a browser session: {e}")
+        ERRORS_TOTAL.inc(type=type(e).__name__)
+        return None, str(e)
     except Exception as e:
         logger.error(f"Failed to initialize WebDriver: {e}", exc_info=True)
-        browser_instance = None
-        return False
-
-def start_browser_initialization_thread():
-    """Starts the browser initialization in a background thread to not block app startup."""
-    init_thread = threading.Thread(target=initialize_browser, daemon=True)
-    init_thread.start()
+        ERRORS_TOTAL.inc(type=type(e).__name__)
+        return None, "Failed to initialize browser."
+    session.request_count += 1
+    return session, None
+
+def notebook_id_from_url(url):
+    """Extracts the notebook ID from a NotebookLM notebook URL, or '' for other pages."""
+    path = urlparse(url or '').path.rstrip('/')
+    if '/notebook/' not in path:
+        return ''
+    return path.split('/')[-1]
+
+def _is_same_page(current_url, target_url):
+    """True if the browser is already showing the target notebook (or the target is the home page)."""
+    target_id = notebook_id_from_url(target_url)
+    if target_id:
+        return target_id in (current_url or '')
+    return "notebooklm.google.com" in (current_url or '')
+
+def _open_in_tab(session, url):
+    """
+    Shows ``url`` in the session's tab for that notebook. Returns True if the notebook was
+    already open in a cached tab (no page load needed), False if it had to be loaded.
+    """
+    key = notebook_id_from_url(url) or url
+    if session.tabs.activate(key):
+        return True
+    session.tabs.open(key, url)
+    return False
 
+@tracer.wrap('selector_search')
 def find_element_by_priority(driver, selectors, condition=EC.presence_of_element_located, timeout=10):
     """
-    Tries to find an element by iterating through a list of selectors.
+    Tries to find an element by iterating through a list of selectors, highest hit rate first.
+    Presence and clickability checks are evaluated for the whole list in one execute_script call per
+    tick; other conditions fall back to one WebDriver call per selector.
     This implementation polls for the element to avoid a multiplicative timeout effect.
     """
+    ordered = selector_cache.ordered(selectors)
+    batched = (condition in (EC.presence_of_element_located, EC.element_to_be_clickable)
+               and all(by in BATCHABLE_STRATEGIES for by, _ in selectors))
     end_time = time.time() + timeout
     while time.time() < end_time:
-        for by, value in selectors:
+        if batched:
             try:
-                element = condition((by, value))(driver)
-                if element:
-                    return element
-            except (NoSuchElementException, StaleElementReferenceException):
-                pass
+                element, matched = find_first_match(driver, ordered, clickable=condition is EC.element_to_be_clickable)
+            except WebDriverException as e:
+                logger.debug(f"Batched selector lookup failed, trying selectors one by one: {e}")
+                batched = False
+                continue
+            if element:
+                selector_cache.record_hit(selectors, matched)
+                return element
+        else:
+            for by, value in ordered:
+                try:
+                    element = condition((by, value))(driver)
+                    if element:
+                        selector_cache.record_hit(selectors, (by, value))
+                        return element
+                except (NoSuchElementException, StaleElementReferenceException):
+                    pass
         time.sleep(0.2)
 
     logger.debug(f"Element not found using any selector within the {timeout}s timeout.")
     return None
 
 
-@notebooklm_bp.route('/process_query', methods=['POST'])
-def process_query():
+# --- Query engine ---
+# The generators below drive a leased browser session and yield event dicts. They are run
+# by the job scheduler; the HTTP endpoints only submit jobs and relay their events.
+
+def _sse(event):
+    return f'data: {json.dumps(event)}\n\n'
+
+@tracer.wrap('navigate')
+def _navigate_events(session, url):
     """
-    Consolidated Endpoint: Opens NotebookLM, submits a query, streams the response, and closes the browser.
+    Shows ``url`` in the session (switching to a cached tab when possible), waiting for a
+    manual Google login if needed. Yields status events; returns True once the page is ready.
     """
-    data = request.get_json()
-    if not data or 'query' not in data:
-        return jsonify({'error': 'Missing "query" in request body'}), 400
+    driver = session.driver
+    navigation_start = time.time()
+    login_wait = 0
+    logger.info(f"Navigating to {url}...")
+    yield {"status": "opening_browser", "message": f"Navigating to {url}"}
     
-    url = data.get('notebooklm_url', "https://notebooklm.google.com/")
-    logger.info(f"DEBUG: process_query received URL: '{url}'")
-    query_text = data['query']
-    timeout = data.get('timeout', 180)
+    cached_tab = _open_in_tab(session, url)
+    if cached_tab:
+        logger.info("Notebook already open in a cached tab; switched to it.")
+    
+    # Wait for initial load - reduced from fixed sleep to smart wait check below
+    # time.sleep(5) 
+    
+    current_url = driver.current_url
+    logger.info(f"Current URL after navigation: {current_url}")
+    
+    if 'accounts.google.com' in current_url or 'signin' in current_url.lower():
+        logger.warning(f"Redirected to Google sign-in page.")
+        yield {"status": "authentication_required", "message": "Redirected to Google sign-in. Waiting 5 minutes for manual login..."}
+        
+        # Wait up to 5 minutes for user to log in
+        auth_timeout = 300
+        auth_start_time = time.time()
+        logged_in = False
+        
+        while time.time() - auth_start_time < auth_timeout:
+            if "notebooklm.google.com" in driver.current_url and find_element_by_priority(driver, CHAT_INPUT_SELECTORS, timeout=1):
+                logged_in = True
+                break
+            time.sleep(2)
+        login_wait = time.time() - auth_start_time
+        PHASE_SECONDS.observe(login_wait, phase='login_wait')
+        
+        if not logged_in:
+            logger.error("Timed out waiting for manual login.")
+            ERRORS_TOTAL.inc(type='LoginTimeout')
+            yield {"error": "Timed out waiting for manual login."}
+            return False
+        else:
+            logger.info("User logged in successfully.")
+            yield {"status": "login_success", "message": "Login detected. Proceeding..."}
 
-    def generate_full_process_response():
-        global browser_instance
+    # Ensure we are on the correct page with retry logic
+    max_retries = 3
+    target_id = notebook_id_from_url(url)
+    
+    for i in range(max_retries):
+        current_url = driver.current_url
         
-        # 1. Initialize and Open
-        with browser_lock:
-            if not browser_instance:
-                if not initialize_browser():
-                     yield f'data: {json.dumps({"error": "Failed to initialize browser."})}\n\n'
-                     return
-            
-            try:
-                logger.info(f"Navigating to {url}...")
-                yield f'data: {json.dumps({"status": "opening_browser", "message": f"Navigating to {url}"})}\n\n'
-                
-                browser_instance.get(url)
-                
-                # Wait for initial load - reduced from fixed sleep to smart wait check below
-                # time.sleep(5) 
-                
-                current_url = browser_instance.current_url
-                logger.info(f"Current URL after navigation: {current_url}")
-                
-                if 'accounts.google.com' in current_url or 'signin' in current_url.lower():
-                    logger.warning(f"Redirected to Google sign-in page.")
-                    yield f'data: {json.dumps({"status": "authentication_required", "message": "Redirected to Google sign-in. Waiting 5 minutes for manual login..."})}\n\n'
-                    
-                    # Wait up to 5 minutes for user to log in
-                    auth_timeout = 300
-                    auth_start_time = time.time()
-                    logged_in = False
-                    
-                    while time.time() - auth_start_time < auth_timeout:
-                        if "notebooklm.google.com" in browser_instance.current_url and find_element_by_priority(browser_instance, CHAT_INPUT_SELECTORS, timeout=1):
-                            logged_in = True
-                            break
-                        time.sleep(2)
-                    
-                    if not logged_in:
-                        logger.error("Timed out waiting for manual login.")
-                        yield f'data: {json.dumps({"error": "Timed out waiting for manual login."})}\n\n'
-                        return
-                    else:
-                        logger.info("User logged in successfully.")
-                        yield f'data: {json.dumps({"status": "login_success", "message": "Login detected. Proceeding..."})}\n\n'
-
-                # Wait for page to fully load
-                # logger.info("Waiting for page to fully load...")
-                # time.sleep(5)
-                
-                # Ensure we are on the correct page with retry logic
-                max_retries = 3
-                target_id = url.split('/')[-1] if 'notebook/' in url else ''
-                
-                for i in range(max_retries):
-                    current_url = browser_instance.current_url
-                    
-                    # 1. Check if we are on the home page but want a specific notebook
-                    if "notebook/" in url and "notebook/" not in current_url:
-                        logger.warning(f"Attempt {i+1}/{max_retries}: Detected Home Page (or non-notebook page) '{current_url}' but target is '{url}'. Re-navigating...")
-                        browser_instance.get(url)
-                        time.sleep(8) # Increased wait time
-                        continue
-
-                    # 2. Check if we are on the WRONG notebook (ID mismatch)
-                    if target_id and target_id not in current_url:
-                        logger.warning(f"Attempt {i+1}/{max_retries}: ID mismatch. Current '{current_url}' vs Target '{url}'. Re-navigating...")
-                        browser_instance.get(url)
-                        time.sleep(8)
-                        continue
-
-                    # 3. Success check
-                    logger.info(f"Successfully on target page: {current_url}")
-                    break
-                else:
-                    logger.error(f"Failed to navigate to {url} after {max_retries} attempts. Current URL: {browser_instance.current_url}")
-
-                logger.info(f"Page loaded. Current URL: {browser_instance.current_url}")
-                yield f'data: {json.dumps({"status": "browser_ready", "message": "NotebookLM interface loaded."})}\n\n'
-
-                # 2. Query Logic
-                if "notebooklm.google.com" not in browser_instance.current_url:
-                     yield f'data: {json.dumps({"error": "Not on a NotebookLM page."})}\n\n'
-                     return
-                
-                initial_response_count = len(browser_instance.find_elements(*RESPONSE_CONTENT_SELECTOR))
-                
-                logger.info("Attempting to find the chat input field...")
-                input_field = find_element_by_priority(browser_instance, CHAT_INPUT_SELECTORS, condition=EC.element_to_be_clickable, timeout=10)
-                if not input_field:
-                    raise NoSuchElementException("Could not find the chat input field.")
-                
-                logger.info(f"Entering query text: {query_text}")
-                input_field.clear()
-                input_field.send_keys(query_text)
-                
-                submit_button = find_element_by_priority(browser_instance, SUBMIT_BUTTON_SELECTORS, condition=EC.element_to_be_clickable, timeout=5)
-                if submit_button:
-                    logger.info("Clicking submit button...")
-                    submit_button.click()
-                else:
-                    logger.info("Submit button not found, sending RETURN key...")
-                    from selenium.webdriver.common.keys import Keys
-                    input_field.send_keys(Keys.RETURN)
-                
-                logger.info("Query submitted.")
-                yield f'data: {json.dumps({"status": "waiting_for_response"})}\n\n'
-
-                def find_new_response_with_text(driver, initial_count, selector):
-                    try:
-                        response_elements = driver.find_elements(*selector)
-                        if len(response_elements) > initial_count:
-                            new_response_element = response_elements[-1]
-                            if new_response_element.is_displayed() and new_response_element.text.strip():
-                                return new_response_element
-                    except StaleElementReferenceException:
-                        return False
-                    return False
+        # 1. Check if we are on the home page but want a specific notebook
+        if "notebook/" in url and "notebook/" not in current_url:
+            logger.warning(f"Attempt {i+1}/{max_retries}: Detected Home Page (or non-notebook page) '{current_url}' but target is '{url}'. Re-navigating...")
+            driver.get(url)
+            time.sleep(8) # Increased wait time
+            continue
+
+        # 2. Check if we are on the WRONG notebook (ID mismatch)
+        if target_id and target_id not in current_url:
+            logger.warning(f"Attempt {i+1}/{max_retries}: ID mismatch. Current '{current_url}' vs Target '{url}'. Re-navigating...")
+            driver.get(url)
+            time.sleep(8)
+            continue
+
+        # 3. Success check
+        logger.info(f"Successfully on target page: {current_url}")
+        break
+    else:
+        logger.error(f"Failed to navigate to {url} after {max_retries} attempts. Current URL: {driver.current_url}")
+
+    session.current_url = driver.current_url
+    PHASE_SECONDS.observe(time.time() - navigation_start - login_wait, phase='navigation')
+    logger.info(f"Page loaded. Current URL: {session.current_url}")
+    yield {"status": "browser_ready", "message": "NotebookLM interface loaded.", "cached_tab": cached_tab}
+
+    if "notebooklm.google.com" not in session.current_url:
+        ERRORS_TOTAL.inc(type='NotNotebookLMPage')
+        yield {"error": "Not on a NotebookLM page."}
+        return False
+    return True
 
-                try:
-                    response_element = WebDriverWait(browser_instance, 50).until(
-                        lambda d: find_new_response_with_text(d, initial_response_count, RESPONSE_CONTENT_SELECTOR)
-                    )
-                    logger.info("Response started.")
-                    yield f'data: {json.dumps({"status": "streaming"})}\n\n'
-                except TimeoutException:
-                    logger.error("Timeout waiting for response generation.")
-                    yield f'data: {json.dumps({"error": "NotebookLM did not start generating response."})}\n\n'
-                    return
-
-                last_text = ""
-                end_time = time.time() + timeout
-                stream_completed = False
-                last_data_time = time.time()
-                INACTIVITY_TIMEOUT = 6
-
-                while time.time() < end_time:
-                    try:
-                        current_text = response_element.text
-                    except StaleElementReferenceException:
-                        logger.warning("Stale element detected during streaming. Attempting to re-acquire...")
-                        try:
-                            # Give DOM a moment to settle
-                            time.sleep(0.5)
-                            elements = browser_instance.find_elements(*RESPONSE_CONTENT_SELECTOR)
-                            if elements:
-                                response_element = elements[-1]
-                                current_text = response_element.text
-                            else:
-                                logger.warning("Could not find any response elements during recovery.")
-                                current_text = last_text
-                        except Exception as e:
-                            logger.warning(f"Failed to re-acquire element or get text: {e}")
-                            current_text = last_text
-
-                    if len(current_text) > len(last_text):
-                        new_text = current_text[len(last_text):]
-                        yield f'data: {json.dumps({"chunk": new_text})}\n\n'
-                        last_text = current_text
-                        last_data_time = time.time()
-
-                    if time.time() - last_data_time > INACTIVITY_TIMEOUT:
-                        stream_completed = True
-                        break
-                    
-                    time.sleep(0.2)
-                
-                final_text = response_element.text
-                if len(final_text) > len(last_text):
-                    new_text = final_text[len(last_text):]
-                    yield f'data: {json.dumps({"chunk": new_text})}\n\n'
-
-                status_message = "timeout" if not stream_completed else "complete"
-                yield f'data: {json.dumps({"status": status_message})}\n\n'
+def _find_new_response_with_text(driver, initial_count, selector):
+    try:
+        response_elements = driver.find_elements(*selector)
+        if len(response_elements) > initial_count:
+            new_response_element = response_elements[-1]
+            if new_response_element.is_displayed() and new_response_element.text.strip():
+                return new_response_element
+    except StaleElementReferenceException:
+        return False
+    return False
 
+def _wait_for_first_chunk(driver, initial_count, stream_mode, timeout=50):
+    """
+    Returns the new response element once it has text; raises TimeoutException after ``timeout``.
+    In observer mode the page reports it as soon as it renders, in one long-poll call per few
+    seconds; otherwise (or if the script fails) the element is polled every 0.5s.
+    """
+    by, value = RESPONSE_CONTENT_SELECTOR
+    if stream_mode == STREAM_MODE_OBSERVER and by == By.CSS_SELECTOR:
+        try:
+            element = wait_for_new_response(driver, value, initial_count, timeout)
+        except WebDriverException as e:
+            logger.warning(f"Could not wait for the response in the page, polling instead: {e}")
+        else:
+            if element is None:
+                raise TimeoutException(f"No response within {timeout}s.")
+            return element
+    return WebDriverWait(driver, timeout).until(
+        lambda d: _find_new_response_with_text(d, initial_count, RESPONSE_CONTENT_SELECTOR)
+    )
+
+@tracer.wrap('ask')
+def _ask_events(session, query_text, timeout, stream_mode, inactivity_timeout):
+    """Submits ``query_text`` in the notebook currently shown by the session and yields the streamed answer."""
+    driver = session.driver
+    initial_response_count = len(driver.find_elements(*RESPONSE_CONTENT_SELECTOR))
+    # The completion baseline must be taken before submitting, like the response count: a
+    # short answer may already be finished by the time streaming starts.
+    install_completion_detector(driver, COMPLETION_SELECTORS)
+    
+    logger.info("Attempting to find the chat input field...")
+    phase_start = time.time()
+    input_field = find_element_by_priority(driver, CHAT_INPUT_SELECTORS, condition=EC.element_to_be_clickable, timeout=10)
+    PHASE_SECONDS.observe(time.time() - phase_start, phase='input_lookup')
+    if not input_field:
+        raise NoSuchElementException("Could not find the chat input field.")
+    
+    phase_start = time.time()
+    logger.info(f"Entering query text: {query_text}")
+    input_field.clear()
+    input_field.send_keys(query_text)
+    
+    submit_button = find_element_by_priority(driver, SUBMIT_BUTTON_SELECTORS, condition=EC.element_to_be_clickable, timeout=5)
+    if submit_button:
+        logger.info("Clicking submit button...")
+        submit_button.click()
+    else:
+        logger.info("Submit button not found, sending RETURN key...")
+        from selenium.webdriver.common.keys import Keys
+        input_field.send_keys(Keys.RETURN)
+    
+    PHASE_SECONDS.observe(time.time() - phase_start, phase='submit')
+    logger.info("Query submitted, waiting for response from NotebookLM...")
+    yield {"status": "waiting_for_response"}
+
+    phase_start = time.time()
+    try:
+        response_element = _wait_for_first_chunk(driver, initial_response_count, stream_mode)
+        PHASE_SECONDS.observe(time.time() - phase_start, phase='first_chunk')
+        logger.info("First text chunk detected. Starting to stream content.")
+        yield {"status": "streaming"}
+    except TimeoutException:
+        logger.error("Timed out waiting for a response from NotebookLM to start generating.")
+        ERRORS_TOTAL.inc(type='FirstChunkTimeout')
+        yield {"error": "NotebookLM did not start generating a response in time."}
+        return
+
+    # Streaming runs until the last chunk; the completion tail is the wait after it for the
+    # completion signal (or the inactivity timeout) that ends the stream.
+    stream_start = last_chunk_at = time.time()
+    stream = open_response_stream(driver, response_element, RESPONSE_CONTENT_SELECTOR, stream_mode)
+    for new_text in stream.iter_chunks(timeout, inactivity_timeout=inactivity_timeout):
+        last_chunk_at = time.time()
+        with tracer.span('chunk_emit', chars=len(new_text)):
+            yield {"chunk": new_text}
+    PHASE_SECONDS.observe(last_chunk_at - stream_start, phase='streaming')
+    PHASE_SECONDS.observe(time.time() - last_chunk_at, phase='completion_tail')
+
+    if not stream.completed:
+        ERRORS_TOTAL.inc(type='StreamTimeout')
+    status_message = "timeout" if not stream.completed else "complete"
+    yield {"status": status_message, "completion_signal": stream.end_reason}
+
+def _caching_answer(params, events):
+    """
+    Passes events through and caches the answer if the stream completed without errors on a
+    signal from the page. An answer that only stopped growing (inactivity_timeout) may be
+    truncated, so it is not replayed from the cache.
+    """
+    chunks = []
+    failed = False
+    for event in events:
+        if 'chunk' in event:
+            chunks.append(event['chunk'])
+        elif 'error' in event:
+            failed = True
+        elif (event.get('status') == 'complete' and not failed
+              and event.get('completion_signal') not in (None, END_REASON_INACTIVITY)):
+            answer_cache.put(params.get('notebook_id'), params['query'], ''.join(chunks))
+        yield event
+
+def _recording_history(kind, params, events):
+    """Passes events through and records the query, its answer and timings in the query history."""
+    start = time.time()
+    chunks = []
+    error = status = first_chunk_seconds = None
+    finished = False
+    try:
+        for event in events:
+            if 'chunk' in event:
+                if first_chunk_seconds is None:
+                    first_chunk_seconds = time.time() - start
+                chunks.append(event['chunk'])
+            elif 'error' in event:
+                error = event['error']
+            elif event.get('status') in ('complete', 'timeout'):
+                status = event['status']
+            yield event
+        finished = True
+    finally:
+        if not finished:
+            status = 'cancelled'
+        elif error is not None or status is None:
+            status = 'error'
+        query_history.record(params.get('notebook_id'), params.get('url'), kind, params['query'], ''.join(chunks),
+                             status, error=error, duration=time.time() - start,
+                             first_chunk_seconds=first_chunk_seconds)
+
+def _traced(kind, runner):
+    """Runs a job inside the trace started for its request, and adds the trace ID to its first event."""
+    def run(params):
+        trace_id = params.get('trace_id')
+        if not trace_id:
+            yield from runner(params)
+            return
+        submitted_at = params.get('submitted_at') or time.time()
+        with tracer.trace(kind, trace_id, start=submitted_at, notebook_id=params.get('notebook_id')):
+            tracer.record_span('queue_wait', submitted_at)
+            first = True
+            for event in runner(params):
+                if first:
+                    event, first = dict(event, trace_id=trace_id), False
+                yield event
+    return run
+
+def _process_query_events(session, params):
+    try:
+        if (yield from _navigate_events(session, params['url'])):
+            yield from _ask_events(session, params['query'], params['timeout'], params['stream_mode'],
+                                   INACTIVITY_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Error in process_query: {e}", exc_info=True)
+        session.record_error(e)
+        yield {"error": str(e)}
+
+def run_process_query(params):
+    """Job runner for /process_query: lease, open the notebook, ask, and release the browser."""
+    session, lease_error = _lease_session()
+    if lease_error:
+        yield {"error": lease_error}
+        return
+    try:
+        yield from _recording_history(JOB_KIND_PROCESS, params,
+                                      _caching_answer(params, _process_query_events(session, params)))
+    finally:
+        # Release the browser. In reuse mode it stays warm for the next query;
+        # otherwise (or if it is due for recycling) it is closed.
+        if not browser_pool.reuse_sessions:
+            session.retire_on_checkin = True
+        kept = browser_pool.checkin(session)
+    if kept:
+        logger.info(f"Browser session in slot {session.slot} released for reuse.")
+        yield {"status": "browser_released"}
+    else:
+        logger.info("Browser closed.")
+        yield {"status": "browser_closed"}
+
+def _notebook_query_events(session, params):
+    driver = session.driver
+    try:
+        # Sessions are shared, so make sure this one shows the requested (or last opened) notebook.
+        target_url = params.get('url') or last_opened_url
+        current_url = session.current_url = driver.current_url
+        if target_url and "notebooklm.google.com" in target_url and not _is_same_page(current_url, target_url):
+            logger.info(f"Leased session is on {current_url}; switching to {target_url}...")
+            if not _open_in_tab(session, target_url):
+                find_element_by_priority(driver, NOTEBOOKLM_LOAD_INDICATORS, timeout=20)
+            current_url = session.current_url = driver.current_url
+
+        # Check if we are on a valid NotebookLM page
+        if "notebooklm.google.com" not in current_url:
+            yield {"error": "Not on a NotebookLM page. Please use /open_notebooklm first."}
+            return
+
+        yield from _ask_events(session, params['query'], params['timeout'], params['stream_mode'],
+                               QUERY_INACTIVITY_TIMEOUT)
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during the query stream: {e}", exc_info=True)
+        session.record_error(e)
+        yield {"error": str(e)}
+
+def _batch_events(session, params):
+    """
+    Opens the notebook once, then asks each query in turn in the same page. Yields one
+    ``{"result": record}`` per query, with timings, and a final ``{"summary": ...}``.
+    """
+    queries = params['queries']
+    batch_start = time.time()
+    navigation_error = None
+    try:
+        ready = yield from _navigate_events(session, params['url'])
+        if not ready:
+            navigation_error = "Could not open the notebook."
+    except Exception as e:
+        logger.error(f"Error opening notebook for batch: {e}", exc_info=True)
+        session.record_error(e)
+        navigation_error = str(e)
+    navigation_seconds = time.time() - batch_start
+
+    completed = 0
+    for index, query_text in enumerate(queries):
+        record = {"index": index, "query": query_text, "cached": False}
+        query_start = time.time()
+        timings = record["timings"] = {}
+        cached_answer = None if params['bypass_cache'] else answer_cache.get(params['notebook_id'], query_text)
+        if cached_answer is not None:
+            record.update(status="complete", answer=cached_answer, cached=True)
+        elif navigation_error:
+            record.update(status="error", error=navigation_error)
+        else:
+            chunks = []
+            try:
+                events = _caching_answer({'notebook_id': params['notebook_id'], 'query': query_text},
+                                         _ask_events(session, query_text, params['timeout'], params['stream_mode'],
+                                                     INACTIVITY_TIMEOUT))
+                for event in events:
+                    if 'chunk' in event:
+                        chunks.append(event['chunk'])
+                    elif 'error' in event:
+                        record.update(status="error", error=event['error'])
+                    elif event.get('status') == 'waiting_for_response':
+                        timings["submit_seconds"] = time.time() - query_start
+                    elif event.get('status') == 'streaming':
+                        timings["first_chunk_seconds"] = time.time() - query_start
+                    elif event.get('status') in ('complete', 'timeout'):
+                        record.update(status=event['status'], completion_signal=event.get('completion_signal'))
             except Exception as e:
-                logger.error(f"Error in process_query: {e}", exc_info=True)
-                yield f'data: {json.dumps({"error": str(e)})}\n\n'
-            
-            finally:
-                # 3. Close Browser
-                if browser_instance:
-                    try:
-                        browser_instance.quit()
-                        logger.info("Browser closed.")
-                        browser_instance = None
-                        yield f'data: {json.dumps({"status": "browser_closed"})}\n\n'
-                    except Exception as e:
-                        logger.error(f"Error closing browser: {e}")
-
-    return Response(stream_with_context(generate_full_process_response()), mimetype='text/event-stream')
+                logger.error(f"Error in batch query {index}: {e}", exc_info=True)
+                session.record_error(e)
+                record.update(status="error", error=str(e))
+            record["answer"] = ''.join(chunks)
+        timings["total_seconds"] = time.time() - query_start
+        if record.get("status") == "complete":
+            completed += 1
+        query_history.record(params['notebook_id'], params['url'], JOB_KIND_BATCH, query_text, record.get("answer"),
+                             record.get("status") or "error", error=record.get("error"), cached=record["cached"],
+                             duration=timings["total_seconds"], first_chunk_seconds=timings.get("first_chunk_seconds"))
+        yield {"result": record}
+
+    yield {"summary": {
+        "queries": len(queries),
+        "completed": completed,
+        "navigation_seconds": navigation_seconds,
+        "total_seconds": time.time() - batch_start
+    }}
+
+def run_batch_query(params):
+    """Job runner for /batch_query: one lease and one navigation for the whole list of queries."""
+    session, lease_error = _lease_session()
+    if lease_error:
+        yield {"error": lease_error}
+        return
+    try:
+        yield from _batch_events(session, params)
+    finally:
+        browser_pool.checkin(session)
+
+def run_notebook_query(params):
+    """Job runner for /query_notebooklm: ask in an already opened (or given) notebook."""
+    session, lease_error = _lease_session()
+    if lease_error:
+        yield {"error": lease_error}
+        return
+    try:
+        yield from _recording_history(JOB_KIND_QUERY, params,
+                                      _caching_answer(params, _notebook_query_events(session, params)))
+    finally:
+        browser_pool.checkin(session)
+
+def run_open_notebook(params):
+    """
+    Job runner for /open_notebooklm: navigates to the URL and waits for it to become interactive.
+    The client does not wait for it, so the outcome is logged as well as yielded.
+    """
+    global last_opened_url
+    url = last_opened_url = params['url']
+
+    session, lease_error = _lease_session()
+    if lease_error:
+        logger.error(f"Browser not available: {lease_error}")
+        yield {"error": lease_error}
+        return
+    try:
+        driver = session.driver
+        logger.info(f"Navigating to {url} and waiting for it to become interactive...")
+        if _open_in_tab(session, url):
+            logger.info(f"Notebook {url} was already open in a cached tab.")
+
+        load_indicator = find_element_by_priority(driver, NOTEBOOKLM_LOAD_INDICATORS, timeout=20)
+
+        current_url = session.current_url = driver.current_url
+        if 'accounts.google.com' in current_url or 'signin' in current_url.lower():
+            logger.warning(f"Redirected to Google sign-in page for URL: {url}")
+            event = {"status": "authentication_required"}
+        elif not load_indicator:
+            logger.error(f"Timed out waiting for NotebookLM interface to load at {url}.")
+            event = {"error": "Timed out waiting for the NotebookLM interface to load."}
+        else:
+            logger.info(f"Successfully navigated to {url} and the interface is ready.")
+            event = {"status": "browser_ready"}
+    except Exception as e:
+        logger.error(f"Error during open of {url}: {e}", exc_info=True)
+        session.record_error(e)
+        event = {"error": str(e)}
+    finally:
+        browser_pool.checkin(session)
+    yield event
+
+JOB_KIND_PROCESS = 'process'
+JOB_KIND_QUERY = 'query'
+JOB_KIND_BATCH = 'batch'
+JOB_KIND_OPEN = 'open'
+
+# Upper bound on the number of questions accepted by /batch_query.
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', 100))
+
+# One worker per browser session: a job is dispatched as soon as a session can serve it.
+# App workers of a broker deployment submit their jobs to the broker's scheduler instead.
+if broker_client:
+    job_scheduler = RemoteJobScheduler(broker_client)
+else:
+    job_scheduler = JobScheduler(
+        {JOB_KIND_PROCESS: _traced(JOB_KIND_PROCESS, run_process_query),
+         JOB_KIND_QUERY: _traced(JOB_KIND_QUERY, run_notebook_query),
+         JOB_KIND_BATCH: _traced(JOB_KIND_BATCH, run_batch_query),
+         JOB_KIND_OPEN: run_open_notebook},
+        workers=int(os.environ.get('JOB_WORKERS', browser_pool.max_size)),
+        result_ttl=float(os.environ.get('JOB_RESULT_TTL', 3600))
+    )
+
+# Gauges read from the scheduler and pool on every /metrics scrape. An app worker also
+# reports the broker's phase histograms and error counters, since the browsers run there.
+def _queue_depth_by_priority():
+    return {(priority,): depth for priority, depth in job_scheduler.stats()['queued_by_priority'].items()}
+
+def _sessions_by_state():
+    stats = browser_pool.stats()
+    return {('idle',): stats['idle'], ('in_use',): stats['in_use']}
+
+REGISTRY.gauge('notebooklm_job_queue_depth', 'Jobs waiting for a worker, by priority.', _queue_depth_by_priority,
+               labels=('priority',))
+REGISTRY.gauge('notebooklm_jobs_running', 'Jobs currently running.', lambda: job_scheduler.stats()['running'])
+REGISTRY.gauge('notebooklm_browser_sessions', 'Open browser sessions, by state.', _sessions_by_state,
+               labels=('state',))
+REGISTRY.gauge('notebooklm_browser_lease_waiting', 'Queries waiting for a free browser session.',
+               lambda: browser_pool.stats()['waiting'])
+if broker_client:
+    REGISTRY.add_source(lambda: broker_client.call('metrics'))
+
+def _parse_query_request(data, default_url=None):
+    """
+    Validates a query request body.
+    Returns (params, priority, None) or (None, None, error_response).
+    """
+    if not data or 'query' not in data:
+        return None, None, ({'error': 'Missing "query" in request body'}, 400)
+    params, priority, error_response = _parse_common_options(data, default_url)
+    if error_response:
+        return None, None, error_response
+    params['query'] = data['query']
+    return params, priority, None
+
+def _parse_batch_request(data):
+    """Validates a /batch_query body. Returns (params, priority, None) or (None, None, error_response)."""
+    if not data or 'notebooklm_url' not in data:
+        return None, None, ({'error': 'Missing "notebooklm_url" in request body'}, 400)
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return None, None, ({'error': '"queries" must be a non-empty list of strings'}, 400)
+    if len(queries) > BATCH_MAX_QUERIES:
+        return None, None, ({'error': f'At most {BATCH_MAX_QUERIES} queries are allowed per batch'}, 400)
+    params, priority, error_response = _parse_common_options(data)
+    if error_response:
+        return None, None, error_response
+    params['queries'] = queries
+    return params, priority, None
+
+def _parse_common_options(data, default_url=None):
+    """Options shared by single and batch queries. Returns (params, priority, error_response)."""
+    stream_mode = data.get('stream_mode', STREAM_MODE)
+    if stream_mode not in STREAM_MODES:
+        return None, None, ({'error': f'stream_mode must be one of {", ".join(STREAM_MODES)}'}, 400)
+    priority = data.get('priority', DEFAULT_PRIORITY)
+    if priority not in PRIORITIES:
+        return None, None, ({'error': f'priority must be one of {", ".join(PRIORITIES)}'}, 400)
+    url = data.get('notebooklm_url', default_url)
+    params = {
+        'url': url,
+        'notebook_id': notebook_id_from_url(url),
+        'timeout': data.get('timeout', 180), # Allow configurable timeout
+        'stream_mode': stream_mode,
+        'bypass_cache': bool(data.get('bypass_cache', False)),
+    }
+    return params, priority, None
+
+def _cached_answer(params):
+    """
+    Returns the cached answer for a single query, or None on a miss.
+    "bypass_cache": true skips the lookup; the fresh answer still refreshes the cache.
+    """
+    if params['bypass_cache']:
+        return None
+    answer = answer_cache.get(params['notebook_id'], params['query'])
+    if answer is not None:
+        logger.info(f"Serving cached answer for notebook {params['notebook_id']}.")
+    return answer
+
+def _coalesce_key(kind, params):
+    """
+    Identical questions to the same notebook share one in-flight job (and browser run).
+    The job kind, stream mode and timeout are part of the key, since they change how the job runs.
+    """
+    if not params['notebook_id']:
+        return None
+    return (kind, params['notebook_id'], normalize_query(params['query']), params['stream_mode'],
+            str(params['timeout']))
+
+def _client_id(data):
+    """Identifies the caller for per-client fairness in the job queue."""
+    return (data or {}).get('client_id') or request.headers.get('X-Client-Id') or request.remote_addr
+
+def _assign_trace(params):
+    """Gives a query its trace ID at submission; the job runner records the trace under it."""
+    if tracer.enabled:
+        params['trace_id'] = tracer.new_trace_id()
+        params['submitted_at'] = time.time()
+    return params
+
+def _default_url(kind):
+    """The notebook a single query without "notebooklm_url" goes to."""
+    if kind == JOB_KIND_PROCESS:
+        return "https://notebooklm.google.com/"
+    # Pin the notebook now so the answer is cached under the notebook it came from.
+    return last_opened_url
+
+def start_query_stream(kind, data, client_id):
+    """
+    Validates the body of a streaming query endpoint and starts it. Shared by the Flask
+    views below and the coroutine handlers in asgi.py.
+    Returns (error_response, job, cached_events); exactly one of them is set.
+    """
+    if kind == JOB_KIND_BATCH:
+        params, priority, error_response = _parse_batch_request(data)
+        if error_response:
+            return error_response, None, None
+        logger.info(f"Batch of {len(params['queries'])} queries received for {params['url']}")
+        return None, job_scheduler.submit(JOB_KIND_BATCH, _assign_trace(params), priority, client_id), None
+
+    params, priority, error_response = _parse_query_request(data, default_url=_default_url(kind))
+    if error_response:
+        return error_response, None, None
+    if kind == JOB_KIND_PROCESS:
+        logger.info(f"DEBUG: process_query received URL: '{params['url']}'")
+
+    _assign_trace(params)
+    lookup_start = time.time()
+    answer = _cached_answer(params)
+    if answer is not None:
+        query_history.record(params['notebook_id'], params['url'], kind, params['query'], answer, 'complete',
+                             cached=True, duration=0.0)
+        events = list(replay_events(answer))
+        if 'trace_id' in params:
+            with tracer.trace(kind, params['trace_id'], start=lookup_start, notebook_id=params['notebook_id'],
+                              cache='hit'):
+                pass
+            events[0] = dict(events[0], trace_id=params['trace_id'])
+        return None, None, events
+    return None, job_scheduler.submit(kind, params, priority, client_id, _coalesce_key(kind, params)), None
+
+def format_sse(index, event):
+    return _sse(event)
+
+def format_sse_with_id(index, event):
+    """SSE with event IDs, so /jobs/<id>/events subscribers can resume with Last-Event-ID."""
+    return f'id: {index}\n' + _sse(event)
+
+def format_batch_record(index, event):
+    """NDJSON framing for /batch_query: one line per query result, then the summary."""
+    if 'result' in event:
+        return json.dumps(event['result']) + '\n'
+    if 'summary' in event or 'error' in event:
+        return json.dumps(event) + '\n'
+    return None
+
+def stream_format(kind):
+    """Returns (format_event, mimetype) for the streaming endpoint of a job kind."""
+    if kind == JOB_KIND_BATCH:
+        return format_batch_record, 'application/x-ndjson'
+    return format_sse, 'text/event-stream'
+
+def resume_index(last_event_id, from_index):
+    """First event to send to a /jobs/<id>/events subscriber."""
+    start = last_event_id + 1 if last_event_id is not None else (from_index or 0)
+    return max(start, 0)
+
+def release_job_stream(job, finished, cancel_on_disconnect=True):
+    """
+    Called when a client stops following a job. Streaming endpoints cancel the job when their
+    client went away early and no other client (of a coalesced request) is still following it;
+    job subscribers only detach.
+    """
+    if job.detach() and cancel_on_disconnect and not finished:
+        job_scheduler.cancel(job.id)
+
+def _stream_job(job, start=0, format_event=format_sse, mimetype='text/event-stream', cancel_on_disconnect=True):
+    """Relays a job's events, replaying from ``start`` then following live. Events formatted as None are skipped."""
+    job.attach()
+
+    def generate():
+        finished = False
+        try:
+            for index, event in enumerate(job.iter_events(start), start):
+                line = format_event(index, event)
+                if line is not None:
+                    yield line
+            finished = True
+        finally:
+            release_job_stream(job, finished, cancel_on_disconnect)
+
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def _query_stream_response(kind):
+    data = request.get_json()
+    error_response, job, cached_events = start_query_stream(kind, data, _client_id(data))
+    if error_response:
+        return error_response
+    format_event, mimetype = stream_format(kind)
+    if cached_events is not None:
+        return Response((format_event(index, event) for index, event in enumerate(cached_events)), mimetype=mimetype)
+    return _stream_job(job, format_event=format_event, mimetype=mimetype)
+
+
+@notebooklm_bp.errorhandler(BrokerError)
+def handle_broker_error(e):
+    logger.error(f"Browser broker error: {e}")
+    return jsonify({'error': str(e)}), 503
+
+@notebooklm_bp.route('/process_query', methods=['POST'])
+def process_query():
+    """
+    Consolidated Endpoint: Opens NotebookLM, submits a query, streams the response, and releases the browser.
+    The session is kept warm for the next query unless BROWSER_POOL_REUSE is disabled.
+    """
+    return _query_stream_response(JOB_KIND_PROCESS)
 
 @notebooklm_bp.route('/open_notebooklm', methods=['POST'])
 def open_notebooklm():
@@ -333,182 +860,154 @@ def open_notebooklm():
     url = data.get('notebooklm_url', "https://notebooklm.google.com/")
     logger.info(f"Request received to open URL: {url}")
 
-    # Start the page load in a background thread
-    thread = threading.Thread(target=_perform_open_notebook, args=(url,))
-    thread.daemon = True
-    thread.start()
-
-    return jsonify({'status': 'loading', 'message': f'Page load initiated for {url}'}), 202
-
-def _perform_open_notebook(url):
-    """
-    Helper function to contain the browser navigation and validation logic.
-    This runs in a background thread and does not return a direct response to the client.
-    """
-    with browser_lock:
-        if not browser_instance:
-            logger.error("Browser not initialized.")
-            return
-        try:
-            logger.info(f"Navigating to {url} and waiting for it to become interactive...")
-            browser_instance.get(url)
+    global last_opened_url
+    last_opened_url = url
 
-            load_indicator = find_element_by_priority(browser_instance, NOTEBOOKLM_LOAD_INDICATORS, timeout=20)
+    # Load the page in the background as a job, on whichever browser session (or broker) is free.
+    job_scheduler.submit(JOB_KIND_OPEN, {'url': url}, DEFAULT_PRIORITY, _client_id(data), keep_alive=True)
 
-            current_url = browser_instance.current_url
-            if 'accounts.google.com' in current_url or 'signin' in current_url.lower():
-                logger.warning(f"Redirected to Google sign-in page for URL: {url}")
-            elif not load_indicator:
-                logger.error(f"Timed out waiting for NotebookLM interface to load at {url}.")
-            else:
-                logger.info(f"Successfully navigated to {url} and the interface is ready.")
-        except Exception as e:
-            logger.error(f"Error during open of {url}: {e}", exc_info=True)
+    return jsonify({'status': 'loading', 'message': f'Page load initiated for {url}'}), 202
 
 @notebooklm_bp.route('/query_notebooklm', methods=['POST'])
 def query_notebooklm():
     """
     Endpoint 2: Submits a query to NotebookLM and streams the response back.
     """
-    data = request.get_json()
-    if not data or 'query' not in data:
-        return jsonify({'error': 'Missing "query" in request body'}), 400
-    query_text = data['query']
-    timeout = data.get('timeout', 180) # Allow configurable timeout
-
-    def generate_response():
-        with browser_lock:
-            if not browser_instance:
-                yield f'data: {json.dumps({"error": "Browser not initialized."})}\n\n'
-                return
+    return _query_stream_response(JOB_KIND_QUERY)
 
-            try:
-                # Check if we are on a valid NotebookLM page
-                if "notebooklm.google.com" not in browser_instance.current_url:
-                    yield f'data: {json.dumps({"error": "Not on a NotebookLM page. Please use /open_notebooklm first."})}\n\n'
-                    return
-
-                initial_response_count = len(browser_instance.find_elements(*RESPONSE_CONTENT_SELECTOR))
-                
-                logger.info("Attempting to find the chat input field...")
-                input_field = find_element_by_priority(browser_instance, CHAT_INPUT_SELECTORS, condition=EC.element_to_be_clickable, timeout=10)
-                if not input_field:
-                    raise NoSuchElementException("Could not find the chat input field.")
-                
-                input_field.clear()
-                input_field.send_keys(query_text)
-                
-                submit_button = find_element_by_priority(browser_instance, SUBMIT_BUTTON_SELECTORS, condition=EC.element_to_be_clickable, timeout=5)
-                if submit_button:
-                    submit_button.click()
-                else:
-                    from selenium.webdriver.common.keys import Keys
-                    input_field.send_keys(Keys.RETURN)
-                
-                logger.info("Query submitted, waiting for response from NotebookLM...")
-                yield f'data: {json.dumps({"status": "waiting_for_response"})}\n\n'
-
-                def find_new_response_with_text(driver, initial_count, selector):
-                    try:
-                        response_elements = driver.find_elements(*selector)
-                        if len(response_elements) > initial_count:
-                            new_response_element = response_elements[-1]
-                            if new_response_element.is_displayed() and new_response_element.text.strip():
-                                return new_response_element
-                    except StaleElementReferenceException:
-                        return False
-                    return False
-
-                try:
-                    response_element = WebDriverWait(browser_instance, 50).until(
-                        lambda d: find_new_response_with_text(d, initial_response_count, RESPONSE_CONTENT_SELECTOR)
-                    )
-                    logger.info("First text chunk detected. Starting to stream content.")
-                    yield f'data: {json.dumps({"status": "streaming"})}\n\n'
-                except TimeoutException:
-                    logger.error("Timed out waiting for a response from NotebookLM to start generating.")
-                    yield f'data: {json.dumps({"error": "NotebookLM did not start generating a response in time."})}\n\n'
-                    return
-
-                last_text = ""
-                end_time = time.time() + timeout
-                stream_completed = False
-                last_data_time = time.time()
-                INACTIVITY_TIMEOUT = 10
-
-                while time.time() < end_time:
-                    try:
-                        current_text = response_element.text
-                    except StaleElementReferenceException:
-                        logger.warning("Response element became stale. Re-finding...")
-                        response_element = browser_instance.find_elements(*RESPONSE_CONTENT_SELECTOR)[-1]
-                        current_text = response_element.text
-                        last_text = ""
-
-                    if len(current_text) > len(last_text):
-                        new_text = current_text[len(last_text):]
-                        yield f'data: {json.dumps({"chunk": new_text})}\n\n'
-                        last_text = current_text
-                        last_data_time = time.time()
-
-                    if time.time() - last_data_time > INACTIVITY_TIMEOUT:
-                        logger.info(f"Stream complete: No new data for {INACTIVITY_TIMEOUT} seconds.")
-                        stream_completed = True
-                        break
-                    
-                    time.sleep(0.2)
-
-                final_text = response_element.text
-                if len(final_text) > len(last_text):
-                    new_text = final_text[len(last_text):]
-                    yield f'data: {json.dumps({"chunk": new_text})}\n\n'
-
-                status_message = "timeout" if not stream_completed else "complete"
-                yield f'data: {json.dumps({"status": status_message})}\n\n'
-
-            except Exception as e:
-                logger.error(f"An unexpected error occurred during the query stream: {e}", exc_info=True)
-                yield f'data: {json.dumps({"error": str(e)})}\n\n'
+@notebooklm_bp.route('/batch_query', methods=['POST'])
+def batch_query():
+    """
+    Runs a list of queries against one notebook in a single browser session: the notebook is
+    opened once and the questions are asked one after another in the same page.
+    Streams NDJSON: one record per query (answer, status, timings) and a final summary.
+    """
+    return _query_stream_response(JOB_KIND_BATCH)
 
-    return Response(stream_with_context(generate_response()), mimetype='text/event-stream')
+@notebooklm_bp.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queues a NotebookLM query and returns immediately with a job ID.
+    Body: the /process_query fields plus optional "mode" ("process" or "query"),
+    "priority" ("high", "normal", "low") and "client_id".
+    """
+    data = request.get_json()
+    kind = (data or {}).get('mode', JOB_KIND_PROCESS)
+    if kind not in (JOB_KIND_PROCESS, JOB_KIND_QUERY):
+        return jsonify({'error': f'mode must be one of {JOB_KIND_PROCESS}, {JOB_KIND_QUERY}'}), 400
+    params, priority, error_response = _parse_query_request(data, default_url=_default_url(kind))
+    if error_response:
+        return error_response
+
+    job = job_scheduler.submit(kind, _assign_trace(params), priority, _client_id(data), _coalesce_key(kind, params),
+                               keep_alive=True)
+    response = job.to_dict()
+    response['events_url'] = f"/api/jobs/{job.id}/events"
+    response['queue'] = job_scheduler.stats()
+    return jsonify(response), 202
+
+@notebooklm_bp.route('/jobs', methods=['GET'])
+def get_job_queue():
+    """Reports queue depth, running jobs and recent queue wait times."""
+    return jsonify(job_scheduler.stats())
+
+@notebooklm_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Returns a job's state and the answer text so far. ?wait=N blocks up to N seconds for it to finish."""
+    job = job_scheduler.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    wait = min(request.args.get('wait', 0, type=float), 60)
+    if wait > 0:
+        job.wait(wait)
+    return jsonify(job.to_dict(include_result=True))
+
+@notebooklm_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    """Streams a job's events as SSE, replaying from the start (or Last-Event-ID / ?from=) then following live."""
+    job = job_scheduler.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    start = resume_index(request.headers.get('Last-Event-ID', type=int), request.args.get('from', 0, type=int))
+    return _stream_job(job, start=start, format_event=format_sse_with_id, cancel_on_disconnect=False)
+
+@notebooklm_bp.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancels a queued job, or stops a running one at its next event."""
+    if not job_scheduler.cancel(job_id):
+        return jsonify({'error': 'Job not found or already finished'}), 404
+    return jsonify({'success': True, 'job_id': job_id})
 
 @notebooklm_bp.route('/status', methods=['GET'])
 def get_status():
-    """Endpoint 4: Checks the status of the browser instance."""
-    with browser_lock:
-        if browser_instance:
-            try:
-                current_url = browser_instance.current_url
-                page_title = browser_instance.title
-                status = 'ready'
-                if 'accounts.google.com' in current_url or 'signin' in current_url.lower():
-                    status = 'authentication_required'
-                
-                return jsonify({
-                    'browser_active': True,
-                    'status': status,
-                    'current_url': current_url,
-                    'page_title': page_title
-                })
-            except Exception as e:
-                logger.error(f"Error getting browser status: {e}")
-                return jsonify({'browser_active': False, 'status': 'error', 'error': str(e)}), 500
-        else:
-            return jsonify({'browser_active': False, 'status': 'inactive'})
+    """Endpoint 4: Reports the state of the browser pool without waiting for a free session."""
+    stats = browser_pool.stats()
+    sessions = stats['sessions']
+    if not sessions:
+        return jsonify({'browser_active': False, 'status': 'inactive', 'pool': stats, 'jobs': job_scheduler.stats(),
+                        'answer_cache': answer_cache.stats(), 'query_history': query_history.stats()})
+
+    status = 'ready'
+    current_url = next((s['current_url'] for s in sessions if s['current_url']), None)
+    if any(s['current_url'] and ('accounts.google.com' in s['current_url'] or 'signin' in s['current_url'].lower())
+           for s in sessions):
+        status = 'authentication_required'
+    elif not any(s['healthy'] for s in sessions):
+        status = 'error'
+    elif stats['idle'] == 0:
+        status = 'busy'
+
+    return jsonify({
+        'browser_active': True,
+        'status': status,
+        'current_url': current_url,
+        'pool': stats,
+        'jobs': job_scheduler.stats(),
+        'answer_cache': answer_cache.stats(),
+        'query_history': query_history.stats()
+    })
+
+def _history_limit():
+    try:
+        return max(1, min(int(request.args.get('limit', 20)), 100))
+    except ValueError:
+        return None
+
+@notebooklm_bp.route('/history', methods=['GET'])
+def get_history():
+    """Past queries, newest first. ?notebook_id filters; ?before=<id> pages further back."""
+    limit = _history_limit()
+    before = request.args.get('before')
+    if limit is None or (before is not None and not before.isdigit()):
+        return jsonify({'error': 'limit and before must be integers'}), 400
+    return jsonify(query_history.recent(request.args.get('notebook_id'), limit,
+                                        int(before) if before is not None else None))
+
+@notebooklm_bp.route('/history/search', methods=['GET'])
+def search_history():
+    """Full-text search over past queries and answers: ?q=<words>[&notebook_id=...][&limit=20]."""
+    search = request.args.get('q', '').strip()
+    if not search:
+        return jsonify({'error': 'q is required'}), 400
+    limit = _history_limit()
+    if limit is None:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify(query_history.search(search, request.args.get('notebook_id'), limit))
+
+@notebooklm_bp.route('/debug/trace/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """The span tree of a query's trace; its ID is in the first event of the stream."""
+    trace = tracer.get(trace_id)
+    if trace is None:
+        return jsonify({'error': 'Trace not found'}), 404
+    return jsonify(trace)
 
 @notebooklm_bp.route('/close_browser', methods=['POST'])
 def close_browser():
-    """Endpoint 3: Closes the browser instance."""
-    global browser_instance
-    with browser_lock:
-        if browser_instance:
-            try:
-                browser_instance.quit()
-                logger.info("Browser instance closed by API call.")
-            except Exception as e:
-                logger.error(f"Error closing browser: {e}")
-            finally:
-                browser_instance = None
-            return jsonify({'success': True, 'message': 'Browser closed successfully.'})
-        else:
-            return jsonify({'success': False, 'message': 'Browser was not active.'})
+    """Endpoint 3: Closes all browser sessions. Sessions serving a query close once it finishes."""
+    closed = browser_pool.close_idle()
+    if closed:
+        logger.info(f"Browser pool closed by API call ({closed} session(s)).")
+        return jsonify({'success': True, 'message': 'Browser closed successfully.'})
+    else:
+        return jsonify({'success': False, 'message': 'Browser was not active.'})
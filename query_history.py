@@ -0,0 +1,224 @@
+import os
+import re
+import time
+import queue
+import logging
+import threading
+from contextlib import nullcontext
+from typing import Optional
+
+from sqlalchemy import and_, text
+from sqlalchemy.exc import OperationalError
+
+from models import db, QueryHistory
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def fts_query(search: str) -> Optional[str]:
+    """
+    Turns free text into an FTS5 query: every word must match, the last one as a prefix.
+    Quoting each word keeps FTS5 operators and punctuation in user input from being parsed.
+    """
+    words = re.findall(r'\w+', search)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class QueryHistoryStore:
+    """
+    Records every NotebookLM query and its outcome in the app database.
+
+    ``record`` only puts the row on an in-memory queue, so the streaming path never waits
+    on disk. A background thread drains the queue and inserts rows in batches of up to
+    ``batch_size``, at most ``flush_interval`` seconds after they were recorded. When more
+    than ``max_queue`` rows are waiting (the database is stalled), new rows are dropped
+    and counted. Like ``db``, the store is bound to the Flask app with ``init_app``.
+    """
+
+    def __init__(self, enabled: bool = True, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_queue: int = 10000):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.app = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._has_fts = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.environ.get('QUERY_HISTORY_ENABLED', 'true').lower() not in ('0', 'false', 'no'),
+            batch_size=int(os.environ.get('QUERY_HISTORY_BATCH_SIZE', 100)),
+            flush_interval=float(os.environ.get('QUERY_HISTORY_FLUSH_INTERVAL', 0.5)),
+            max_queue=int(os.environ.get('QUERY_HISTORY_MAX_QUEUE', 10000))
+        )
+
+    def init_app(self, app):
+        self.app = app
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='query-history-writer', daemon=True)
+            self._thread.start()
+
+    def _app_context(self):
+        return self.app.app_context() if self.app is not None else nullcontext()
+
+    # --- Writing ---
+
+    def record(self, notebook_id: Optional[str], notebook_url: Optional[str], kind: str, query: str,
+               answer: str, status: str, error: Optional[str] = None, cached: bool = False,
+               duration: Optional[float] = None, first_chunk_seconds: Optional[float] = None):
+        """Queues one query for the writer thread. Never blocks."""
+        if not self.enabled or self.app is None:
+            return
+        row = {
+            'notebook_id': notebook_id,
+            'notebook_url': notebook_url,
+            'kind': kind,
+            'query_text': query,
+            'answer': answer or '',
+            'status': status,
+            'error': error,
+            'cached': cached,
+            'duration': duration,
+            'first_chunk_seconds': first_chunk_seconds,
+            'created_at': time.time()
+        }
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning("Query history queue is full; dropping a record.")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch, waiters, stop = [], [], False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if isinstance(item, threading.Event):
+                    # flush(): write what is queued now, then wake the caller.
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _write(self, rows):
+        with self._app_context():
+            try:
+                db.session.execute(db.insert(QueryHistory), rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                with self._lock:
+                    self.failed += len(rows)
+                logger.error(f"Could not write {len(rows)} query history record(s): {e}")
+                return
+        with self._lock:
+            self.written += len(rows)
+
+    def flush(self, timeout: float = 5) -> bool:
+        """Blocks until everything recorded so far is written. Mostly for tests and shutdown."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def shutdown(self, timeout: float = 5):
+        """Writes the remaining records and stops the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    # --- Reading (within an app context) ---
+
+    def recent(self, notebook_id: Optional[str] = None, limit: int = 20, before_id: Optional[int] = None):
+        """Most recent queries first; ``before_id`` pages further back."""
+        query = QueryHistory.query
+        if notebook_id:
+            query = query.filter(QueryHistory.notebook_id == notebook_id)
+        if before_id is not None:
+            query = query.filter(QueryHistory.id < before_id)
+        return [row.to_dict() for row in query.order_by(QueryHistory.id.desc()).limit(limit)]
+
+    def search(self, search: str, notebook_id: Optional[str] = None, limit: int = 20):
+        """Past queries whose question or answer match ``search``, best match first."""
+        match = fts_query(search)
+        if match is None:
+            return []
+        if self._fts_available():
+            try:
+                return self._search_fts(match, notebook_id, limit)
+            except OperationalError as e:
+                db.session.rollback()
+                logger.warning(f"Full-text history search failed, falling back to LIKE: {e}")
+        return self._search_like(search, notebook_id, limit)
+
+    def _fts_available(self) -> bool:
+        if self._has_fts is None:
+            self._has_fts = db.engine.dialect.name == 'sqlite' and db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'query_history_fts'")).first() is not None
+        return self._has_fts
+
+    def _search_fts(self, match, notebook_id, limit):
+        sql = ("SELECT query_history_fts.rowid AS id, "
+               "snippet(query_history_fts, 1, '<mark>', '</mark>', '…', 24) AS snippet "
+               "FROM query_history_fts JOIN query_history ON query_history.id = query_history_fts.rowid "
+               "WHERE query_history_fts MATCH :match")
+        params = {'match': match, 'limit': limit}
+        if notebook_id:
+            sql += " AND query_history.notebook_id = :notebook_id"
+            params['notebook_id'] = notebook_id
+        sql += " ORDER BY query_history_fts.rank LIMIT :limit"
+        hits = db.session.execute(text(sql), params).all()
+        rows = {row.id: row for row in QueryHistory.query.filter(QueryHistory.id.in_([hit.id for hit in hits]))}
+        return [dict(rows[hit.id].to_dict(), snippet=hit.snippet) for hit in hits if hit.id in rows]
+
+    def _search_like(self, search, notebook_id, limit):
+        conditions = [QueryHistory.query_text.ilike(f'%{word}%') | QueryHistory.answer.ilike(f'%{word}%')
+                      for word in re.findall(r'\w+', search)]
+        query = QueryHistory.query.filter(and_(*conditions))
+        if notebook_id:
+            query = query.filter(QueryHistory.notebook_id == notebook_id)
+        return [row.to_dict() for row in query.order_by(QueryHistory.id.desc()).limit(limit)]
+
+    def stats(self):
+        with self._lock:
+            written, dropped, failed = self.written, self.dropped, self.failed
+        return {
+            'enabled': self.enabled,
+            'queued': self._queue.qsize(),
+            'written': written,
+            'dropped': dropped,
+            'failed': failed
+        }
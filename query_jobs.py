@@ -0,0 +1,370 @@
+import time
+import asyncio
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import closing
+from typing import AsyncIterator, Callable, Dict, Hashable, Iterator, List, Optional
+
+from metrics import ERRORS_TOTAL, JOB_QUEUE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, highest first. Dispatch is strict between classes and round-robin
+# between clients within a class, so one busy client cannot starve the others.
+PRIORITIES = ('high', 'normal', 'low')
+DEFAULT_PRIORITY = 'normal'
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+
+class QueryJob:
+    """
+    A NotebookLM query submitted to the scheduler.
+
+    Every event produced while the job runs (status updates, chunks, errors) is appended
+    to ``events``. Any number of subscribers can replay them from an offset with
+    ``iter_events`` and then follow the live tail until the job finishes.
+
+    Streaming clients ``attach`` while they relay the job and ``detach`` when they stop;
+    a job nobody is following any more can be cancelled, unless it is ``keep_alive``
+    (submitted through the job API, where the result is fetched later).
+    """
+
+    def __init__(self, kind: str, params: dict, priority: str = DEFAULT_PRIORITY, client_id: str = 'anonymous'):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.priority = priority
+        self.client_id = client_id
+        self.state = JOB_QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+        self.coalesce_key: Optional[Hashable] = None
+        self.coalesced = 0
+        self.keep_alive = False
+        self.subscribers = 0
+        self.events: List[dict] = []
+        self._cond = threading.Condition()
+        # (event loop, asyncio.Event) pairs of coroutine subscribers waiting for the next event.
+        self._async_waiters = []
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def publish(self, event: dict):
+        with self._cond:
+            if 'error' in event and self.error is None:
+                self.error = event['error']
+            self.events.append(event)
+            self._cond.notify_all()
+            self._wake_async_waiters()
+
+    def _set_state(self, state: str):
+        with self._cond:
+            self.state = state
+            if state == JOB_RUNNING:
+                self.started_at = time.time()
+            elif state in FINISHED_STATES:
+                self.finished_at = time.time()
+            self._cond.notify_all()
+            self._wake_async_waiters()
+
+    def _wake_async_waiters(self):
+        """Caller holds the lock."""
+        for loop, wakeup in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass  # The subscriber's event loop has been closed.
+        self._async_waiters = []
+
+    def attach(self):
+        with self._cond:
+            self.subscribers += 1
+
+    def detach(self) -> bool:
+        """Returns True if this was the last subscriber and nothing else needs the job."""
+        with self._cond:
+            self.subscribers -= 1
+            return self.subscribers <= 0 and not self.keep_alive
+
+    def iter_events(self, start: int = 0) -> Iterator[dict]:
+        """Yields events from index ``start`` onwards, blocking for new ones until the job finishes."""
+        index = start
+        while True:
+            with self._cond:
+                while index >= len(self.events) and not self.finished:
+                    self._cond.wait()
+                batch = self.events[index:]
+                finished = self.finished
+            for event in batch:
+                index += 1
+                yield event
+            if finished and index >= len(self.events):
+                return
+
+    async def aiter_events(self, start: int = 0) -> AsyncIterator[dict]:
+        """Like ``iter_events`` but waits on the event loop, so an idle subscriber holds no thread."""
+        loop = asyncio.get_running_loop()
+        index = start
+        while True:
+            wakeup = None
+            with self._cond:
+                batch = self.events[index:]
+                finished = self.finished
+                if not batch and not finished:
+                    wakeup = asyncio.Event()
+                    self._async_waiters.append((loop, wakeup))
+            for event in batch:
+                index += 1
+                yield event
+            if wakeup is not None:
+                await wakeup.wait()
+            elif finished and index >= len(self.events):
+                return
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until the job finishes. Returns False if ``timeout`` expired first."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout)
+
+    def result_text(self) -> str:
+        with self._cond:
+            return ''.join(event['chunk'] for event in self.events if 'chunk' in event)
+
+    def to_dict(self, include_result: bool = False):
+        with self._cond:
+            data = {
+                'job_id': self.id,
+                'kind': self.kind,
+                'state': self.state,
+                'priority': self.priority,
+                'client_id': self.client_id,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'wait_seconds': (self.started_at or time.time()) - self.created_at,
+                'event_count': len(self.events),
+                'coalesced': self.coalesced,
+                'error': self.error,
+                'trace_id': self.params.get('trace_id'),
+            }
+            if self.events and 'status' in self.events[-1]:
+                data['last_status'] = self.events[-1]['status']
+        if include_result:
+            data['result'] = self.result_text()
+        return data
+
+
+class JobScheduler:
+    """
+    Queues QueryJobs and runs them on a fixed set of worker threads.
+
+    ``runners`` maps a job kind to a callable that takes the job's params and returns an
+    iterator of event dicts; the runner is responsible for leasing a browser session.
+    ``workers`` should match the number of browser sessions available, so a job is only
+    dispatched when a session can serve it. Workers are started on the first submit.
+
+    Jobs submitted with a ``coalesce_key`` are single-flight: while one with the same key
+    is queued or running, identical submissions return that job instead of a new one, and
+    their clients replay its events so far before following the live tail.
+    """
+
+    def __init__(self, runners: Dict[str, Callable[[dict], Iterator[dict]]], workers: int = 1,
+                 result_ttl: float = 3600):
+        self.runners = runners
+        self.worker_count = max(1, workers)
+        self.result_ttl = result_ttl
+
+        self._cond = threading.Condition()
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._jobs: Dict[str, QueryJob] = {}
+        self._inflight: Dict[Hashable, QueryJob] = {}
+        self._coalesced_total = 0
+        self._workers: List[threading.Thread] = []
+        self._running = 0
+        self._recent_waits = deque(maxlen=100)
+        self._closed = False
+
+    # --- Submission ---
+
+    def submit(self, kind: str, params: dict, priority: str = DEFAULT_PRIORITY,
+               client_id: Optional[str] = None, coalesce_key: Optional[Hashable] = None,
+               keep_alive: bool = False) -> QueryJob:
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        with self._cond:
+            existing = self._inflight.get(coalesce_key) if coalesce_key is not None else None
+            if existing is not None and not existing.finished and not existing.cancel_requested:
+                existing.coalesced += 1
+                existing.keep_alive = existing.keep_alive or keep_alive
+                self._coalesced_total += 1
+                logger.info(f"Coalesced request from client '{client_id}' into in-flight job {existing.id}.")
+                return existing
+            job = QueryJob(kind, params, priority, client_id or 'anonymous')
+            job.coalesce_key = coalesce_key
+            job.keep_alive = keep_alive
+            if coalesce_key is not None:
+                self._inflight[coalesce_key] = job
+            self._prune()
+            self._jobs[job.id] = job
+            self._queues[priority].setdefault(job.client_id, deque()).append(job)
+            # Published before any worker can pick the job up, so it is always the first event.
+            queued = {'status': JOB_QUEUED, 'job_id': job.id, 'queue_depth': self._queued_count()}
+            if params.get('trace_id'):
+                queued['trace_id'] = params['trace_id']
+            job.publish(queued)
+            self._cond.notify()
+        self._ensure_workers()
+        return job
+
+    def get(self, job_id: str) -> Optional[QueryJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a queued job immediately or asks a running job to stop. Returns False if unknown or finished."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.cancel_requested = True
+            client_queue = self._queues[job.priority].get(job.client_id)
+            dequeued = client_queue is not None and job in client_queue
+            if dequeued:
+                client_queue.remove(job)
+                if not client_queue:
+                    del self._queues[job.priority][job.client_id]
+        if dequeued:
+            job.publish({'status': JOB_CANCELLED})
+            self._finish(job, JOB_CANCELLED)
+        return True
+
+    # --- Dispatch ---
+
+    def _queued_count(self) -> int:
+        return sum(len(jobs) for queue in self._queues.values() for jobs in queue.values())
+
+    def _next_job(self) -> Optional[QueryJob]:
+        """Pops the next job: highest priority first, round-robin across clients. Caller holds the lock."""
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            client_id, jobs = next(iter(queue.items()))
+            job = jobs.popleft()
+            if jobs:
+                queue.move_to_end(client_id)
+            else:
+                del queue[client_id]
+            return job
+        return None
+
+    def _ensure_workers(self):
+        with self._cond:
+            while len(self._workers) < self.worker_count:
+                worker = threading.Thread(target=self._worker_loop, name=f"query-job-worker-{len(self._workers)}",
+                                          daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+                self._running += 1
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+    def _run(self, job: QueryJob):
+        job._set_state(JOB_RUNNING)
+        with self._cond:
+            self._recent_waits.append(job.started_at - job.created_at)
+        JOB_QUEUE_WAIT_SECONDS.observe(job.started_at - job.created_at, kind=job.kind)
+        if job.cancel_requested:
+            # Cancelled between being dequeued and starting.
+            job.publish({'status': JOB_CANCELLED})
+            self._finish(job, JOB_CANCELLED)
+            return
+        logger.info(f"Running {job.kind} job {job.id} for client '{job.client_id}' ({job.priority} priority).")
+        try:
+            with closing(iter(self.runners[job.kind](job.params))) as events:
+                for event in events:
+                    job.publish(event)
+                    if job.cancel_requested:
+                        logger.info(f"Job {job.id} cancelled while running.")
+                        break
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            ERRORS_TOTAL.inc(type=type(e).__name__)
+            job.publish({'error': str(e)})
+        if job.cancel_requested:
+            job.publish({'status': JOB_CANCELLED})
+            self._finish(job, JOB_CANCELLED)
+        else:
+            self._finish(job, JOB_FAILED if job.error else JOB_COMPLETED)
+
+    def _finish(self, job: QueryJob, state: str):
+        # Stop coalescing before the job is marked finished, so late identical requests start a new one.
+        with self._cond:
+            if self._inflight.get(job.coalesce_key) is job:
+                del self._inflight[job.coalesce_key]
+        job._set_state(state)
+
+    def _prune(self):
+        """Forgets finished jobs older than ``result_ttl``. Caller holds the lock."""
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    # --- Introspection ---
+
+    def stats(self):
+        now = time.time()
+        with self._cond:
+            queued_by_priority = {p: sum(len(jobs) for jobs in self._queues[p].values()) for p in PRIORITIES}
+            queued_jobs = [job for queue in self._queues.values() for jobs in queue.values() for job in jobs]
+            waits = list(self._recent_waits)
+            return {
+                'queue_depth': sum(queued_by_priority.values()),
+                'queued_by_priority': queued_by_priority,
+                'clients_waiting': len({job.client_id for job in queued_jobs}),
+                'oldest_queued_seconds': max((now - job.created_at for job in queued_jobs), default=0),
+                'running': self._running,
+                'inflight_coalescable': len(self._inflight),
+                'coalesced_requests': self._coalesced_total,
+                'workers': self.worker_count,
+                'recent_wait_seconds': {
+                    'avg': sum(waits) / len(waits) if waits else 0,
+                    'max': max(waits, default=0),
+                    'samples': len(waits),
+                },
+                'jobs_tracked': len(self._jobs),
+            }
@@ -0,0 +1,435 @@
+import math
+import time
+import logging
+
+from selenium.common.exceptions import StaleElementReferenceException, WebDriverException
+from selenium.webdriver.common.by import By
+
+logger = logging.getLogger(__name__)
+
+STREAM_MODE_POLL = 'poll'
+STREAM_MODE_OBSERVER = 'observer'
+STREAM_MODES = (STREAM_MODE_POLL, STREAM_MODE_OBSERVER)
+
+END_REASON_INACTIVITY = 'inactivity_timeout'
+END_REASON_TIMEOUT = 'timeout'
+
+# Records which "still generating" indicators and "answer finished" controls are visible
+# when streaming starts, and defines check(), which returns the name of the first
+# completion signal seen since then (e.g. 'stop_button_gone', 'copy_button') or null.
+# Indicators only count once they have been seen and then disappear, and controls only
+# count when more of them exist than at the start, so earlier answers do not end a stream.
+INSTALL_COMPLETION_SCRIPT = """
+var generating = arguments[0], finished = arguments[1];
+function count(css) {
+    try { return document.querySelectorAll(css).length; } catch (e) { return 0; }
+}
+var state = window.__nlmCompletion = {seen: {}, baseline: {}};
+finished.forEach(function (f) { state.baseline[f[0]] = count(f[1]); });
+state.check = function () {
+    var active = false;
+    generating.forEach(function (g) {
+        if (count(g[1])) { state.seen[g[0]] = true; active = true; }
+    });
+    if (active) { return null; }
+    for (var i = 0; i < generating.length; i++) {
+        if (state.seen[generating[i][0]]) { return generating[i][0] + '_gone'; }
+    }
+    for (var j = 0; j < finished.length; j++) {
+        if (count(finished[j][1]) > state.baseline[finished[j][0]]) { return finished[j][0]; }
+    }
+    return null;
+};
+state.check();
+return true;
+"""
+
+# Installs a MutationObserver that buffers text appended to the newest response element.
+# The latest element is re-queried on every mutation batch, so NotebookLM replacing the
+# node mid-answer does not break the stream the way a stale WebElement would. A pending
+# drain is also woken when a completion signal appears.
+INSTALL_OBSERVER_SCRIPT = """
+var selector = arguments[0];
+var previous = window.__nlmStream;
+if (previous && previous.observer) { previous.observer.disconnect(); }
+var state = window.__nlmStream = {buffer: [], sent: 0, waiter: null, observer: null};
+function latest() {
+    var els = document.querySelectorAll(selector);
+    return els.length ? els[els.length - 1] : null;
+}
+function wake() {
+    if (state.waiter) { var waiter = state.waiter; state.waiter = null; waiter(); }
+}
+function capture() {
+    var el = latest();
+    var text = el ? el.innerText : '';
+    if (text.length > state.sent) {
+        state.buffer.push(text.slice(state.sent));
+        state.sent = text.length;
+        wake();
+    } else if (state.waiter && window.__nlmCompletion) {
+        var signal = window.__nlmCompletion.check();
+        if (signal && signal !== state.knownSignal) { wake(); }
+    }
+}
+state.observer = new MutationObserver(capture);
+state.observer.observe(document.body, {childList: true, subtree: true, characterData: true});
+capture();
+return true;
+"""
+
+# Long-poll drain: resolves immediately if text is buffered, otherwise as soon as the
+# observer captures more text or a completion signal the caller has not seen yet
+# (``knownSignal``), or after waitMs. Returns null if the observer is gone (e.g. the page
+# navigated), which makes the caller fall back to polling.
+DRAIN_OBSERVER_SCRIPT = """
+var waitMs = arguments[0];
+var callback = arguments[arguments.length - 1];
+var state = window.__nlmStream;
+if (!state) { callback(null); return; }
+state.knownSignal = arguments[1];
+function currentSignal() { return window.__nlmCompletion ? window.__nlmCompletion.check() : null; }
+function flush() {
+    var out = state.buffer.join('');
+    state.buffer = [];
+    callback({delta: out, done: currentSignal()});
+}
+var signal = currentSignal();
+if (state.buffer.length || (signal && signal !== state.knownSignal)) { flush(); return; }
+var timer = setTimeout(function () { state.waiter = null; flush(); }, waitMs);
+state.waiter = function () { clearTimeout(timer); flush(); };
+"""
+
+# Long-poll for the first text of a new answer: resolves with the newest element matching
+# ``selector`` once there are more than ``initialCount`` of them and it has text, or with
+# null after waitMs. A MutationObserver wakes it, so the first chunk is seen as soon as it
+# is rendered rather than on the next poll.
+WAIT_FOR_RESPONSE_SCRIPT = """
+var selector = arguments[0], initialCount = arguments[1], waitMs = arguments[2];
+var callback = arguments[arguments.length - 1];
+function found() {
+    var els = document.querySelectorAll(selector);
+    if (els.length <= initialCount) { return null; }
+    var el = els[els.length - 1];
+    return el.innerText.trim() ? el : null;
+}
+var el = found();
+if (el) { callback(el); return; }
+var timer = null;
+var observer = new MutationObserver(function () {
+    var el = found();
+    if (el) { observer.disconnect(); clearTimeout(timer); callback(el); }
+});
+observer.observe(document.body, {childList: true, subtree: true, characterData: true});
+timer = setTimeout(function () { observer.disconnect(); callback(null); }, waitMs);
+"""
+
+# Returns only the answer text after ``offset`` so each poll transfers the new characters
+# instead of the whole answer. If the element reference is missing or detached, the
+# newest element matching ``selector`` is used and returned so the caller can keep it.
+READ_TEXT_DELTA_SCRIPT = """
+var el = arguments[0], selector = arguments[1], offset = arguments[2];
+if (!el || !el.isConnected) {
+    var els = document.querySelectorAll(selector);
+    el = els.length ? els[els.length - 1] : null;
+}
+if (!el) { return null; }
+var text = el.innerText;
+return {
+    delta: text.length > offset ? text.slice(offset) : '',
+    length: text.length,
+    element: el,
+    done: window.__nlmCompletion ? window.__nlmCompletion.check() : null
+};
+"""
+
+REMOVE_OBSERVER_SCRIPT = """
+var state = window.__nlmStream;
+if (state && state.observer) { state.observer.disconnect(); }
+delete window.__nlmStream;
+delete window.__nlmCompletion;
+"""
+
+
+def install_completion_detector(driver, completion_selectors) -> bool:
+    """
+    Installs INSTALL_COMPLETION_SCRIPT for ``completion_selectors`` (generating, finished).
+    Call it before the query is submitted, so that the baseline of finished answers does not
+    include the new one if it completes before streaming starts. Returns False if it failed.
+    """
+    generating, finished = completion_selectors
+    try:
+        driver.execute_script(INSTALL_COMPLETION_SCRIPT, [list(g) for g in generating], [list(f) for f in finished])
+        return True
+    except WebDriverException as e:
+        logger.warning(f"Could not install completion detector, using inactivity timeout only: {e}")
+        return False
+
+
+def wait_for_new_response(driver, css_selector: str, initial_count: int, timeout: float, wait_ms: int = 5000):
+    """
+    Waits in the page for a new response element with text (see WAIT_FOR_RESPONSE_SCRIPT).
+    Each call blocks for at most ``wait_ms``, well under the WebDriver script timeout.
+    Returns the element, or None after ``timeout`` seconds.
+    """
+    deadline = time.time() + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        element = driver.execute_async_script(WAIT_FOR_RESPONSE_SCRIPT, css_selector, initial_count,
+                                              math.ceil(min(wait_ms, remaining * 1000)))
+        if element:
+            return element
+
+
+class ObserverUnavailable(Exception):
+    """Raised when the in-page observer cannot be installed or has disappeared."""
+
+
+class ResponseStream:
+    """
+    Streams the text of a NotebookLM answer as it is generated.
+
+    ``iter_chunks`` yields newly generated text until the page signals that the answer
+    is finished, the answer stops growing for ``inactivity_timeout`` seconds, or
+    ``timeout`` expires. Afterwards ``completed`` tells whether the answer finished (as
+    opposed to timing out), ``end_reason`` which signal ended it, and ``text_length``
+    how many characters have been emitted.
+
+    Completion signals come from ``completion_selectors``, a pair of
+    ``[(name, css), ...]`` lists: indicators shown while NotebookLM is generating, and
+    controls that appear once the answer is done. A signal must hold for
+    ``completion_settle`` seconds without new text before the stream ends.
+
+    Polling is adaptive: the interval drops to ``min_poll_interval`` while text is
+    growing and backs off towards ``max_poll_interval`` while the answer is idle.
+
+    Pass ``completion_selectors`` only if the detector is not installed yet; installing it
+    here resets its baseline (see ``install_completion_detector``).
+    """
+
+    min_poll_interval = 0.05
+    max_poll_interval = 1.0
+    poll_backoff = 1.5
+    completion_settle = 0.5
+
+    def __init__(self, driver, response_element, selector, completion_selectors=None):
+        self.driver = driver
+        self.response_element = response_element
+        self.selector = selector
+        self.text_length = 0
+        self.completed = False
+        self.end_reason = None
+        self.poll_interval = self.min_poll_interval
+        # Latest completion signal reported by the page, and since when it has held.
+        self.completion_signal = None
+        self._signal_since = None
+        if completion_selectors:
+            install_completion_detector(self.driver, completion_selectors)
+
+    def _read_new_text(self) -> str:
+        raise NotImplementedError
+
+    def _adapt_poll_interval(self, received_text: bool):
+        if received_text:
+            self.poll_interval = self.min_poll_interval
+        else:
+            self.poll_interval = min(self.max_poll_interval, self.poll_interval * self.poll_backoff)
+
+    def _pause(self):
+        time.sleep(self.poll_interval)
+
+    def close(self):
+        try:
+            self.driver.execute_script(REMOVE_OBSERVER_SCRIPT)
+        except WebDriverException:
+            pass
+
+    def _completion_settled(self, received_text: bool) -> bool:
+        """
+        True once a completion signal has held for ``completion_settle`` seconds without new text.
+        A signal that arrives with the last text starts the settle period right away.
+        """
+        if not self.completion_signal:
+            self._signal_since = None
+            return False
+        if received_text or self._signal_since is None:
+            self._signal_since = time.time()
+            return False
+        return time.time() - self._signal_since >= self.completion_settle
+
+    def _settle_remaining(self) -> float:
+        """Seconds until the current completion signal has settled (the full period if it has not started)."""
+        if self._signal_since is None:
+            return self.completion_settle
+        return max(0.0, self.completion_settle - (time.time() - self._signal_since))
+
+    def iter_chunks(self, timeout, inactivity_timeout):
+        end_time = time.time() + timeout
+        last_data_time = time.time()
+        self.end_reason = END_REASON_TIMEOUT
+        try:
+            while time.time() < end_time:
+                new_text = self._read_new_text()
+                self._adapt_poll_interval(bool(new_text))
+                if new_text:
+                    self.text_length += len(new_text)
+                    last_data_time = time.time()
+                    yield new_text
+
+                if self._completion_settled(bool(new_text)):
+                    logger.info(f"Stream complete: page signalled '{self.completion_signal}'.")
+                    self.completed = True
+                    self.end_reason = self.completion_signal
+                    break
+
+                if time.time() - last_data_time > inactivity_timeout:
+                    logger.info(f"Stream complete: No new data for {inactivity_timeout} seconds.")
+                    self.completed = True
+                    self.end_reason = END_REASON_INACTIVITY
+                    break
+
+                self._pause()
+
+            final_text = self._read_final_text()
+            if final_text:
+                self.text_length += len(final_text)
+                yield final_text
+        finally:
+            self.close()
+
+    def _read_final_text(self) -> str:
+        return self._read_new_text()
+
+    # --- Polling primitives shared by all modes ---
+
+    def _current_text(self) -> str:
+        """Reads the full answer text over WebDriver, re-acquiring the element if it went stale."""
+        try:
+            return self.response_element.text
+        except StaleElementReferenceException:
+            logger.warning("Stale element detected during streaming. Attempting to re-acquire...")
+            try:
+                # Give DOM a moment to settle
+                time.sleep(0.5)
+                elements = self.driver.find_elements(*self.selector)
+                if elements:
+                    self.response_element = elements[-1]
+                    return self.response_element.text
+                logger.warning("Could not find any response elements during recovery.")
+            except Exception as e:
+                logger.warning(f"Failed to re-acquire element or get text: {e}")
+        return ''
+
+    def _fetch_delta(self, offset):
+        """
+        Runs READ_TEXT_DELTA_SCRIPT. A stale element reference is dropped and the newest
+        response element is resolved in the page instead, keeping the same offset.
+        """
+        by, value = self.selector
+        try:
+            return self.driver.execute_script(READ_TEXT_DELTA_SCRIPT, self.response_element, value, offset)
+        except StaleElementReferenceException:
+            logger.warning("Stale element detected during streaming. Re-acquiring by selector...")
+            self.response_element = None
+            return self.driver.execute_script(READ_TEXT_DELTA_SCRIPT, None, value, offset)
+
+    def _poll_new_text(self, already_read=0) -> str:
+        """Returns the text beyond what has been emitted (plus ``already_read`` pending characters)."""
+        offset = self.text_length + already_read
+        if self.selector[0] != By.CSS_SELECTOR:
+            current_text = self._current_text()
+            return current_text[offset:] if len(current_text) > offset else ''
+
+        try:
+            result = self._fetch_delta(offset)
+        except WebDriverException as e:
+            logger.warning(f"Failed to fetch response text: {e}")
+            return ''
+        if not result:
+            logger.warning("Could not find any response elements while streaming.")
+            return ''
+        self.response_element = result.get('element') or self.response_element
+        self.completion_signal = result.get('done')
+        if result['length'] < offset:
+            # The answer was re-rendered shorter than what we already sent; keep the offset
+            # rather than re-sending text the client already has.
+            logger.debug(f"Response text shrank from {offset} to {result['length']} characters.")
+        return result['delta']
+
+
+class PollingResponseStream(ResponseStream):
+    """Fetches only the characters after the emitted offset on every tick."""
+
+    def _read_new_text(self) -> str:
+        return self._poll_new_text()
+
+
+class ObserverResponseStream(ResponseStream):
+    """
+    Receives text pushed by an in-page MutationObserver. Each tick is one async script
+    call that returns as soon as new text or a completion signal is captured, so there is
+    no fixed polling delay. If the observer disappears, streaming continues by polling
+    from the same offset.
+    """
+
+    drain_wait_ms = 1000
+
+    def __init__(self, driver, response_element, selector, completion_selectors=None):
+        by, value = selector
+        if by != By.CSS_SELECTOR:
+            raise ObserverUnavailable("The response observer requires a CSS selector.")
+        super().__init__(driver, response_element, selector, completion_selectors)
+        try:
+            self.driver.execute_script(INSTALL_OBSERVER_SCRIPT, value)
+        except WebDriverException as e:
+            raise ObserverUnavailable(str(e)) from e
+        self.observing = True
+
+    def _drain(self, wait_ms=None):
+        """Returns buffered text from the observer, or None if it is no longer available."""
+        if wait_ms is None:
+            # Once the page signals completion, the drain returns early only for new text (the
+            # signal is already known), so wait no longer than the rest of the settle period.
+            wait_ms = self._settle_remaining() * 1000 if self.completion_signal else self.drain_wait_ms
+        try:
+            result = self.driver.execute_async_script(DRAIN_OBSERVER_SCRIPT, math.ceil(wait_ms), self.completion_signal)
+        except WebDriverException as e:
+            logger.warning(f"Response observer drain failed: {e}")
+            return None
+        if result is None:
+            return None
+        self.completion_signal = result.get('done')
+        return result['delta']
+
+    def _read_new_text(self) -> str:
+        if self.observing:
+            new_text = self._drain()
+            if new_text is not None:
+                return new_text
+            logger.warning("Response observer is gone; falling back to polling.")
+            self.observing = False
+        return self._poll_new_text()
+
+    def _pause(self):
+        # The drain call already blocks in the browser until text arrives.
+        if not self.observing:
+            super()._pause()
+
+    def _read_final_text(self) -> str:
+        # Anything buffered but not yet drained, then a direct read to catch text the
+        # observer could not see (e.g. changes after it was disconnected).
+        text = (self._drain(wait_ms=0) or '') if self.observing else ''
+        return text + self._poll_new_text(already_read=len(text))
+
+
+def open_response_stream(driver, response_element, selector, mode=STREAM_MODE_OBSERVER,
+                         completion_selectors=None) -> ResponseStream:
+    """Creates a response stream for ``mode``, falling back to polling if the observer cannot be installed."""
+    if mode == STREAM_MODE_OBSERVER:
+        try:
+            return ObserverResponseStream(driver, response_element, selector, completion_selectors)
+        except ObserverUnavailable as e:
+            logger.warning(f"Could not install response observer, polling instead: {e}")
+    return PollingResponseStream(driver, response_element, selector, completion_selectors)
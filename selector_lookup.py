@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from selenium.webdriver.common.by import By
+
+logger = logging.getLogger(__name__)
+
+BATCHABLE_STRATEGIES = (By.CSS_SELECTOR, By.XPATH)
+# Weight kept by a selector's hit rate on each lookup of its list. The rate follows the last
+# few dozen lookups, so a UI change reorders a list within a handful of misses.
+HIT_RATE_DECAY = 0.9
+
+# Evaluates a whole selector list in one WebDriver call and returns [element, index] for
+# the first selector that matches, or null. With ``clickable`` set, matches must also be
+# rendered and enabled, mirroring EC.element_to_be_clickable.
+FIND_FIRST_MATCH_SCRIPT = """
+var selectors = arguments[0], clickable = arguments[1];
+function usable(el) {
+    if (!clickable) { return true; }
+    var rect = el.getBoundingClientRect();
+    var style = window.getComputedStyle(el);
+    return rect.width > 0 && rect.height > 0 && style.visibility !== 'hidden'
+        && style.display !== 'none' && !el.disabled;
+}
+for (var i = 0; i < selectors.length; i++) {
+    var by = selectors[i][0], value = selectors[i][1], el = null;
+    try {
+        if (by === 'css selector') {
+            el = document.querySelector(value);
+        } else if (by === 'xpath') {
+            el = document.evaluate(value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        }
+    } catch (e) {
+        el = null;
+    }
+    if (el && usable(el)) { return [el, i]; }
+}
+return null;
+"""
+
+
+class SelectorOrderCache:
+    """
+    Remembers which selectors match and orders selector lists so that the selector that
+    usually works is tried first, including after a restart.
+
+    Stats are kept per selector and per list, since lists share selectors (the chat input is
+    also a load indicator), as ``{"hits": n, "rate": r, "last_hit": timestamp}``, where
+    ``rate`` is the share of recent lookups of the list that the selector answered (an
+    exponentially weighted average, see HIT_RATE_DECAY). Lists are ordered by rate, then
+    by the most recent hit. They are persisted as JSON to ``path`` whenever the preferred
+    selector of a list changes.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._load()
+
+    @classmethod
+    def from_env(cls):
+        default_path = os.path.join(os.path.dirname(__file__), 'database', 'selector_cache.json')
+        return cls(os.environ.get('SELECTOR_CACHE_PATH') or default_path)
+
+    @staticmethod
+    def _key(selectors: List[Tuple[str, str]], selector: Tuple[str, str]) -> str:
+        """``<list>|<by>:<value>``; the list is identified by a digest of the selectors it holds."""
+        digest = hashlib.sha1('\n'.join(f"{by}:{value}" for by, value in selectors).encode()).hexdigest()[:12]
+        by, value = selector
+        return f"{digest}|{by}:{value}"
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                stats = json.load(f)
+            # Files from before stats were kept per list have keys without a list digest.
+            self._stats = {key: value for key, value in stats.items() if '|' in key}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load selector cache from {self.path}: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._stats, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save selector cache to {self.path}: {e}")
+
+    def _rank(self, selectors: List[Tuple[str, str]], selector: Tuple[str, str]) -> Tuple[float, float]:
+        """Sort key within ``selectors``, higher is better: the hit rate, with the most recent hit breaking ties."""
+        stats = self._stats.get(self._key(selectors, selector), {})
+        return stats.get('rate', 0), stats.get('last_hit', 0)
+
+    def ordered(self, selectors: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Returns ``selectors`` with the highest hit rates first; ties keep list order."""
+        with self._lock:
+            ranks = [self._rank(selectors, s) for s in selectors]
+        order = sorted(range(len(selectors)), key=lambda i: (-ranks[i][0], -ranks[i][1], i))
+        return [selectors[i] for i in order]
+
+    def record_hit(self, selectors: List[Tuple[str, str]], selector: Tuple[str, str]):
+        """Records that ``selector`` matched when looking up ``selectors``; the others in the list missed."""
+        with self._lock:
+            previous_first = self._preferred(selectors)
+            for other in selectors:
+                stats = self._stats.get(self._key(selectors, other))
+                if stats is not None and other != selector:
+                    stats['rate'] = stats.get('rate', 0) * HIT_RATE_DECAY
+            stats = self._stats.setdefault(self._key(selectors, selector), {'hits': 0, 'rate': 0, 'last_hit': 0})
+            stats['rate'] = stats['rate'] * HIT_RATE_DECAY + (1 - HIT_RATE_DECAY)
+            stats['hits'] += 1
+            stats['last_hit'] = time.time()
+            preferred = self._preferred(selectors)
+            if preferred != previous_first:
+                logger.info(f"Selector {preferred} is now preferred for lookups.")
+                self._save()
+
+    def _preferred(self, selectors):
+        best = max(selectors, key=lambda s: self._rank(selectors, s))
+        return best if self._stats.get(self._key(selectors, best)) else None
+
+    def stats(self):
+        with self._lock:
+            return {key: dict(value) for key, value in self._stats.items()}
+
+
+def find_first_match(driver, selectors, clickable=False):
+    """
+    Looks up all ``selectors`` in a single ``execute_script`` call.
+    Returns ``(element, selector)`` for the first match or ``(None, None)``.
+    Raises ValueError for locator strategies that cannot be evaluated in the page.
+    """
+    if any(by not in BATCHABLE_STRATEGIES for by, _ in selectors):
+        raise ValueError("Only CSS and XPath selectors can be looked up in one call.")
+    result = driver.execute_script(FIND_FIRST_MATCH_SCRIPT, [list(s) for s in selectors], clickable)
+    if not result:
+        return None, None
+    element, index = result
+    return element, selectors[index]
+
@@ -0,0 +1,134 @@
+"""
+Serves the frontend in ``static/`` from an in-memory manifest.
+
+The static folder is scanned once at startup: every file is read into memory with its
+content type, a strong ETag and its compressed variants. build-static.sh writes ``.br``
+and ``.gz`` files next to each asset; text assets without them are gzipped here.
+Requests never touch the filesystem. They are answered with the best encoding
+allowed by Accept-Encoding, or with 304 Not Modified when If-None-Match matches.
+
+The content-hashed files listed in ``dist/manifest.json`` (e.g. ``dist/script.min.1a2b3c4d5e.js``)
+never change, so they are sent as ``immutable`` for a year. Everything else, including
+index.html, is sent with ``no-cache`` so browsers revalidate it with the ETag.
+Unknown paths get index.html, like before. Rebuilt assets are picked up on restart.
+"""
+import os
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+from typing import Dict, Optional
+
+from flask import Response, abort
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_PATH = 'dist/manifest.json'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# Encodings in order of preference, with the suffix of their pre-compressed files.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+# Smaller files are not worth compressing at startup.
+MIN_COMPRESS_SIZE = 1024
+
+
+class StaticAsset:
+
+    __slots__ = ('content_type', 'cache_control', 'variants')
+
+    def __init__(self, content_type: str, cache_control: str, variants: Dict[str, tuple]):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        # Encoding ('identity', 'br', 'gzip') -> (body, etag).
+        self.variants = variants
+
+
+def _etag(body: bytes, encoding: str) -> str:
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    # Every encoding is a different representation, so it needs its own strong ETag.
+    return digest if encoding == 'identity' else f'{digest}-{encoding}'
+
+
+class StaticAssets:
+
+    def __init__(self, root: str):
+        self.root = root
+        self.assets: Dict[str, StaticAsset] = {}
+        self.index = None
+        self.load()
+
+    def _read(self, relative_path: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.root, relative_path), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _immutable_paths(self) -> set:
+        manifest = self._read(MANIFEST_PATH)
+        if manifest is None:
+            return set()
+        try:
+            return set(json.loads(manifest).get('files', {}).values())
+        except ValueError as e:
+            logger.warning(f"Ignoring invalid static manifest {MANIFEST_PATH}: {e}")
+            return set()
+
+    def load(self):
+        """Reads the static folder into memory. Called once at startup."""
+        assets = {}
+        immutable = self._immutable_paths()
+        suffixes = tuple(suffix for _, suffix in ENCODINGS)
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, '/')
+                if path.endswith(suffixes):
+                    continue
+                body = self._read(path)
+                if body is None:
+                    continue
+                content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+                cache_control = IMMUTABLE_CACHE_CONTROL if path in immutable else REVALIDATE_CACHE_CONTROL
+                assets[path] = StaticAsset(content_type, cache_control, self._variants(path, body, content_type))
+        self.assets = assets
+        # The build writes an index.html that references the content-hashed assets.
+        self.index = assets.get('dist/index.html') or assets.get('index.html')
+        logger.info(f"Loaded {len(assets)} static assets ({len(immutable)} content-hashed) from {self.root}.")
+
+    def _variants(self, path: str, body: bytes, content_type: str) -> Dict[str, tuple]:
+        variants = {'identity': (body, _etag(body, 'identity'))}
+        for encoding, suffix in ENCODINGS:
+            encoded = self._read(path + suffix)
+            if encoded is None and len(body) >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+                if encoding == 'gzip':
+                    encoded = gzip.compress(body, compresslevel=9, mtime=0)
+                elif brotli is not None:
+                    encoded = brotli.compress(body)
+            if encoded is not None and len(encoded) < len(body):
+                variants[encoding] = (encoded, _etag(encoded, encoding))
+        return variants
+
+    def response(self, path: str, request) -> Response:
+        """The asset at ``path`` (index.html for unknown paths) in the best accepted encoding."""
+        asset = self.assets.get(path) if path and path != 'index.html' else None
+        asset = asset or self.index
+        if asset is None:
+            abort(404)
+        encoding = next((name for name, _ in ENCODINGS
+                         if name in asset.variants and request.accept_encodings[name]), 'identity')
+        body, etag = asset.variants[encoding]
+        response = Response(body, mimetype=asset.content_type)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = asset.cache_control
+        if len(asset.variants) > 1:
+            response.vary.add('Accept-Encoding')
+        if encoding != 'identity':
+            response.content_encoding = encoding
+        return response.make_conditional(request)
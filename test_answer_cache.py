@@ -0,0 +1,114 @@
+import json
+import time
+
+import pytest
+from flask import Flask
+
+from answer_cache import AnswerCache, normalize_query, replay_events
+from models import db
+
+NOTEBOOK_URL = "https://notebooklm.google.com/notebook/abc123"
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'cache.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+def make_cache(app, **kwargs):
+    cache = AnswerCache(**kwargs)
+    cache.init_app(app)
+    return cache
+
+def test_normalize_query_ignores_case_and_spacing():
+    assert normalize_query("  What is\n the   Summary? ") == normalize_query("what is the summary?")
+
+def test_put_then_get_hits(app):
+    cache = make_cache(app)
+    cache.put('abc123', 'What is the summary?', 'The summary.')
+    with app.app_context():
+        assert cache.get('abc123', 'what is  the summary?') == 'The summary.'
+        assert cache.get('other', 'What is the summary?') is None
+        stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['entries'] == 1
+
+def test_put_replaces_existing_answer(app):
+    cache = make_cache(app)
+    cache.put('abc123', 'q', 'old')
+    cache.put('abc123', 'Q', 'new')
+    with app.app_context():
+        assert cache.get('abc123', 'q') == 'new'
+        assert cache.stats()['entries'] == 1
+
+def test_expired_entries_miss(app):
+    cache = make_cache(app, ttl=0.01)
+    cache.put('abc123', 'q', 'answer')
+    time.sleep(0.02)
+    with app.app_context():
+        assert cache.get('abc123', 'q') is None
+        assert cache.stats()['entries'] == 0
+
+def test_least_recently_hit_entries_are_evicted(app):
+    cache = make_cache(app, max_entries=2)
+    cache.put('abc123', 'first', 'one')
+    cache.put('abc123', 'second', 'two')
+    with app.app_context():
+        assert cache.get('abc123', 'first') == 'one'
+    cache.put('abc123', 'third', 'three')
+    with app.app_context():
+        assert cache.get('abc123', 'second') is None
+        assert cache.get('abc123', 'first') == 'one'
+        assert cache.get('abc123', 'third') == 'three'
+
+def test_pages_without_notebook_id_are_not_cached(app):
+    cache = make_cache(app)
+    cache.put('', 'q', 'answer')
+    with app.app_context():
+        assert cache.get('', 'q') is None
+        assert cache.stats()['entries'] == 0
+
+def test_replay_matches_live_stream_format():
+    events = list(replay_events('The answer.'))
+    assert {"chunk": "The answer."} in events
+    assert events[-1]['status'] == 'complete'
+
+def test_process_query_replays_cached_answer():
+    from main import app as main_app
+    from notebooklm import answer_cache
+
+    answer_cache.put('abc123', 'Cached question?', 'Cached answer.')
+    try:
+        client = main_app.test_client()
+        start = time.time()
+        response = client.post('/api/process_query', json={'query': 'cached question?', 'notebooklm_url': NOTEBOOK_URL})
+        events = [json.loads(line[len('data: '):]) for line in response.get_data(as_text=True).splitlines()
+                  if line.startswith('data: ')]
+        assert time.time() - start < 1
+        assert events[0]['status'] == 'cache_hit'
+        assert client.get(f"/api/debug/trace/{events[0]['trace_id']}").json['root']['attributes']['cache'] == 'hit'
+        assert ''.join(e.get('chunk', '') for e in events) == 'Cached answer.'
+        assert events[-1] == {"status": "complete", "completion_signal": "cache"}
+    finally:
+        with main_app.app_context():
+            answer_cache.clear()
+
+def test_only_answers_ended_by_the_page_are_cached():
+    from main import app as main_app
+    from notebooklm import _caching_answer, answer_cache
+
+    def stream(answer, completion_signal):
+        return [{"chunk": answer}, {"status": "complete", "completion_signal": completion_signal}]
+
+    try:
+        list(_caching_answer({'notebook_id': 'abc123', 'query': 'Stalled?'}, stream('Half an', 'inactivity_timeout')))
+        list(_caching_answer({'notebook_id': 'abc123', 'query': 'Finished?'}, stream('Whole.', 'stop_button_gone')))
+        with main_app.app_context():
+            assert answer_cache.get('abc123', 'Stalled?') is None
+            assert answer_cache.get('abc123', 'Finished?') == 'Whole.'
+    finally:
+        with main_app.app_context():
+            answer_cache.clear()
@@ -0,0 +1,151 @@
+import json
+import asyncio
+import threading
+
+import pytest
+from flask import Flask, Response, request, stream_with_context
+
+import grok
+import notebooklm
+from asgi import AsgiApp
+from main import app
+
+NOTEBOOK_URL = "https://notebooklm.google.com/notebook/asgi123"
+
+
+async def call(asgi_app, method, path, payload=None, headers=(), disconnect=None, query_string=''):
+    """Runs one request through the ASGI app; returns (status, body). ``disconnect`` is awaited before disconnecting."""
+    body = json.dumps(payload).encode() if payload is not None else b''
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string.encode(), 'root_path': '',
+             'headers': [(b'content-type', b'application/json')] + list(headers), 'http_version': '1.1',
+             'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+    received = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    messages = []
+
+    async def receive():
+        if received:
+            return received.pop(0)
+        if disconnect is not None:
+            await disconnect.wait()
+        else:
+            await asyncio.Event().wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi_app(scope, receive, send)
+    status = next(m['status'] for m in messages if m['type'] == 'http.response.start')
+    return status, b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body').decode()
+
+def sse_events(body):
+    return [json.loads(line[len('data: '):]) for line in body.splitlines() if line.startswith('data: ')]
+
+@pytest.fixture
+def asgi_app():
+    return AsgiApp(app, threads=4)
+
+@pytest.fixture
+def gated_browser(fake_browser):
+    """The browser answers only once the returned gate is set."""
+    fake_browser['gate'].clear()
+    return fake_browser['gate']
+
+def test_other_routes_are_served_by_flask(asgi_app):
+    status, body = asyncio.run(call(asgi_app, 'GET', '/api/jobs'))
+    assert status == 200
+    assert 'queue_depth' in json.loads(body)
+
+def test_validation_errors_are_json(asgi_app):
+    status, body = asyncio.run(call(asgi_app, 'POST', '/api/process_query', {'notebooklm_url': NOTEBOOK_URL}))
+    assert status == 400
+    assert json.loads(body) == {'error': 'Missing "query" in request body'}
+
+def test_status_stays_responsive_while_streaming(asgi_app, gated_browser):
+    async def scenario():
+        stream = asyncio.ensure_future(call(asgi_app, 'POST', '/api/process_query',
+                                            {'notebooklm_url': NOTEBOOK_URL, 'query': 'slow question',
+                                             'bypass_cache': True}))
+        await asyncio.sleep(0.05)
+        status, _ = await asyncio.wait_for(call(asgi_app, 'GET', '/api/users'), timeout=2)
+        assert status == 200
+        assert not stream.done()
+        gated_browser.set()
+        return await asyncio.wait_for(stream, timeout=5)
+
+    status, body = asyncio.run(scenario())
+    events = sse_events(body)
+    assert status == 200
+    assert events[0]['status'] == 'queued'
+    assert {"chunk": "Answer to slow question"} in events
+    assert events[-1] == {"status": "browser_released"}
+
+def test_disconnect_cancels_the_job(asgi_app, gated_browser):
+    async def scenario():
+        disconnect = asyncio.Event()
+        stream = asyncio.ensure_future(call(asgi_app, 'POST', '/api/process_query',
+                                            {'notebooklm_url': NOTEBOOK_URL, 'query': 'abandoned question',
+                                             'bypass_cache': True},
+                                            headers=[(b'x-client-id', b'asgi-test')], disconnect=disconnect))
+        await asyncio.sleep(0.05)
+        disconnect.set()
+        await asyncio.wait_for(stream, timeout=2)
+
+    asyncio.run(scenario())
+    jobs = [job for job in notebooklm.job_scheduler._jobs.values() if job.client_id == 'asgi-test']
+    assert jobs and jobs[-1].cancel_requested
+
+def test_stream_with_context_responses_keep_their_context():
+    """Every chunk of a streamed Flask response is produced inside the request that started it."""
+    flask_app = Flask(__name__)
+
+    @flask_app.route('/count')
+    def count():
+        def generate():
+            for i in range(int(request.args['n'])):
+                yield f"{request.args['prefix']}{i}\n"
+        return Response(stream_with_context(generate()), mimetype='text/plain')
+
+    streaming_app = AsgiApp(flask_app, threads=4)
+
+    async def scenario():
+        return await asyncio.gather(*(call(streaming_app, 'GET', '/count', query_string=f'n=50&prefix={p}')
+                                      for p in 'abcd'))
+
+    for (status, body), prefix in zip(asyncio.run(scenario()), 'abcd'):
+        assert status == 200
+        assert body.splitlines() == [f"{prefix}{i}" for i in range(50)]
+
+def test_grok_streams_do_not_hold_the_wsgi_threads(monkeypatch):
+    """With one WSGI thread, other routes are served while a Grok completion is still streaming."""
+    gate = threading.Event()
+
+    class SlowUpstream:
+        status_code = 200
+        headers = {'Content-Type': 'text/event-stream'}
+
+        def iter_content(self, chunk_size=None):
+            yield b'data: {"delta": "Hel"}\n\n'
+            gate.wait(5)
+            yield b'data: {"delta": "lo"}\n\n'
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(grok.grok_session, 'post', lambda url, **kwargs: SlowUpstream())
+    single_thread_app = AsgiApp(app, threads=1)
+
+    async def scenario():
+        streams = [asyncio.ensure_future(call(single_thread_app, 'POST', '/api/grok', {'messages': [], 'stream': True},
+                                              headers=[(b'authorization', b'Bearer key')]))
+                   for _ in range(2)]
+        await asyncio.sleep(0.1)
+        status, _ = await asyncio.wait_for(call(single_thread_app, 'GET', '/api/jobs'), timeout=2)
+        assert status == 200
+        assert not any(stream.done() for stream in streams)
+        gate.set()
+        return await asyncio.wait_for(asyncio.gather(*streams), timeout=5)
+
+    for status, body in asyncio.run(scenario()):
+        assert status == 200
+        assert body == 'data: {"delta": "Hel"}\n\ndata: {"delta": "lo"}\n\n'
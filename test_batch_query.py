@@ -0,0 +1,35 @@
+import json
+
+import notebooklm
+from main import app
+
+NOTEBOOK_URL = "https://notebooklm.google.com/notebook/batch123"
+
+
+def post_batch(payload):
+    response = app.test_client().post('/api/batch_query', json=payload)
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+    return response, lines
+
+def test_batch_navigates_once_and_streams_one_record_per_query(fake_browser):
+    response, lines = post_batch({'notebooklm_url': NOTEBOOK_URL, 'queries': ['one', 'fail', 'three'],
+                                  'bypass_cache': True})
+    assert response.mimetype == 'application/x-ndjson'
+    assert fake_browser['navigate'] == 1
+    assert fake_browser['asked'] == ['one', 'fail', 'three']
+
+    records, summary = lines[:-1], lines[-1]['summary']
+    assert [r['index'] for r in records] == [0, 1, 2]
+    assert records[0]['answer'] == 'Answer to one'
+    assert records[0]['status'] == 'complete'
+    assert set(records[0]['timings']) == {'submit_seconds', 'first_chunk_seconds', 'total_seconds'}
+    assert records[1]['status'] == 'error'
+    assert summary['queries'] == 3 and summary['completed'] == 2
+
+def test_batch_rejects_invalid_requests():
+    client = app.test_client()
+    assert client.post('/api/batch_query', json={'queries': ['q']}).status_code == 400
+    assert client.post('/api/batch_query', json={'notebooklm_url': NOTEBOOK_URL, 'queries': []}).status_code == 400
+    assert client.post('/api/batch_query', json={'notebooklm_url': NOTEBOOK_URL, 'queries': ['q', 3]}).status_code == 400
+    too_many = ['q'] * (notebooklm.BATCH_MAX_QUERIES + 1)
+    assert client.post('/api/batch_query', json={'notebooklm_url': NOTEBOOK_URL, 'queries': too_many}).status_code == 400
@@ -0,0 +1,151 @@
+"""
+Offline benchmarks of the two streaming endpoints against a fake NotebookLM notebook.
+
+Run with ``pytest test_benchmark_notebooklm.py`` (needs pytest-benchmark). By default the
+pure-Python FakeNotebookDriver is used; BENCHMARK_WEBDRIVER=local drives a local headless
+Chrome against FakeNotebookServer instead. Besides wall time, each benchmark reports the
+time to first chunk, the completion tail (last chunk to the end of the stream) and the
+WebDriver round trips per query in ``extra_info``.
+"""
+import os
+import json
+import time
+from collections import Counter
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import browser_pool as browser_pool_module
+import notebooklm
+from browser_pool import BrowserPool
+from fake_notebooklm import FakeNotebookDriver, FakeNotebookServer, GenerationProfile
+from main import app
+
+ENDPOINTS = ['/api/process_query', '/api/query_notebooklm']
+STREAM_MODES = ['observer', 'poll']
+PROFILE = GenerationProfile(first_token_delay=0.05, tokens_per_second=60, answer_tokens=60)
+ANSWER = ''.join(f"word{i} " for i in range(PROFILE.answer_tokens))
+
+
+def _count_round_trips(driver):
+    """The fake driver counts its own calls; a real one is counted at ``execute``, like tracing does."""
+    if hasattr(driver, 'round_trips'):
+        return driver
+    driver.round_trips = Counter()
+    execute = driver.execute
+
+    def counted_execute(driver_command, params=None):
+        driver.round_trips[driver_command] += 1
+        return execute(driver_command, params)
+
+    driver.execute = counted_execute
+    return driver
+
+
+@pytest.fixture(scope='module')
+def notebook():
+    """(notebook URL, driver factory) for the configured backend."""
+    if os.environ.get('BENCHMARK_WEBDRIVER', 'fake') != 'local':
+        yield 'https://notebooklm.google.com/notebook/bench', lambda slot=0: FakeNotebookDriver(PROFILE)
+        return
+    monkeypatch = pytest.MonkeyPatch()
+    monkeypatch.setenv('WEBDRIVER_BACKEND', 'local')
+    server = FakeNotebookServer(port=0, profile=PROFILE)
+    server.start()
+    try:
+        browser_pool_module.create_driver().quit()
+    except Exception as e:
+        pytest.skip(f"No local Chrome available: {e}")
+    else:
+        yield server.notebook_url(), browser_pool_module.create_driver
+    finally:
+        server.shutdown()
+        monkeypatch.undo()
+
+
+@pytest.fixture
+def fake_pool(monkeypatch, notebook):
+    url, factory = notebook
+    drivers = []
+
+    def driver_factory(slot=0):
+        drivers.append(_count_round_trips(factory(slot)))
+        return drivers[-1]
+
+    pool = BrowserPool(min_size=0, max_size=1, driver_factory=driver_factory)
+    monkeypatch.setattr(notebooklm, 'browser_pool', pool)
+    yield url, drivers
+    pool.shutdown()
+
+
+def run_query(endpoint, url, stream_mode):
+    """Posts one query and times its events as the client receives them."""
+    start = time.time()
+    response = app.test_client().post(endpoint, buffered=False, json={
+        'notebooklm_url': url,
+        'query': f"Benchmark question {time.time_ns()}",
+        'stream_mode': stream_mode,
+        'bypass_cache': True
+    })
+    answer, first_chunk_at, last_chunk_at, completion = '', None, None, None
+    for line in response.response:
+        line = line.decode() if isinstance(line, bytes) else line
+        if not line.startswith('data: '):
+            continue
+        event = json.loads(line[6:])
+        if 'chunk' in event:
+            last_chunk_at = time.time()
+            first_chunk_at = first_chunk_at or last_chunk_at
+            answer += event['chunk']
+        elif event.get('status') == 'complete':
+            completion = (time.time(), event.get('completion_signal'))
+        assert 'error' not in event, event['error']
+    return {
+        'answer': answer,
+        'completion_signal': completion[1],
+        'first_chunk_seconds': first_chunk_at - start,
+        'completion_tail_seconds': completion[0] - last_chunk_at
+    }
+
+
+@pytest.mark.parametrize('stream_mode', STREAM_MODES)
+@pytest.mark.parametrize('endpoint', ENDPOINTS)
+def test_streaming_endpoint(benchmark, fake_pool, endpoint, stream_mode):
+    url, drivers = fake_pool
+    results = []
+
+    def query():
+        before = sum(drivers[-1].round_trips.values()) if drivers else 0
+        result = run_query(endpoint, url, stream_mode)
+        result['round_trips'] = sum(drivers[-1].round_trips.values()) - before
+        results.append(result)
+
+    # The first query starts the browser session and opens the notebook for /query_notebooklm.
+    run_query('/api/process_query', url, stream_mode)
+    benchmark.pedantic(query, rounds=3, iterations=1)
+
+    for result in results:
+        assert result['answer'] == ANSWER
+        assert result['completion_signal'] == 'stop_button_gone'
+    benchmark.extra_info.update({
+        'first_chunk_seconds': max(r['first_chunk_seconds'] for r in results),
+        'completion_tail_seconds': max(r['completion_tail_seconds'] for r in results),
+        'round_trips_per_query': max(r['round_trips'] for r in results)
+    })
+    # A completed answer should end within the settle period plus one drain or poll.
+    assert benchmark.extra_info['completion_tail_seconds'] < 3
+    assert benchmark.extra_info['round_trips_per_query'] < 150
+
+def test_observer_is_not_slower_than_polling(fake_pool):
+    """Observer mode is the default, so it must win on both time to first chunk and completion tail."""
+    url, _ = fake_pool
+    timings = {}
+    for stream_mode in STREAM_MODES:
+        run_query('/api/process_query', url, stream_mode)
+        results = [run_query('/api/process_query', url, stream_mode) for _ in range(3)]
+        timings[stream_mode] = {key: sorted(r[key] for r in results)[1]
+                                for key in ('first_chunk_seconds', 'completion_tail_seconds')}
+    # A small allowance for scheduling noise; the polling interval alone is 0.5s.
+    for key in ('first_chunk_seconds', 'completion_tail_seconds'):
+        assert timings['observer'][key] <= timings['poll'][key] + 0.05, timings
@@ -0,0 +1,122 @@
+import os
+import stat
+import socket
+import asyncio
+import tempfile
+import threading
+
+import pytest
+
+from browser_broker import BrokerClient, BrokerError, BrokerServer, RemoteBrowserPool, RemoteJobScheduler
+from query_jobs import JobScheduler
+
+
+class FakePool:
+    def stats(self):
+        return {'size': 1, 'idle': 1}
+
+    def close_idle(self):
+        return 1
+
+
+@pytest.fixture
+def broker():
+    """A broker serving a scheduler whose 'query' runner answers once ``gate`` is set."""
+    gate = threading.Event()
+
+    def run(params):
+        yield {"status": "streaming"}
+        gate.wait(5)
+        yield {"chunk": f"Answer to {params['query']}"}
+        yield {"status": "complete"}
+
+    scheduler = JobScheduler({'query': run})
+    path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+    server = BrokerServer(path, scheduler, FakePool())
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    client = BrokerClient(path)
+    yield client, scheduler, gate
+    gate.set()
+    server.shutdown()
+    server.server_close()
+    scheduler.shutdown()
+
+def test_remote_job_streams_events_from_the_broker(broker):
+    client, scheduler, gate = broker
+    remote = RemoteJobScheduler(client)
+    job = remote.submit('query', {'query': 'q1'}, 'normal', 'worker-1')
+    gate.set()
+    events = list(job.iter_events())
+    assert events[0]['status'] == 'queued'
+    assert {"chunk": "Answer to q1"} in events
+    assert job.wait(5)
+    assert job.to_dict(include_result=True)['result'] == 'Answer to q1'
+    assert remote.stats()['queue_depth'] == 0
+
+def test_identical_requests_from_two_workers_share_a_job(broker):
+    client, scheduler, gate = broker
+    worker_a, worker_b = RemoteJobScheduler(client), RemoteJobScheduler(BrokerClient(client.path))
+    first = worker_a.submit('query', {'query': 'q'}, 'normal', 'a', coalesce_key=('nb', 'q'))
+    second = worker_b.submit('query', {'query': 'q'}, 'normal', 'b', coalesce_key=['nb', 'q'])
+    assert first.id == second.id
+    gate.set()
+    assert first.wait(5)
+
+def test_last_detaching_worker_can_cancel(broker):
+    client, scheduler, gate = broker
+    remote = RemoteJobScheduler(client)
+    job = remote.submit('query', {'query': 'q'}, 'normal', 'a')
+    job.attach()
+    job.attach()
+    assert not job.detach()
+    assert job.detach()
+    assert remote.cancel(job.id)
+    gate.set()
+    assert job.wait(5)
+    assert job.to_dict()['state'] == 'cancelled'
+
+def test_async_subscribers_follow_events(broker):
+    client, scheduler, gate = broker
+    job = RemoteJobScheduler(client).submit('query', {'query': 'q2'}, 'normal', 'a')
+
+    async def follow():
+        return [event async for event in job.aiter_events()]
+
+    gate.set()
+    assert {"chunk": "Answer to q2"} in asyncio.run(follow())
+
+def test_pool_calls_reach_the_broker(broker):
+    client, scheduler, gate = broker
+    pool = RemoteBrowserPool(client)
+    assert pool.stats() == {'size': 1, 'idle': 1}
+    assert pool.close_idle() == 1
+
+def test_broker_metrics_snapshot_is_mergeable(broker):
+    client, scheduler, gate = broker
+    snapshot = client.call('metrics')
+    assert 'notebooklm_phase_seconds' in snapshot and 'notebooklm_errors_total' in snapshot
+    assert 'notebooklm_job_queue_depth' not in snapshot  # Gauges are read locally.
+
+def test_unknown_job_and_unreachable_broker(broker):
+    client, scheduler, gate = broker
+    assert RemoteJobScheduler(client).get('missing') is None
+    with pytest.raises(BrokerError):
+        BrokerClient('/nonexistent/broker.sock').call('stats')
+
+def test_socket_is_private_and_only_stale_sockets_are_replaced(tmp_path):
+    scheduler = JobScheduler({'query': lambda params: iter(())})
+    path = str(tmp_path / 'broker.sock')
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+    server = BrokerServer(path, scheduler, FakePool())
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    finally:
+        server.server_close()
+    other = tmp_path / 'not-a-socket'
+    other.write_text('keep me')
+    with pytest.raises(PermissionError):
+        BrokerServer(str(other), scheduler, FakePool())
+    assert other.read_text() == 'keep me'
@@ -0,0 +1,225 @@
+import time
+import threading
+
+import pytest
+from selenium.common.exceptions import NoSuchWindowException
+from browser_pool import BrowserPool, NotebookTabCache, PoolClosedError, PoolExhaustedError
+
+
+class FakeDriver:
+    """Minimal stand-in for a remote WebDriver session."""
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.alive = True
+        self.quit_called = False
+
+    @property
+    def current_url(self):
+        if not self.alive:
+            raise RuntimeError("session deleted")
+        return "https://notebooklm.google.com/"
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        if handle not in self.driver.windows:
+            raise NoSuchWindowException(handle)
+        self.driver.current_window_handle = handle
+
+    def new_window(self, kind):
+        handle = f"tab-{len(self.driver.windows) + len(self.driver.closed)}"
+        self.driver.windows[handle] = None
+        self.driver.current_window_handle = handle
+
+
+class FakeTabDriver:
+    """Tracks window handles and page loads for tab cache tests."""
+
+    def __init__(self):
+        self.windows = {'main': None}
+        self.closed = []
+        self.loads = []
+        self.current_window_handle = 'main'
+        self.switch_to = FakeSwitchTo(self)
+
+    def get(self, url):
+        self.loads.append(url)
+        self.windows[self.current_window_handle] = url
+
+    def close(self):
+        self.closed.append(self.current_window_handle)
+        del self.windows[self.current_window_handle]
+
+
+@pytest.fixture
+def pool():
+    pool = BrowserPool(min_size=0, max_size=2, acquire_timeout=0.2, driver_factory=FakeDriver)
+    yield pool
+    pool.shutdown()
+
+def test_checkout_creates_sessions_lazily_up_to_max(pool):
+    """Sessions are created on demand and each lease gets its own slot."""
+    first = pool.checkout()
+    second = pool.checkout()
+    assert {first.slot, second.slot} == {0, 1}
+    assert pool.stats()['in_use'] == 2
+    with pytest.raises(PoolExhaustedError):
+        pool.checkout()
+
+def test_checkin_reuses_idle_session(pool):
+    """A returned healthy session is handed to the next caller instead of creating a new one."""
+    session = pool.checkout()
+    pool.checkin(session)
+    assert pool.checkout() is session
+    assert pool.stats()['size'] == 1
+
+def test_waiter_is_woken_by_checkin(pool):
+    """A caller blocked on a full pool receives the session as soon as it is returned."""
+    held = [pool.checkout(), pool.checkout()]
+    threading.Timer(0.05, pool.checkin, args=(held[0],)).start()
+    assert pool.checkout(timeout=2) is held[0]
+
+def test_unhealthy_session_is_discarded(pool):
+    """Errors on a dead session free its slot and quit the driver."""
+    with pytest.raises(ValueError):
+        with pool.lease() as session:
+            session.driver.alive = False
+            raise ValueError("boom")
+    assert session.driver.quit_called
+    assert pool.stats()['size'] == 0
+    assert pool.checkout() is not session
+
+def test_close_idle_retires_busy_sessions_on_checkin(pool):
+    """Sessions in use are closed when they come back rather than interrupted mid-query."""
+    busy = pool.checkout()
+    idle = pool.checkout()
+    pool.checkin(idle)
+    assert pool.close_idle() == 2
+    assert idle.driver.quit_called and not busy.driver.quit_called
+    pool.checkin(busy)
+    assert busy.driver.quit_called
+    assert pool.stats()['size'] == 0
+
+def test_failed_creation_releases_slot():
+    """A hub failure does not leak the reserved slot."""
+    calls = []
+
+    def flaky_factory(slot):
+        calls.append(slot)
+        if len(calls) == 1:
+            raise ConnectionError("hub unavailable")
+        return FakeDriver(slot)
+
+    pool = BrowserPool(min_size=0, max_size=1, acquire_timeout=0.2, driver_factory=flaky_factory)
+    with pytest.raises(ConnectionError):
+        pool.checkout()
+    assert pool.checkout().slot == 0
+
+def test_shutdown_rejects_new_leases(pool):
+    """No sessions are handed out once the pool is shut down."""
+    pool.shutdown()
+    with pytest.raises(PoolClosedError):
+        pool.checkout()
+
+def test_start_prewarms_min_size():
+    """start() creates min_size sessions in the background."""
+    pool = BrowserPool(min_size=2, max_size=3, driver_factory=FakeDriver)
+    pool.start().join(timeout=2)
+    stats = pool.stats()
+    assert stats['size'] == 2 and stats['idle'] == 2
+    pool.shutdown()
+
+def test_session_recycled_after_max_requests():
+    """A session that has served max_requests queries is closed instead of reused."""
+    pool = BrowserPool(min_size=0, max_size=1, driver_factory=FakeDriver, max_requests=2)
+    with pool.lease() as first:
+        pass
+    with pool.lease() as second:
+        pass
+    assert first is second
+    assert second.driver.quit_called
+    assert pool.stats()['size'] == 0
+
+def test_session_recycled_after_max_errors():
+    """Repeated errors on a still-responsive session eventually recycle it."""
+    pool = BrowserPool(min_size=0, max_size=1, driver_factory=FakeDriver, max_errors=1)
+    session = pool.checkout()
+    session.record_error(RuntimeError("selector not found"))
+    assert session.healthy
+    assert pool.checkin(session) is False
+    assert session.driver.quit_called
+
+def test_reap_idle_recycles_expired_sessions():
+    """Idle sessions past their TTL are closed and replaced up to min_size."""
+    pool = BrowserPool(min_size=1, max_size=2, driver_factory=FakeDriver, idle_ttl=60)
+    old, extra = pool.checkout(), pool.checkout()
+    pool.checkin(old)
+    pool.checkin(extra)
+    old.last_used_at -= 120
+    extra.last_used_at -= 120
+    assert pool.reap_idle() == 2
+    assert old.driver.quit_called and extra.driver.quit_called
+    stats = pool.stats()
+    assert stats['size'] == 1 and stats['idle'] == 1
+    pool.shutdown()
+
+def test_recent_idle_sessions_survive_reaping():
+    """Sessions used within the TTL stay warm."""
+    pool = BrowserPool(min_size=0, max_size=1, driver_factory=FakeDriver, idle_ttl=60)
+    session = pool.checkout()
+    pool.checkin(session)
+    assert pool.reap_idle() == 0
+    assert pool.checkout() is session
+
+def test_waiter_is_woken_by_checkin_while_reaper_runs():
+    """The idle reaper never takes the wakeup meant for a blocked checkout."""
+    pool = BrowserPool(min_size=0, max_size=1, driver_factory=FakeDriver, idle_ttl=60)
+    pool.start()
+    try:
+        held = pool.checkout()
+        threading.Timer(0.2, pool.checkin, args=(held,)).start()
+        started = time.monotonic()
+        assert pool.checkout(timeout=5) is held
+        assert time.monotonic() - started < 1
+    finally:
+        pool.shutdown()
+
+def test_tab_cache_switches_instead_of_reloading():
+    """A cached notebook is shown by switching tabs, without another page load."""
+    driver = FakeTabDriver()
+    tabs = NotebookTabCache(driver, capacity=2)
+    tabs.open('nb1', 'https://notebooklm.google.com/notebook/nb1')
+    tabs.open('nb2', 'https://notebooklm.google.com/notebook/nb2')
+    assert driver.current_window_handle != 'main'
+    assert tabs.activate('nb1')
+    assert driver.current_window_handle == 'main'
+    assert len(driver.loads) == 2
+
+def test_tab_cache_evicts_least_recently_used():
+    """Opening a notebook beyond capacity closes the least recently used tab."""
+    driver = FakeTabDriver()
+    tabs = NotebookTabCache(driver, capacity=2)
+    tabs.open('nb1', 'url1')
+    tabs.open('nb2', 'url2')
+    tabs.activate('nb1')
+    tabs.open('nb3', 'url3')
+    assert tabs.notebook_ids() == ['nb1', 'nb3']
+    assert driver.windows['main'] == 'url1'
+    assert len(driver.closed) == 1
+    assert driver.windows[driver.current_window_handle] == 'url3'
+
+def test_tab_cache_drops_closed_windows():
+    """A tab closed behind the cache's back is treated as a miss."""
+    driver = FakeTabDriver()
+    tabs = NotebookTabCache(driver, capacity=2)
+    tabs.open('nb1', 'url1')
+    del driver.windows['main']
+    assert not tabs.activate('nb1')
+    assert 'nb1' not in tabs
@@ -0,0 +1,66 @@
+import threading
+
+from flask import Flask
+from sqlalchemy import text
+from flask_sqlalchemy import SQLAlchemy
+
+from db_config import database_uri, engine_options, init_db
+
+
+def make_app(tmp_path, monkeypatch, **env):
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    app = Flask(__name__)
+    db = SQLAlchemy()
+    init_db(app, db, str(tmp_path / 'app.db'))
+    return app, db
+
+def test_database_uri_defaults_to_sqlite_file(monkeypatch):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    assert database_uri('/data/app.db') == 'sqlite:////data/app.db'
+
+def test_database_uri_from_env(monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', 'postgres://u:p@db/app')
+    assert database_uri('/data/app.db') == 'postgresql://u:p@db/app'
+
+def test_engine_options_for_server_and_memory(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '4')
+    options = engine_options('postgresql://u:p@db/app')
+    assert options['pool_size'] == 4 and options['pool_pre_ping'] is True
+    assert engine_options('sqlite:///:memory:') == {}
+
+def test_sqlite_connections_use_wal_and_pragmas(tmp_path, monkeypatch):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    app, db = make_app(tmp_path, monkeypatch, DB_BUSY_TIMEOUT='5', DB_SQLITE_CACHE_KB='4096')
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+            assert conn.execute(text('PRAGMA cache_size')).scalar() == -4096
+
+def test_concurrent_writers_do_not_hit_locked_errors(tmp_path, monkeypatch):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    app, db = make_app(tmp_path, monkeypatch)
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text('CREATE TABLE item (id INTEGER PRIMARY KEY, worker INTEGER)'))
+    errors = []
+
+    def write(worker):
+        try:
+            with app.app_context():
+                for _ in range(50):
+                    with db.engine.begin() as conn:
+                        conn.execute(text('INSERT INTO item (worker) VALUES (:w)'), {'w': worker})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with app.app_context(), db.engine.connect() as conn:
+        assert conn.execute(text('SELECT COUNT(*) FROM item')).scalar() == 400
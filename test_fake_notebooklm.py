@@ -0,0 +1,69 @@
+import time
+import urllib.request
+
+from selenium.webdriver.common.by import By
+
+from fake_notebooklm import FakeNotebookDriver, FakeNotebookServer, GenerationProfile
+from notebooklm import CHAT_INPUT_SELECTORS, COMPLETION_SELECTORS, RESPONSE_CONTENT_SELECTOR
+from response_stream import install_completion_detector, open_response_stream
+from selector_lookup import find_first_match
+
+NOTEBOOK_URL = "https://notebooklm.google.com/notebook/fake123"
+
+
+def ask(driver, question="What is this?", before_submit=lambda driver: None):
+    driver.get(NOTEBOOK_URL)
+    before_submit(driver)
+    element, selector = find_first_match(driver, CHAT_INPUT_SELECTORS, clickable=True)
+    assert selector == CHAT_INPUT_SELECTORS[0]
+    element.send_keys(question)
+    driver.find_element(By.CSS_SELECTOR, 'button[data-testid="send-button"]').click()
+
+def test_answer_is_generated_token_by_token():
+    driver = FakeNotebookDriver(GenerationProfile(first_token_delay=0.05, tokens_per_second=100, answer_tokens=5))
+    ask(driver)
+    response = driver.find_element(*RESPONSE_CONTENT_SELECTOR)
+    assert response.text == ''
+    time.sleep(0.07)
+    assert response.text.startswith('word0 ')
+    time.sleep(0.1)
+    assert response.text == 'word0 word1 word2 word3 word4 '
+    assert driver.round_trips['findElement'] == 2
+
+def test_input_is_missing_before_a_notebook_is_opened():
+    driver = FakeNotebookDriver()
+    assert find_first_match(driver, CHAT_INPUT_SELECTORS) == (None, None)
+
+def test_streams_end_on_the_stop_button_disappearing():
+    profile = GenerationProfile(first_token_delay=0.01, tokens_per_second=50, answer_tokens=20)
+    for mode in ('observer', 'poll'):
+        driver = FakeNotebookDriver(profile)
+        ask(driver)
+        time.sleep(0.02)
+        element = driver.find_element(*RESPONSE_CONTENT_SELECTOR)
+        stream = open_response_stream(driver, element, RESPONSE_CONTENT_SELECTOR, mode, COMPLETION_SELECTORS)
+        text = ''.join(stream.iter_chunks(timeout=5, inactivity_timeout=3))
+        assert text == ''.join(f"word{i} " for i in range(20))
+        assert stream.end_reason == 'stop_button_gone'
+
+def test_short_answer_finished_before_streaming_still_completes():
+    """With the baseline taken before submitting, an answer that is already done ends on its copy button."""
+    driver = FakeNotebookDriver(GenerationProfile(first_token_delay=0.01, tokens_per_second=1000, answer_tokens=3))
+    ask(driver, before_submit=lambda d: install_completion_detector(d, COMPLETION_SELECTORS))
+    time.sleep(0.05)
+    element = driver.find_element(*RESPONSE_CONTENT_SELECTOR)
+    stream = open_response_stream(driver, element, RESPONSE_CONTENT_SELECTOR, 'observer')
+    assert ''.join(stream.iter_chunks(timeout=5, inactivity_timeout=3)) == 'word0 word1 word2 '
+    assert stream.end_reason == 'copy_button'
+
+def test_server_serves_the_notebook_page_with_the_profile():
+    server = FakeNotebookServer(port=0, profile=GenerationProfile(first_token_delay=0.2))
+    server.start()
+    try:
+        url = server.notebook_url('abc')
+        assert 'notebooklm.google.com/notebook/abc' in url
+        page = urllib.request.urlopen(url).read().decode()
+    finally:
+        server.shutdown()
+    assert 'data-testid="chat-input"' in page
+    assert '"first_token_ms": 200.0' in page
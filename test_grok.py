@@ -0,0 +1,194 @@
+import json
+import time
+
+import pytest
+import requests
+
+import grok
+from main import app
+
+
+class FakeUpstream:
+    def __init__(self, status_code=200, content=b'{"choices": []}', chunks=(), headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.chunks = chunks
+        self.headers = headers or {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        yield from self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+    state = {'response': FakeUpstream()}
+
+    def post(url, **kwargs):
+        calls.append(kwargs)
+        if isinstance(state['response'], Exception):
+            raise state['response']
+        return state['response']
+
+    monkeypatch.setattr(grok.grok_session, 'post', post)
+    return calls, state
+
+def post_grok(payload, auth='Bearer key'):
+    headers = {'Authorization': auth} if auth else {}
+    return app.test_client().post('/api/grok', json=payload, headers=headers)
+
+def test_missing_authorization_is_rejected(upstream):
+    assert post_grok({'messages': []}, auth=None).status_code == 401
+
+def test_buffered_request_uses_timeouts_and_filters_cors_headers(upstream):
+    calls, state = upstream
+    response = post_grok({'messages': []})
+    assert response.status_code == 200
+    assert response.data == b'{"choices": []}'
+    assert grok._passthrough_headers(state['response']) == [('Content-Type', 'application/json')]
+    assert calls[0]['timeout'] == (grok.GROK_CONNECT_TIMEOUT, grok.GROK_READ_TIMEOUT)
+    assert calls[0]['stream'] is False
+
+def test_stream_true_passes_chunks_through(upstream):
+    calls, state = upstream
+    state['response'] = FakeUpstream(chunks=[b'data: {"delta": "Hel"}\n\n', b'data: {"delta": "lo"}\n\n',
+                                             b'data: [DONE]\n\n'],
+                                     headers={'Content-Type': 'text/event-stream'})
+    response = post_grok({'messages': [], 'stream': True})
+    assert calls[0]['stream'] is True
+    assert response.headers['Content-Type'] == 'text/event-stream'
+    assert list(response.response) == state['response'].chunks
+    response.close()
+    assert state['response'].closed
+
+def test_timeouts_and_connection_errors_map_to_gateway_errors(upstream):
+    calls, state = upstream
+    state['response'] = requests.exceptions.ReadTimeout('read timed out')
+    assert post_grok({'messages': []}).status_code == 504
+    state['response'] = requests.exceptions.ConnectionError('refused')
+    assert post_grok({'messages': []}).status_code == 502
+
+def test_session_pools_connections_and_retries_connect_failures():
+    adapter = grok.grok_session.get_adapter(grok.GROK_API_URL)
+    assert adapter.max_retries.connect == grok.GROK_CONNECT_RETRIES
+    assert adapter.max_retries.read == 0
+    assert adapter._pool_maxsize == grok.GROK_POOL_SIZE
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = grok.GrokResponseCache(enabled=True, ttl=60, max_entries=2)
+    monkeypatch.setattr(grok, 'grok_cache', cache)
+    return cache
+
+DETERMINISTIC = {'model': 'grok-3', 'messages': [{'role': 'user', 'content': 'hi'}], 'temperature': 0}
+
+def test_deterministic_requests_are_served_from_cache(upstream, cache):
+    calls, state = upstream
+    first = post_grok(DETERMINISTIC)
+    # Key order does not matter: the request JSON is hashed canonically.
+    second = post_grok(dict(reversed(list(DETERMINISTIC.items()))))
+    assert len(calls) == 1
+    assert first.headers['X-Cache'] == 'MISS' and second.headers['X-Cache'] == 'HIT'
+    assert second.data == first.data
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+def test_cache_is_scoped_per_credential(upstream, cache):
+    calls, state = upstream
+    post_grok(DETERMINISTIC, auth='Bearer one')
+    post_grok(DETERMINISTIC, auth='Bearer two')
+    assert len(calls) == 2
+
+def test_non_deterministic_and_failed_requests_bypass_cache(upstream, cache):
+    calls, state = upstream
+    post_grok({**DETERMINISTIC, 'temperature': 0.7})
+    post_grok({**DETERMINISTIC, 'temperature': 0.7})
+    assert len(calls) == 2 and cache.stats()['bypassed'] == 2
+    state['response'] = FakeUpstream(status_code=429)
+    post_grok(DETERMINISTIC)
+    post_grok(DETERMINISTIC)
+    assert len(calls) == 4
+
+def test_no_cache_header_refreshes_entry(upstream, cache):
+    calls, state = upstream
+    post_grok(DETERMINISTIC)
+    response = app.test_client().post('/api/grok', json=DETERMINISTIC,
+                                      headers={'Authorization': 'Bearer key', 'Cache-Control': 'no-cache'})
+    assert response.headers['X-Cache'] == 'MISS'
+    assert len(calls) == 2
+
+def test_cache_evicts_least_recently_used_and_expired_entries():
+    cache = grok.GrokResponseCache(enabled=True, ttl=60, max_entries=2)
+    cache.put('a', b'1', 200, [])
+    cache.put('b', b'2', 200, [])
+    assert cache.get('a')
+    cache.put('c', b'3', 200, [])
+    assert cache.get('b') is None and cache.get('a') and cache.get('c')
+    assert cache.stats()['evictions'] == 1
+    cache.ttl = 0
+    assert cache.get('a') is None
+
+def test_cache_stats_endpoint(cache):
+    assert app.test_client().get('/api/grok/cache').get_json()['enabled'] is True
+
+@pytest.fixture
+def slow_upstream(monkeypatch):
+    """Answers each prompt after the delay given in its first message, echoing the prompt."""
+    def post(url, json=None, timeout=None, **kwargs):
+        delay = float(json['messages'][0]['content'])
+        if delay > timeout[1]:
+            raise requests.exceptions.ReadTimeout('read timed out')
+        time.sleep(delay)
+        return FakeUpstream(content=b'{"prompt": "%s"}' % json['messages'][0]['content'].encode())
+
+    monkeypatch.setattr(grok.grok_session, 'post', post)
+
+def batch_of(*delays):
+    return [{'messages': [{'role': 'user', 'content': str(delay)}]} for delay in delays]
+
+def test_batch_runs_concurrently_and_keeps_input_order(slow_upstream):
+    started = time.time()
+    response = app.test_client().post('/api/grok/batch', json={'requests': batch_of(0.3, 0.1, 0.2, 0.3)},
+                                      headers={'Authorization': 'Bearer key'})
+    assert time.time() - started < 0.8
+    results = response.get_json()['results']
+    assert [r['index'] for r in results] == [0, 1, 2, 3]
+    assert [r['response']['prompt'] for r in results] == ['0.3', '0.1', '0.2', '0.3']
+
+def test_batch_streams_results_as_they_finish(slow_upstream):
+    response = app.test_client().post('/api/grok/batch', json={'requests': batch_of(0.3, 0.05), 'stream_results': True},
+                                      headers={'Authorization': 'Bearer key'})
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert response.mimetype == 'application/x-ndjson'
+    assert [r['index'] for r in records] == [1, 0]
+
+def test_batch_reports_per_request_timeouts(slow_upstream):
+    response = app.test_client().post('/api/grok/batch', json={'requests': batch_of(0.05, 5), 'timeout': 1},
+                                      headers={'Authorization': 'Bearer key'})
+    results = response.get_json()['results']
+    assert results[0]['status_code'] == 200
+    assert results[1]['status_code'] == 504 and 'error' in results[1]
+
+def test_batch_validation():
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer key'}
+    assert client.post('/api/grok/batch', json={'requests': batch_of(1)}).status_code == 401
+    assert client.post('/api/grok/batch', json={'requests': []}, headers=headers).status_code == 400
+    assert client.post('/api/grok/batch', json={'requests': [{'stream': True}]}, headers=headers).status_code == 400
+    for options in ({'max_concurrency': 'many'}, {'max_concurrency': 0}, {'timeout': None}, {'timeout': 'nan'},
+                    {'timeout': -1}, {'timeout': [1]}):
+        response = client.post('/api/grok/batch', json=dict({'requests': batch_of(1)}, **options), headers=headers)
+        assert response.status_code == 400, options
+
+def test_requests_are_traced(upstream):
+    from tracing import tracer
+    calls, state = upstream
+    state['response'] = FakeUpstream(chunks=[b'data: {"delta": "Hi"}\n\n'], headers={'Content-Type': 'text/event-stream'})
+    response = post_grok({'messages': [], 'stream': True})
+    assert response.data == b'data: {"delta": "Hi"}\n\n'
+    root = tracer.get(response.headers['X-Trace-Id'])['root']
+    assert root['attributes']['status'] == 'ok' and root['attributes']['chunks'] == 1
+    assert [c['name'] for c in root['children']] == ['grok.upstream_connect', 'grok.stream']
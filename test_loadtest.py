@@ -0,0 +1,67 @@
+import random
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import grok
+import notebooklm
+from browser_pool import BrowserPool
+from fake_notebooklm import FakeNotebookDriver, GenerationProfile
+from loadtest import LoadTest, StubGrokServer, arrival_offsets, iter_sse_data, percentile
+from main import app
+
+PROFILE = GenerationProfile(first_token_delay=0.05, tokens_per_second=60, answer_tokens=60)
+
+
+@pytest.fixture
+def base_url(monkeypatch):
+    """The app on a local port, with the fake NotebookLM WebDriver and a stub Grok API."""
+    pool = BrowserPool(min_size=0, max_size=1, driver_factory=lambda slot=0: FakeNotebookDriver(PROFILE))
+    monkeypatch.setattr(notebooklm, 'browser_pool', pool)
+    stub = StubGrokServer(PROFILE).start()
+    monkeypatch.setattr(grok, 'GROK_API_URL', stub.url)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    stub.shutdown()
+    pool.shutdown()
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([], 50) is None
+
+def test_arrival_offsets():
+    assert list(arrival_offsets('constant', 3, rate=2)) == [0, 0.5, 1.0]
+    assert list(arrival_offsets('burst', 5, rate=4, burst_size=2)) == [0, 0, 0.5, 0.5, 1.0]
+    poisson = list(arrival_offsets('poisson', 1000, rate=10, rng=random.Random(1)))
+    assert poisson == sorted(poisson)
+    assert 80 < poisson[-1] < 120
+    with pytest.raises(ValueError):
+        list(arrival_offsets('closed', 1, rate=1))
+
+def test_iter_sse_data_joins_multiline_events():
+    lines = ['data: {"a": 1}', '', ': comment', 'data: one', 'data: two', '', 'data: [DONE]']
+    assert list(iter_sse_data(lines)) == ['{"a": 1}', 'one\ntwo', '[DONE]']
+
+def test_load_test_reports_latency_per_endpoint(base_url):
+    summary = LoadTest(base_url, ['process_query', 'grok'], concurrency=2, requests_count=4, timeout=30).run()
+    assert summary['overall']['completed'] == 4
+    for name in ('process_query', 'grok'):
+        endpoint = summary['endpoints'][name]
+        assert endpoint['requests'] == 2 and endpoint['error_rate'] == 0
+        assert 0 < endpoint['first_chunk_seconds']['p50'] <= endpoint['completion_seconds']['p50']
+        assert endpoint['completion_seconds']['p99'] == endpoint['completion_seconds']['max']
+
+def test_load_test_counts_timeouts_and_errors(base_url):
+    summary = LoadTest(base_url, ['grok'], requests_count=2, pattern='constant', rate=20, timeout=0.5).run()
+    assert summary['overall']['timeouts'] == 2 and summary['overall']['timeout_rate'] == 1
+    assert summary['overall']['completion_seconds']['p50'] is None
+
+    summary = LoadTest(base_url, ['grok'], requests_count=1, grok_key='').run()
+    assert summary['overall']['error_rate'] == 1
+    assert summary['overall']['top_errors'][0]['error'].startswith('HTTP 401')
@@ -0,0 +1,71 @@
+from browser_pool import BrowserPool
+from metrics import ERRORS_TOTAL, LEASE_WAIT_SECONDS, PHASE_SECONDS, Registry
+
+
+class FakeDriver:
+
+    current_url = "https://notebooklm.google.com/"
+
+    def quit(self):
+        pass
+
+
+def sample(text, line_prefix):
+    """The value of the first exposition line starting with ``line_prefix``."""
+    return float(next(line for line in text.splitlines() if line.startswith(line_prefix)).rsplit(' ', 1)[1])
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram('phase_seconds', 'Phase durations.', labels=('phase',), buckets=(1, 5))
+    histogram.observe(0.5, phase='submit')
+    histogram.observe(1, phase='submit')
+    histogram.observe(7, phase='submit')
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP phase_seconds Phase durations.', '# TYPE phase_seconds histogram']
+    assert lines[2:] == [
+        'phase_seconds_bucket{phase="submit",le="1"} 2',
+        'phase_seconds_bucket{phase="submit",le="5"} 2',
+        'phase_seconds_bucket{phase="submit",le="+Inf"} 3',
+        'phase_seconds_sum{phase="submit"} 8.5',
+        'phase_seconds_count{phase="submit"} 3',
+    ]
+
+def test_remote_snapshots_are_merged():
+    broker, worker = Registry(), Registry()
+    for registry in (broker, worker):
+        registry.counter('errors_total', 'Errors.', labels=('type',))
+        registry.histogram('wait_seconds', 'Waits.', buckets=(1,))
+    broker._metrics['errors_total'].inc(type='TimeoutException')
+    broker._metrics['wait_seconds'].observe(2)
+    worker._metrics['errors_total'].inc(2, type='TimeoutException')
+    worker.add_source(broker.snapshot)
+    text = worker.render()
+    assert 'errors_total{type="TimeoutException"} 3' in text
+    assert 'wait_seconds_bucket{le="+Inf"} 1' in text
+
+def test_gauges_are_collected_on_render_and_failures_are_skipped():
+    registry = Registry()
+    registry.gauge('sessions', 'Sessions.', lambda: {('idle',): 2}, labels=('state',))
+    registry.gauge('broken', 'Unavailable.', lambda: 1 / 0)
+    text = registry.render()
+    assert 'sessions{state="idle"} 2' in text and 'broken' not in text
+
+def test_pool_records_browser_init_and_lease_wait():
+    pool = BrowserPool(min_size=0, max_size=1, driver_factory=lambda slot: FakeDriver())
+    init_before = PHASE_SECONDS.snapshot()
+    waits_before = sum(count for _, (_, _, count) in LEASE_WAIT_SECONDS.snapshot())
+    session = pool.checkout()
+    session.record_error(ValueError("boom"))
+    pool.checkin(session)
+    assert PHASE_SECONDS.snapshot() != init_before
+    assert sum(count for _, (_, _, count) in LEASE_WAIT_SECONDS.snapshot()) == waits_before + 1
+    assert dict((tuple(k), v) for k, v in ERRORS_TOTAL.snapshot())[('ValueError',)] >= 1
+
+def test_metrics_endpoint():
+    from main import app
+    response = app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    text = response.get_data(as_text=True)
+    assert '# TYPE notebooklm_phase_seconds histogram' in text
+    assert sample(text, 'notebooklm_jobs_running') >= 0
@@ -0,0 +1,93 @@
+import pytest
+from flask import Flask
+
+from models import db, QueryHistory
+from query_history import QueryHistoryStore, fts_query
+
+NOTEBOOK_URL = "https://notebooklm.google.com/notebook/abc123"
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'history.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+@pytest.fixture
+def store(app):
+    store = QueryHistoryStore(batch_size=3, flush_interval=0.05)
+    store.init_app(app)
+    yield store
+    store.shutdown()
+
+def record(store, query, answer, notebook_id='abc123', **kwargs):
+    store.record(notebook_id, NOTEBOOK_URL, 'query', query, answer, kwargs.pop('status', 'complete'), **kwargs)
+
+def test_fts_query_quotes_words_and_prefixes_the_last():
+    assert fts_query('What is "the" summary?') == '"What" "is" "the" "summary"*'
+    assert fts_query(' -*" ') is None
+
+def test_records_are_written_in_batches(app, store):
+    for i in range(7):
+        record(store, f'Question {i}?', f'Answer {i}.', duration=1.5)
+    assert store.flush()
+    with app.app_context():
+        assert QueryHistory.query.count() == 7
+        newest = store.recent(limit=2)
+    assert [row['query'] for row in newest] == ['Question 6?', 'Question 5?']
+    assert newest[0]['duration'] == 1.5 and newest[0]['status'] == 'complete'
+    assert store.stats()['written'] == 7
+
+def test_search_matches_queries_and_answers(app, store):
+    record(store, 'What are the main findings?', 'The study summarizes three findings about sleep.')
+    record(store, 'Who funded it?', 'A public research grant.', notebook_id='other')
+    record(store, 'Anything else?', 'Nothing relevant.')
+    store.flush()
+    with app.app_context():
+        hits = store.search('summarize sleep')  # Stemmed, so "summarize" matches "summarizes".
+        assert [hit['query'] for hit in hits] == ['What are the main findings?']
+        assert '<mark>sleep</mark>' in hits[0]['snippet']
+        assert [hit['query'] for hit in store.search('fund')] == ['Who funded it?']
+        assert store.search('fund', notebook_id='abc123') == []
+        assert store.search('grant OR "NEAR(') == []  # FTS5 syntax in user input is matched literally.
+
+def test_record_never_blocks_when_the_queue_is_full(app):
+    store = QueryHistoryStore(max_queue=1)
+    store.app = app  # Bound, but with no writer thread draining the queue.
+    record(store, 'First?', 'Kept.')
+    record(store, 'Second?', 'Dropped.')
+    assert store.stats()['queued'] == 1 and store.stats()['dropped'] == 1
+
+def test_record_before_init_app_is_ignored():
+    store = QueryHistoryStore()
+    record(store, 'Question?', 'Answer.')
+    assert store.stats()['queued'] == 0
+
+def test_recording_history_captures_outcome_and_timing(monkeypatch, app, store):
+    import notebooklm
+    monkeypatch.setattr(notebooklm, 'query_history', store)
+    params = {'notebook_id': 'abc123', 'url': NOTEBOOK_URL, 'query': 'Q?'}
+    events = [{"status": "streaming"}, {"chunk": "Part one. "}, {"chunk": "Part two."},
+              {"status": "complete", "completion_signal": "observer"}]
+    assert list(notebooklm._recording_history('process', params, iter(events))) == events
+    failing = notebooklm._recording_history('query', params, iter([{"error": "Not on a NotebookLM page."}]))
+    list(failing)
+    cancelled = notebooklm._recording_history('query', params, iter(events))
+    next(cancelled)
+    cancelled.close()
+    store.flush()
+    with app.app_context():
+        rows = {row['status']: row for row in store.recent()}
+    assert rows['complete']['answer'] == 'Part one. Part two.' and rows['complete']['first_chunk_seconds'] is not None
+    assert rows['error']['error'] == 'Not on a NotebookLM page.'
+    assert 'cancelled' in rows
+
+def test_history_endpoints_validate_arguments():
+    from main import app as main_app
+    client = main_app.test_client()
+    assert client.get('/api/history/search').status_code == 400
+    assert client.get('/api/history?limit=abc').status_code == 400
+    assert client.get('/api/history?limit=5').status_code == 200
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+
+from query_jobs import JOB_CANCELLED, JOB_COMPLETED, JOB_FAILED, JobScheduler, QueryJob
+
+
+def gated_runner(gate, order):
+    """Records the order jobs start in; the first job blocks until ``gate`` is set."""
+    def run(params):
+        order.append(params['name'])
+        if params.get('block'):
+            gate.wait(5)
+        yield {"chunk": params['name']}
+        yield {"status": "complete"}
+    return run
+
+def submit_while_busy(scheduler, gate, jobs):
+    """Occupies the single worker, queues ``jobs``, then releases the worker."""
+    blocker = scheduler.submit('query', {'name': 'blocker', 'block': True}, client_id='x')
+    while blocker.state == 'queued':
+        blocker.wait(0.01)
+    submitted = [scheduler.submit('query', {'name': name}, priority, client) for name, priority, client in jobs]
+    gate.set()
+    for job in submitted:
+        assert job.wait(5)
+    return submitted
+
+def test_job_runs_and_keeps_events():
+    scheduler = JobScheduler({'query': gated_runner(threading.Event(), [])})
+    job = scheduler.submit('query', {'name': 'answer'})
+    assert job.wait(5)
+    assert job.state == JOB_COMPLETED
+    assert job.result_text() == 'answer'
+    assert job.events[0]['status'] == 'queued'
+    # Subscribers arriving late replay everything from their offset.
+    assert list(job.iter_events(1)) == [{"chunk": "answer"}, {"status": "complete"}]
+    scheduler.shutdown()
+
+def test_higher_priority_runs_first():
+    gate, order = threading.Event(), []
+    scheduler = JobScheduler({'query': gated_runner(gate, order)})
+    submit_while_busy(scheduler, gate, [('low', 'low', 'a'), ('normal', 'normal', 'a'), ('high', 'high', 'a')])
+    assert order == ['blocker', 'high', 'normal', 'low']
+    scheduler.shutdown()
+
+def test_clients_are_served_round_robin():
+    """A client with many queued jobs does not starve another client of the same priority."""
+    gate, order = threading.Event(), []
+    scheduler = JobScheduler({'query': gated_runner(gate, order)})
+    submit_while_busy(scheduler, gate, [('a1', 'normal', 'a'), ('a2', 'normal', 'a'), ('a3', 'normal', 'a'),
+                                        ('b1', 'normal', 'b')])
+    assert order == ['blocker', 'a1', 'b1', 'a2', 'a3']
+    scheduler.shutdown()
+
+def test_cancel_queued_job():
+    gate = threading.Event()
+    scheduler = JobScheduler({'query': gated_runner(gate, [])})
+    blocker = scheduler.submit('query', {'name': 'blocker', 'block': True})
+    queued = scheduler.submit('query', {'name': 'queued'})
+    assert scheduler.stats()['queue_depth'] >= 1
+    assert scheduler.cancel(queued.id)
+    assert queued.state == JOB_CANCELLED
+    gate.set()
+    assert blocker.wait(5)
+    assert not scheduler.cancel(blocker.id)
+    scheduler.shutdown()
+
+def test_cancel_running_job_stops_runner():
+    closed = threading.Event()
+    started = threading.Event()
+
+    def endless(params):
+        try:
+            while True:
+                started.set()
+                yield {"chunk": "."}
+        finally:
+            closed.set()
+
+    scheduler = JobScheduler({'query': endless})
+    job = scheduler.submit('query', {})
+    assert started.wait(5)
+    scheduler.cancel(job.id)
+    assert job.wait(5)
+    assert job.state == JOB_CANCELLED
+    assert closed.is_set()
+    scheduler.shutdown()
+
+def test_error_event_marks_job_failed():
+    scheduler = JobScheduler({'query': lambda params: iter([{"error": "Browser not available"}])})
+    job = scheduler.submit('query', {})
+    assert job.wait(5)
+    assert job.state == JOB_FAILED
+    assert job.to_dict()['error'] == 'Browser not available'
+    scheduler.shutdown()
+
+def test_stats_report_wait_times():
+    scheduler = JobScheduler({'query': gated_runner(threading.Event(), [])})
+    scheduler.submit('query', {'name': 'a'}).wait(5)
+    stats = scheduler.stats()
+    assert stats['queue_depth'] == 0
+    assert stats['recent_wait_seconds']['samples'] == 1
+    scheduler.shutdown()
+
+def test_iter_events_waits_for_live_events():
+    job = QueryJob('query', {})
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(job.iter_events()))
+    reader.start()
+    job.publish({"chunk": "a"})
+    job._set_state(JOB_COMPLETED)
+    reader.join(5)
+    assert received == [{"chunk": "a"}]
+
+def test_identical_requests_share_one_job():
+    gate, order = threading.Event(), []
+    scheduler = JobScheduler({'query': gated_runner(gate, order)})
+    first = scheduler.submit('query', {'name': 'answer', 'block': True}, client_id='a', coalesce_key=('nb', 'q'))
+    while first.state == 'queued':
+        first.wait(0.01)
+    second = scheduler.submit('query', {'name': 'answer', 'block': True}, client_id='b', coalesce_key=('nb', 'q'))
+    assert second is first
+    gate.set()
+    assert first.wait(5)
+    # The late joiner replays everything the first request saw.
+    assert [e for e in second.iter_events() if 'chunk' in e] == [{"chunk": "answer"}]
+    assert order == ['answer']
+    assert scheduler.stats()['coalesced_requests'] == 1
+    # Once finished, the same request runs again instead of attaching to a stale job.
+    third = scheduler.submit('query', {'name': 'answer'}, coalesce_key=('nb', 'q'))
+    assert third is not first
+    assert third.wait(5)
+    scheduler.shutdown()
+
+def test_last_subscriber_detaching_reports_job_unneeded():
+    job = QueryJob('query', {})
+    job.attach()
+    job.attach()
+    assert not job.detach()
+    assert job.detach()
+    job.keep_alive = True
+    job.attach()
+    assert not job.detach()
+
+def test_aiter_events_follows_live_events_without_a_thread():
+    job = QueryJob('query', {})
+
+    async def follow():
+        return [event async for event in job.aiter_events()]
+
+    def produce():
+        job.publish({"chunk": "a"})
+        job.publish({"chunk": "b"})
+        job._set_state(JOB_COMPLETED)
+
+    async def scenario():
+        follower = asyncio.ensure_future(follow())
+        await asyncio.sleep(0.01)
+        threading.Thread(target=produce).start()
+        return await asyncio.wait_for(follower, timeout=5)
+
+    assert asyncio.run(scenario()) == [{"chunk": "a"}, {"chunk": "b"}]
+
+def test_same_question_as_different_job_kinds_is_not_coalesced():
+    from notebooklm import _coalesce_key
+    gate, order = threading.Event(), []
+    scheduler = JobScheduler({kind: gated_runner(gate, order) for kind in ('process', 'query')}, workers=2)
+    params = {'notebook_id': 'nb', 'query': 'What is this?', 'stream_mode': 'observer', 'timeout': 180}
+    jobs = [scheduler.submit(kind, dict(params, name=kind, block=True), coalesce_key=_coalesce_key(kind, params))
+            for kind in ('process', 'query')]
+    again = scheduler.submit('query', dict(params, name='again'), coalesce_key=_coalesce_key('query', params))
+    gate.set()
+    assert jobs[0] is not jobs[1] and again is jobs[1]
+    assert all(job.wait(5) for job in jobs)
+    assert sorted(order) == ['process', 'query']
+    scheduler.shutdown()
+
+def test_query_jobs_without_a_url_use_the_open_notebook(monkeypatch, fake_browser):
+    import notebooklm
+    from main import app
+    monkeypatch.setattr(notebooklm, 'last_opened_url', 'https://notebooklm.google.com/notebook/open123')
+    response = app.test_client().post('/api/jobs', json={'mode': 'query', 'query': 'Which notebook?'})
+    assert response.status_code == 202
+    job = notebooklm.job_scheduler.get(response.json['job_id'])
+    assert job.params['notebook_id'] == 'open123'
+    assert job.wait(5)
@@ -0,0 +1,181 @@
+import pytest
+from selenium.common.exceptions import StaleElementReferenceException
+from selenium.webdriver.common.by import By
+
+import response_stream
+from response_stream import (DRAIN_OBSERVER_SCRIPT, END_REASON_INACTIVITY, INSTALL_COMPLETION_SCRIPT,
+                             INSTALL_OBSERVER_SCRIPT, READ_TEXT_DELTA_SCRIPT, ObserverResponseStream,
+                             PollingResponseStream, open_response_stream)
+
+SELECTOR = (By.CSS_SELECTOR, '.message-content')
+
+
+class FakeElement:
+    """A response element whose text grows by one scripted step per read."""
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.reads = 0
+        self.stale_at = None
+
+    @property
+    def text(self):
+        self.reads += 1
+        if self.stale_at == self.reads:
+            raise StaleElementReferenceException()
+        index = min(self.reads - 1, len(self.steps) - 1)
+        return self.steps[index]
+
+
+class FakeDriver:
+    """
+    Answers the stream's scripts from a FakeElement. ``drains`` lists observer drain
+    results (text, or None for a lost observer); ``signals`` lists the completion
+    signal reported on successive reads.
+    """
+
+    def __init__(self, element, drains=None, signals=None):
+        self.element = element
+        self.drains = list(drains or [])
+        self.signals = list(signals or [])
+        self.scripts = []
+        self.transferred = 0
+        self.drain_waits = []
+
+    def _signal(self):
+        return self.signals.pop(0) if len(self.signals) > 1 else (self.signals[0] if self.signals else None)
+
+    def find_elements(self, by, value):
+        return [self.element]
+
+    def execute_script(self, script, *args):
+        self.scripts.append(script)
+        if script == READ_TEXT_DELTA_SCRIPT:
+            element, selector, offset = args
+            text = (element or self.element).text
+            self.transferred += len(text[offset:])
+            return {'delta': text[offset:], 'length': len(text), 'element': self.element, 'done': self._signal()}
+        return True
+
+    def execute_async_script(self, script, *args):
+        assert script == DRAIN_OBSERVER_SCRIPT
+        self.drain_waits.append(args[0])
+        delta = self.drains.pop(0) if self.drains else ''
+        if delta is None:
+            return None
+        return {'delta': delta, 'done': self._signal()}
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(response_stream.time, 'sleep', lambda seconds: None)
+
+def test_polling_stream_emits_only_new_text():
+    """Each chunk is the suffix added since the previous read."""
+    element = FakeElement(["Hel", "Hello", "Hello world"])
+    stream = PollingResponseStream(FakeDriver(element), element, SELECTOR)
+    chunks = list(stream.iter_chunks(timeout=5, inactivity_timeout=0.01))
+    assert "".join(chunks) == "Hello world"
+    assert stream.completed
+    assert stream.text_length == len("Hello world")
+
+def test_polling_stream_transfers_only_deltas():
+    """Polling fetches characters after the emitted offset, not the whole answer each tick."""
+    steps = ["a" * n for n in range(0, 1001, 100)]
+    element = FakeElement(steps)
+    driver = FakeDriver(element)
+    stream = PollingResponseStream(driver, element, SELECTOR)
+    assert "".join(stream.iter_chunks(timeout=5, inactivity_timeout=0.01)) == "a" * 1000
+    assert driver.transferred == 1000
+
+def test_polling_interval_adapts_to_activity():
+    """The interval backs off while idle and resets when text arrives."""
+    element = FakeElement(["x"])
+    stream = PollingResponseStream(FakeDriver(element), element, SELECTOR)
+    for _ in range(20):
+        stream._adapt_poll_interval(False)
+    assert stream.poll_interval == stream.max_poll_interval
+    stream._adapt_poll_interval(True)
+    assert stream.poll_interval == stream.min_poll_interval
+
+def test_polling_stream_recovers_from_stale_element_without_resending():
+    """A stale element is re-acquired and streaming resumes from the same offset."""
+    element = FakeElement(["Hel", "Hello", "Hello", "Hello world"])
+    element.stale_at = 2
+    stream = PollingResponseStream(FakeDriver(element), element, SELECTOR)
+    assert "".join(stream.iter_chunks(timeout=5, inactivity_timeout=0.01)) == "Hello world"
+
+def test_observer_stream_forwards_pushed_chunks():
+    """Text drained from the in-page buffer is forwarded as-is."""
+    element = FakeElement(["Hello world"])
+    driver = FakeDriver(element, drains=["Hello", " world"])
+    stream = ObserverResponseStream(driver, element, SELECTOR)
+    chunks = list(stream.iter_chunks(timeout=5, inactivity_timeout=0.01))
+    assert chunks == ["Hello", " world"]
+    assert INSTALL_OBSERVER_SCRIPT in driver.scripts
+    assert element.reads == 1  # only the final consistency check reads the element
+
+def test_observer_stream_falls_back_to_polling_at_same_offset():
+    """If the observer disappears, polling continues without repeating emitted text."""
+    element = FakeElement(["Hello world"])
+    driver = FakeDriver(element, drains=["Hello", None])
+    stream = ObserverResponseStream(driver, element, SELECTOR)
+    chunks = list(stream.iter_chunks(timeout=5, inactivity_timeout=0.01))
+    assert chunks == ["Hello", " world"]
+    assert not stream.observing
+
+def test_open_response_stream_falls_back_for_non_css_selector():
+    """The observer needs a CSS selector; other locators use polling."""
+    element = FakeElement(["x"])
+    stream = open_response_stream(FakeDriver(element), element, (By.XPATH, '//div'), 'observer')
+    assert isinstance(stream, PollingResponseStream)
+
+def test_completion_signal_ends_stream_before_inactivity_timeout():
+    """A page completion signal finishes the stream without waiting out the inactivity timeout."""
+    element = FakeElement(["Hel", "Hello", "Hello"])
+    driver = FakeDriver(element, signals=[None, None, 'stop_button_gone'])
+    stream = PollingResponseStream(driver, element, SELECTOR,
+                                   completion_selectors=([('stop_button', 'button')], []))
+    stream.completion_settle = 0
+    chunks = list(stream.iter_chunks(timeout=5, inactivity_timeout=60))
+    assert "".join(chunks) == "Hello"
+    assert stream.completed
+    assert stream.end_reason == 'stop_button_gone'
+    assert INSTALL_COMPLETION_SCRIPT in driver.scripts
+
+def test_completion_signal_ignored_while_text_is_growing():
+    """A signal reported in the same tick as new text does not end the stream."""
+    element = FakeElement(["a", "ab", "abc", "abc"])
+    driver = FakeDriver(element, signals=['copy_button'])
+    stream = PollingResponseStream(driver, element, SELECTOR)
+    stream.completion_settle = 0
+    assert "".join(stream.iter_chunks(timeout=5, inactivity_timeout=60)) == "abc"
+    assert stream.end_reason == 'copy_button'
+
+def test_observer_stream_reports_completion_signal():
+    """Completion signals are delivered with the drained text in observer mode."""
+    element = FakeElement(["Hello"])
+    driver = FakeDriver(element, drains=["Hello", ""], signals=[None, 'copy_button'])
+    stream = ObserverResponseStream(driver, element, SELECTOR)
+    stream.completion_settle = 0
+    assert list(stream.iter_chunks(timeout=5, inactivity_timeout=60)) == ["Hello"]
+    assert stream.end_reason == 'copy_button'
+
+def test_observer_waits_only_the_settle_period_after_the_last_text():
+    """A signal that arrives with the last text is not held up by a full-length drain."""
+    element = FakeElement(["Hello"])
+    driver = FakeDriver(element, drains=["Hello"], signals=['stop_button_gone'])
+    stream = ObserverResponseStream(driver, element, SELECTOR)
+    stream.completion_settle = 0.05
+    assert list(stream.iter_chunks(timeout=5, inactivity_timeout=60)) == ["Hello"]
+    assert stream.end_reason == 'stop_button_gone'
+    assert driver.drain_waits[0] == stream.drain_wait_ms
+    assert all(wait <= 50 for wait in driver.drain_waits[1:])
+
+def test_inactivity_timeout_is_the_fallback():
+    """Without any page signal the stream still ends after the inactivity timeout."""
+    element = FakeElement(["Hello"])
+    stream = PollingResponseStream(FakeDriver(element), element, SELECTOR)
+    list(stream.iter_chunks(timeout=5, inactivity_timeout=0.01))
+    assert stream.completed
+    assert stream.end_reason == END_REASON_INACTIVITY
@@ -0,0 +1,83 @@
+import pytest
+from selenium.webdriver.common.by import By
+
+from selector_lookup import FIND_FIRST_MATCH_SCRIPT, SelectorOrderCache, find_first_match
+
+SELECTORS = [
+    (By.CSS_SELECTOR, '[data-testid="chat-input"]'),
+    (By.XPATH, "//textarea[contains(@placeholder, 'Start typing')]"),
+    (By.CSS_SELECTOR, 'textarea[placeholder*="Ask"]'),
+]
+
+
+class FakeDriver:
+    """Resolves FIND_FIRST_MATCH_SCRIPT against a set of selector values present on the page."""
+
+    def __init__(self, present):
+        self.present = present
+        self.calls = 0
+
+    def execute_script(self, script, selectors, clickable):
+        assert script == FIND_FIRST_MATCH_SCRIPT
+        self.calls += 1
+        for index, (by, value) in enumerate(selectors):
+            if value in self.present:
+                return [f"element:{value}", index]
+        return None
+
+def test_find_first_match_uses_one_call_and_reports_selector():
+    """The whole list is evaluated in a single script call."""
+    driver = FakeDriver(present={'textarea[placeholder*="Ask"]'})
+    element, selector = find_first_match(driver, SELECTORS)
+    assert element == 'element:textarea[placeholder*="Ask"]'
+    assert selector == SELECTORS[2]
+    assert driver.calls == 1
+
+def test_find_first_match_returns_none_without_match():
+    assert find_first_match(FakeDriver(present=set()), SELECTORS) == (None, None)
+
+def test_find_first_match_rejects_unbatchable_strategies():
+    with pytest.raises(ValueError):
+        find_first_match(FakeDriver(present=set()), [(By.ID, 'chat')])
+
+def test_cache_orders_hit_selectors_first(tmp_path):
+    """A selector that matched moves ahead of those that never did; the rest keep their order."""
+    cache = SelectorOrderCache(str(tmp_path / 'selectors.json'))
+    assert cache.ordered(SELECTORS) == SELECTORS
+    cache.record_hit(SELECTORS, SELECTORS[2])
+    assert cache.ordered(SELECTORS) == [SELECTORS[2], SELECTORS[0], SELECTORS[1]]
+
+def test_cache_orders_by_hit_rate_not_the_last_hit(tmp_path):
+    """One stray hit on a rarely useful selector does not move it ahead of the usual one."""
+    cache = SelectorOrderCache(str(tmp_path / 'selectors.json'))
+    for _ in range(5):
+        cache.record_hit(SELECTORS, SELECTORS[1])
+    cache.record_hit(SELECTORS, SELECTORS[2])
+    assert cache.ordered(SELECTORS) == [SELECTORS[1], SELECTORS[2], SELECTORS[0]]
+    assert cache.stats()[cache._key(SELECTORS, SELECTORS[1])]['hits'] == 5
+    # Once the page changes for good, the new selector takes over after a few lookups.
+    for _ in range(5):
+        cache.record_hit(SELECTORS, SELECTORS[2])
+    assert cache.ordered(SELECTORS)[0] == SELECTORS[2]
+
+def test_lists_sharing_a_selector_are_ordered_independently(tmp_path):
+    """Hits in one list neither promote nor decay the shared selector in another list."""
+    cache = SelectorOrderCache(str(tmp_path / 'selectors.json'))
+    load_indicators = [(By.CSS_SELECTOR, 'div[aria-label="Sources"]'), SELECTORS[0]]
+    for _ in range(5):
+        cache.record_hit(load_indicators, SELECTORS[0])
+        cache.record_hit(SELECTORS, SELECTORS[1])
+    assert cache.ordered(load_indicators)[0] == SELECTORS[0]
+    assert cache.ordered(SELECTORS) == [SELECTORS[1], SELECTORS[0], SELECTORS[2]]
+    assert cache._key(SELECTORS, SELECTORS[0]) not in cache.stats()
+
+def test_cache_order_survives_restart(tmp_path):
+    """The learned order is persisted and reloaded by a new cache instance."""
+    path = str(tmp_path / 'selectors.json')
+    SelectorOrderCache(path).record_hit(SELECTORS, SELECTORS[1])
+    assert SelectorOrderCache(path).ordered(SELECTORS)[0] == SELECTORS[1]
+
+def test_cache_ignores_corrupt_file(tmp_path):
+    path = tmp_path / 'selectors.json'
+    path.write_text('{not json')
+    assert SelectorOrderCache(str(path)).ordered(SELECTORS) == SELECTORS
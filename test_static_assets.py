@@ -0,0 +1,80 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask, request
+
+from static_assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, StaticAssets
+
+SCRIPT = b"console.log('hello');\n" * 100
+HASHED_SCRIPT = 'dist/script.min.0123456789.js'
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    """A static folder as build-static.sh leaves it."""
+    dist = tmp_path / 'dist'
+    dist.mkdir()
+    (tmp_path / 'index.html').write_text('<script src="dist/script.min.js"></script>')
+    (dist / 'index.html').write_text(f'<script src="{HASHED_SCRIPT}"></script>')
+    (tmp_path / HASHED_SCRIPT).write_bytes(SCRIPT)
+    (tmp_path / f'{HASHED_SCRIPT}.gz').write_bytes(gzip.compress(SCRIPT))
+    (tmp_path / f'{HASHED_SCRIPT}.br').write_bytes(b'brotli-bytes')
+    (dist / 'manifest.json').write_text(json.dumps({'files': {'dist/script.min.js': HASHED_SCRIPT}}))
+    return tmp_path
+
+@pytest.fixture
+def client(static_dir):
+    app = Flask(__name__)
+    assets = StaticAssets(str(static_dir))
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        return assets.response(path, request)
+
+    return app.test_client()
+
+def test_hashed_assets_are_immutable_and_negotiated(client):
+    response = client.get(f'/{HASHED_SCRIPT}', headers={'Accept-Encoding': 'gzip, deflate, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.data == b'brotli-bytes'
+    assert response.headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+    response = client.get(f'/{HASHED_SCRIPT}', headers={'Accept-Encoding': 'gzip, br;q=0'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == SCRIPT
+
+    response = client.get(f'/{HASHED_SCRIPT}')
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == SCRIPT
+
+def test_matching_etag_answers_304(client):
+    first = client.get(f'/{HASHED_SCRIPT}', headers={'Accept-Encoding': 'gzip'})
+    etag = first.headers['ETag']
+    repeat = client.get(f'/{HASHED_SCRIPT}', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert repeat.status_code == 304
+    assert repeat.data == b''
+    # The identity representation has its own ETag.
+    other = client.get(f'/{HASHED_SCRIPT}', headers={'If-None-Match': etag})
+    assert other.status_code == 200 and other.headers['ETag'] != etag
+
+def test_unknown_paths_get_the_built_index(client):
+    for path in ('/', '/index.html', '/some/page'):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/html'
+        assert HASHED_SCRIPT.encode() in response.data
+        assert response.headers['Cache-Control'] == REVALIDATE_CACHE_CONTROL
+
+def test_assets_are_served_from_memory(static_dir, client):
+    (static_dir / HASHED_SCRIPT).unlink()
+    assert client.get(f'/{HASHED_SCRIPT}').data == SCRIPT
+
+def test_large_text_assets_without_variants_are_gzipped_at_load(tmp_path):
+    (tmp_path / 'index.html').write_text('<p>hello</p>' * 200)
+    assets = StaticAssets(str(tmp_path))
+    variants = assets.index.variants
+    assert gzip.decompress(variants['gzip'][0]) == variants['identity'][0]
+    assert assets.index.cache_control == REVALIDATE_CACHE_CONTROL
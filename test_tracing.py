@@ -0,0 +1,154 @@
+import json
+
+from tracing import Tracer
+
+
+def make_tracer(tmp_path, **kwargs):
+    return Tracer(path=str(tmp_path / 'traces.jsonl'), **kwargs)
+
+def test_spans_nest_under_the_active_span(tmp_path):
+    tracer = make_tracer(tmp_path)
+    with tracer.trace('process', notebook_id='abc123') as trace:
+        with tracer.span('navigate', url='https://notebooklm.google.com/'):
+            with tracer.span('webdriver.get'):
+                pass
+        with tracer.span('ask'):
+            pass
+    tree = tracer.get(trace.id)
+    assert tree['in_progress'] is False
+    root = tree['root']
+    assert root['name'] == 'process' and root['attributes'] == {'notebook_id': 'abc123', 'status': 'ok'}
+    assert [child['name'] for child in root['children']] == ['navigate', 'ask']
+    assert root['children'][0]['children'][0]['name'] == 'webdriver.get'
+    assert root['children'][0]['duration_ms'] >= 0
+
+def test_spans_outside_a_trace_do_nothing(tmp_path):
+    tracer = make_tracer(tmp_path)
+    with tracer.span('navigate') as span:
+        assert span is None
+    assert tracer.current_trace_id() is None
+
+def test_wrapped_generators_keep_their_return_value(tmp_path):
+    tracer = make_tracer(tmp_path)
+
+    @tracer.wrap('navigate')
+    def navigate():
+        yield {"status": "opening_browser"}
+        return True
+
+    def run():
+        ready = yield from navigate()
+        yield {"ready": ready}
+
+    with tracer.trace('process') as trace:
+        events = list(run())
+    assert events[-1] == {"ready": True}
+    assert [c['name'] for c in tracer.get(trace.id)['root']['children']] == ['navigate']
+
+def test_errors_and_cancellation_are_recorded(tmp_path):
+    tracer = make_tracer(tmp_path)
+
+    def job():
+        with tracer.trace('query', trace_id='cancelled-trace'):
+            with tracer.span('chunk_emit'):
+                yield {"chunk": "a"}
+            yield {"chunk": "b"}
+
+    events = job()
+    next(events)
+    events.close()
+    assert tracer.get('cancelled-trace')['root']['attributes']['status'] == 'cancelled'
+    try:
+        with tracer.trace('query', trace_id='failed-trace'):
+            with tracer.span('selector_search'):
+                raise ValueError("no input")
+    except ValueError:
+        pass
+    root = tracer.get('failed-trace')['root']
+    assert root['attributes']['status'] == 'error'
+    assert root['children'][0]['attributes']['error'] == 'ValueError: no input'
+
+def test_span_count_is_capped(tmp_path):
+    tracer = make_tracer(tmp_path, max_spans=3)
+    with tracer.trace('process') as trace:
+        for _ in range(5):
+            with tracer.span('chunk_emit'):
+                pass
+    tree = tracer.get(trace.id)
+    assert len(tree['root']['children']) == 2 and tree['dropped_spans'] == 3
+
+def test_finished_traces_are_exported_and_found_after_eviction(tmp_path):
+    tracer = make_tracer(tmp_path, keep=1, max_bytes=2000, backups=2)
+    ids = []
+    for i in range(10):
+        with tracer.trace('process', index=i) as trace:
+            with tracer.span('navigate'):
+                pass
+        ids.append(trace.id)
+    assert (tmp_path / 'traces.jsonl.1').exists()  # Rotated.
+    line = json.loads((tmp_path / 'traces.jsonl').read_text().splitlines()[-1])
+    assert line['trace_id'] == ids[-1]
+    assert tracer.get(ids[-3])['root']['attributes']['index'] == 7  # From a file, not memory.
+    assert tracer.get('unknown') is None
+
+def test_webdriver_commands_become_spans(tmp_path):
+    tracer = make_tracer(tmp_path)
+
+    class Driver:
+        def execute(self, command, params=None):
+            return {'value': command}
+
+    driver = tracer.trace_webdriver(Driver())
+    with tracer.trace('process') as trace:
+        assert driver.execute('findElements', {'using': 'css selector'}) == {'value': 'findElements'}
+    assert tracer.get(trace.id)['root']['children'][0]['name'] == 'webdriver.findElements'
+
+def test_job_runner_tags_first_event_and_records_queue_wait(monkeypatch, tmp_path):
+    import notebooklm
+    tracer = make_tracer(tmp_path)
+    monkeypatch.setattr(notebooklm, 'tracer', tracer)
+
+    def runner(params):
+        with tracer.span('ask'):
+            yield {"status": "streaming"}
+        yield {"status": "complete"}
+
+    events = list(notebooklm._traced('query', runner)({'trace_id': 'job-trace', 'notebook_id': 'abc123'}))
+    assert events == [{"status": "streaming", "trace_id": "job-trace"}, {"status": "complete"}]
+    root = tracer.get('job-trace')['root']
+    assert [c['name'] for c in root['children']] == ['queue_wait', 'ask']
+
+def test_trace_endpoint():
+    from main import app
+    from tracing import tracer
+    with tracer.trace('process') as trace:
+        pass
+    client = app.test_client()
+    assert client.get(f'/api/debug/trace/{trace.id}').json['root']['name'] == 'process'
+    assert client.get('/api/debug/trace/missing').status_code == 404
+
+def test_first_streamed_event_and_job_response_carry_the_trace_id(monkeypatch, tmp_path):
+    import notebooklm
+    from main import app
+    from query_jobs import JobScheduler
+    tracer = make_tracer(tmp_path)
+    monkeypatch.setattr(notebooklm, 'tracer', tracer)
+
+    def runner(params):
+        yield {"chunk": "Answer"}
+        yield {"status": "complete"}
+
+    scheduler = JobScheduler({kind: notebooklm._traced(kind, runner) for kind in ('process', 'query')})
+    monkeypatch.setattr(notebooklm, 'job_scheduler', scheduler)
+    client = app.test_client()
+    body = {'notebooklm_url': 'https://notebooklm.google.com/notebook/trace123', 'query': 'Traced?',
+            'bypass_cache': True}
+
+    response = client.post('/api/process_query', json=body)
+    first = json.loads(response.get_data(as_text=True).split('\n\n')[0][len('data: '):])
+    assert first['status'] == 'queued'
+    assert tracer.get(first['trace_id'])['root']['name'] == 'process'
+
+    job = client.post('/api/jobs', json=dict(body, query='Traced job?')).json
+    assert job['trace_id'] and client.get(f"/api/jobs/{job['job_id']}").json['trace_id'] == job['trace_id']
+    scheduler.shutdown()
@@ -1,3 +1,4 @@
+import json
 import pytest
 from main import app, db
 from models import User
@@ -114,4 +115,105 @@ def test_delete_user(test_client):
     
     # Verify the user is gone
     get_response = test_client.get(f'/api/users/{user_id}')
-    assert get_response.status_code == 404
\ No newline at end of file
+    assert get_response.status_code == 404
+
+def create_users(test_client, count):
+    for i in range(count):
+        test_client.post('/api/users', json={'username': f'user{i}', 'email': f'user{i}@example.com'})
+
+def test_get_users_keyset_pagination(test_client):
+    """Test walking the user list page by page with the next cursor."""
+    create_users(test_client, 5)
+    first = test_client.get('/api/users?limit=2')
+    assert [u['username'] for u in first.json] == ['user0', 'user1']
+    cursor = first.headers['X-Next-Cursor']
+    assert 'rel="next"' in first.headers['Link']
+
+    second = test_client.get(f'/api/users?limit=2&after={cursor}')
+    assert [u['username'] for u in second.json] == ['user2', 'user3']
+    last = test_client.get(f"/api/users?limit=2&after={second.headers['X-Next-Cursor']}")
+    assert [u['username'] for u in last.json] == ['user4']
+    assert 'X-Next-Cursor' not in last.headers
+
+def test_get_users_without_paging_args_returns_everyone(test_client, monkeypatch):
+    """Test that the unpaginated listing is not cut off at the default page size."""
+    import user
+    monkeypatch.setattr(user, 'DEFAULT_PAGE_SIZE', 2)
+    create_users(test_client, 5)
+    response = test_client.get('/api/users')
+    assert [u['username'] for u in response.json] == [f'user{i}' for i in range(5)]
+    assert 'X-Next-Cursor' not in response.headers
+    assert len(test_client.get('/api/users?after=0').json) == 2
+
+def test_get_users_field_selection(test_client):
+    """Test returning only the requested fields."""
+    create_users(test_client, 1)
+    response = test_client.get('/api/users?fields=username')
+    assert response.json == [{'username': 'user0'}]
+    assert test_client.get('/api/users?fields=password').status_code == 400
+    assert test_client.get('/api/users?limit=0').status_code == 400
+    assert test_client.get('/api/users?limit=abc').status_code == 400
+    assert test_client.get('/api/users?after=abc').status_code == 400
+    assert test_client.get('/api/users/export?after=1.5').status_code == 400
+
+def test_get_users_streaming_ndjson(test_client, monkeypatch):
+    """Test streaming every user as NDJSON, fetched in small batches."""
+    import user
+    monkeypatch.setattr(user, 'STREAM_BATCH_SIZE', 2)
+    create_users(test_client, 5)
+    response = test_client.get('/api/users?format=ndjson&fields=id,email')
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [r['email'] for r in rows] == [f'user{i}@example.com' for i in range(5)]
+    assert set(rows[0]) == {'id', 'email'}
+
+    limited = test_client.get('/api/users?limit=3', headers={'Accept': 'application/x-ndjson'})
+    assert len(limited.get_data(as_text=True).splitlines()) == 3
+
+def test_import_users_ndjson_reports_row_errors(test_client):
+    """Test a bulk import where some rows are invalid or conflict, without aborting the rest."""
+    test_client.post('/api/users', json={'username': 'existing', 'email': 'existing@example.com'})
+    body = '\n'.join([
+        json.dumps({'username': 'a', 'email': 'a@example.com'}),
+        json.dumps({'username': 'existing', 'email': 'new@example.com'}),
+        'not json',
+        json.dumps({'username': ' ', 'email': 'b@example.com'}),
+        json.dumps({'username': 'a', 'email': 'other@example.com'}),
+        json.dumps({'username': 'c', 'email': 'c@example.com'}),
+    ])
+    response = test_client.post('/api/users/import', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.json['imported'] == 2
+    assert [e['row'] for e in response.json['errors']] == [2, 3, 4, 5]
+    assert response.json['errors'][0]['error'] == 'A user with this username or email already exists'
+    assert len(test_client.get('/api/users').json) == 3
+
+def test_import_users_csv_in_batches(test_client, monkeypatch):
+    """Test a CSV import spanning several batched transactions."""
+    import user
+    monkeypatch.setattr(user, 'IMPORT_BATCH_SIZE', 3)
+    rows = ['username,email'] + [f'user{i},user{i}@example.com' for i in range(10)]
+    response = test_client.post('/api/users/import', data='\n'.join(rows), content_type='text/csv')
+    assert response.json == {'imported': 10, 'failed': 0, 'errors': []}
+    assert len(test_client.get('/api/users').json) == 10
+
+def test_import_users_rejects_undecodable_or_malformed_bodies(test_client):
+    """Test that a body that is not UTF-8 or not valid CSV is a 400, not a server error."""
+    response = test_client.post('/api/users/import', data=b'{"username": "\xff"}\n', content_type='application/x-ndjson')
+    assert response.status_code == 400
+    assert response.json['error'] == 'Request body is not valid UTF-8'
+
+    response = test_client.post('/api/users/import', data='username,email\n"a,a@example.com', content_type='text/csv')
+    assert response.status_code == 400
+    assert response.json['error'].startswith('Invalid CSV')
+    assert response.json['imported'] == 0
+
+def test_export_users_streams_csv_and_ndjson(test_client):
+    """Test exporting all users as CSV and NDJSON."""
+    create_users(test_client, 3)
+    csv_export = test_client.get('/api/users/export?format=csv&fields=username,email')
+    assert csv_export.mimetype == 'text/csv'
+    assert csv_export.get_data(as_text=True).splitlines() == [
+        'username,email', 'user0,user0@example.com', 'user1,user1@example.com', 'user2,user2@example.com']
+    ndjson_export = test_client.get('/api/users/export')
+    assert len(ndjson_export.get_data(as_text=True).splitlines()) == 3
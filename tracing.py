@@ -0,0 +1,305 @@
+"""
+Per-request span tracing.
+
+A trace covers one query: its root span runs from submission to the last event, with nested
+spans for the queue wait, the browser lease, navigation, every selector search, every
+WebDriver command and every chunk emitted. The active span is kept in a context variable,
+so ``tracer.span(...)`` nests under whatever is running in the current thread and costs a
+single lookup when no trace is active.
+
+Finished traces are appended as one JSON line each to a rotating file (TRACE_FILE) and the
+most recent ones are also kept in memory; GET /api/debug/trace/<id> returns the span tree.
+"""
+import os
+import json
+import time
+import uuid
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACE_FILE = os.path.join(os.path.dirname(__file__), 'database', 'traces.jsonl')
+
+# (trace, span) currently active in this thread or task.
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+
+    __slots__ = ('id', 'parent_id', 'name', 'start', 'end', 'attributes')
+
+    def __init__(self, name: str, parent_id: Optional[str], start: float, attributes: dict):
+        self.id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start
+        self.end = None
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {'span_id': self.id, 'parent_id': self.parent_id, 'name': self.name, 'start': self.start,
+                'end': self.end, 'attributes': self.attributes}
+
+
+class Trace:
+
+    def __init__(self, trace_id: str, name: str, start: float, attributes: dict, max_spans: int):
+        self.id = trace_id
+        self.root = Span(name, None, start, attributes)
+        self.spans: List[Span] = [self.root]
+        self.max_spans = max_spans
+        self.dropped_spans = 0
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> bool:
+        with self._lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped_spans += 1
+                return False
+            self.spans.append(span)
+            return True
+
+    def to_dict(self):
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {'trace_id': self.id, 'name': self.root.name, 'start': self.root.start, 'end': self.root.end,
+                'dropped_spans': self.dropped_spans, 'spans': spans}
+
+
+def span_tree(trace: dict) -> dict:
+    """Nests a trace's flat span list under its root; times become milliseconds from the trace start."""
+    origin = trace['start']
+    nodes = {}
+    for span in trace['spans']:
+        end = span['end']
+        nodes[span['span_id']] = {
+            'name': span['name'],
+            'span_id': span['span_id'],
+            'offset_ms': round((span['start'] - origin) * 1000, 3),
+            'duration_ms': round((end - span['start']) * 1000, 3) if end is not None else None,
+            'attributes': span['attributes'],
+            'children': []
+        }
+    root = None
+    for span in trace['spans']:
+        node = nodes[span['span_id']]
+        parent = nodes.get(span['parent_id'])
+        if parent is not None:
+            parent['children'].append(node)
+        elif root is None:
+            root = node
+    return {'trace_id': trace['trace_id'], 'in_progress': trace['end'] is None,
+            'dropped_spans': trace.get('dropped_spans', 0), 'root': root}
+
+
+class Tracer:
+    """
+    Creates traces and spans, exports finished traces to a rotating JSONL file and keeps the
+    last ``keep`` traces (finished or running) in memory for lookup.
+    """
+
+    def __init__(self, enabled: bool = True, path: Optional[str] = DEFAULT_TRACE_FILE,
+                 max_bytes: int = 10 * 1024 * 1024, backups: int = 3, keep: int = 200, max_spans: int = 2000):
+        self.enabled = enabled
+        self.path = path
+        self.keep = keep
+        self.max_spans = max_spans
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._export_logger = None
+        if enabled and path:
+            self._export_logger = self._build_export_logger(path, max_bytes, backups)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.environ.get('TRACING_ENABLED', 'true').lower() not in ('0', 'false', 'no'),
+            path=os.environ.get('TRACE_FILE') or DEFAULT_TRACE_FILE,
+            max_bytes=int(os.environ.get('TRACE_FILE_MAX_BYTES', 10 * 1024 * 1024)),
+            backups=int(os.environ.get('TRACE_FILE_BACKUPS', 3)),
+            keep=int(os.environ.get('TRACE_MEMORY_SIZE', 200)),
+            max_spans=int(os.environ.get('TRACE_MAX_SPANS', 2000))
+        )
+
+    @staticmethod
+    def _build_export_logger(path, max_bytes, backups):
+        """A dedicated logger writing bare JSON lines; the handler rotates the file and serializes writes."""
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        except OSError as e:
+            logger.warning(f"Trace export disabled, cannot write to {path}: {e}")
+            return None
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        export_logger = logging.getLogger(f'{__name__}.export.{id(handler)}')
+        export_logger.propagate = False
+        export_logger.setLevel(logging.INFO)
+        export_logger.addHandler(handler)
+        return export_logger
+
+    @staticmethod
+    def new_trace_id() -> str:
+        return uuid.uuid4().hex
+
+    # --- Traces ---
+
+    def start_trace(self, name: str, trace_id: Optional[str] = None, start: Optional[float] = None,
+                    **attributes) -> Optional[Trace]:
+        if not self.enabled:
+            return None
+        trace = Trace(trace_id or self.new_trace_id(), name, start or time.time(), attributes, self.max_spans)
+        with self._lock:
+            self._recent[trace.id] = trace
+            self._recent.move_to_end(trace.id)
+            while len(self._recent) > self.keep:
+                self._recent.popitem(last=False)
+        return trace
+
+    @contextmanager
+    def activate(self, trace: Optional[Trace]):
+        """Makes ``trace`` the parent of spans opened in this block (for work spread over several calls)."""
+        if trace is None:
+            yield None
+            return
+        token = _current.set((trace, trace.root))
+        try:
+            yield trace
+        finally:
+            _current.reset(token)
+
+    def finish(self, trace: Optional[Trace], **attributes):
+        if trace is None or trace.root.end is not None:
+            return
+        trace.root.set(**attributes)
+        trace.root.end = time.time()
+        if self._export_logger is not None:
+            try:
+                self._export_logger.info(json.dumps(trace.to_dict(), default=str))
+            except Exception as e:
+                logger.warning(f"Could not export trace {trace.id}: {e}")
+
+    @contextmanager
+    def trace(self, name: str, trace_id: Optional[str] = None, start: Optional[float] = None, **attributes):
+        """Starts a trace, makes it active for the block and finishes it at the end."""
+        trace = self.start_trace(name, trace_id, start, **attributes)
+        status = 'ok'
+        try:
+            with self.activate(trace):
+                yield trace
+        except GeneratorExit:
+            status = 'cancelled'
+            raise
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.finish(trace, status=status)
+
+    # --- Spans ---
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """A child of the active span; does nothing outside a trace."""
+        current = _current.get()
+        if current is None:
+            yield None
+            return
+        trace, parent = current
+        span = Span(name, parent.id, time.time(), attributes)
+        if not trace.add(span):
+            yield span
+            return
+        token = _current.set((trace, span))
+        try:
+            yield span
+        except Exception as e:
+            span.set(error=f'{type(e).__name__}: {e}')
+            raise
+        finally:
+            span.end = time.time()
+            _current.reset(token)
+
+    def wrap(self, name: str):
+        """Decorator: runs each call (or, for a generator function, each iteration) in a span."""
+        def decorate(func):
+            if inspect.isgeneratorfunction(func):
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return (yield from func(*args, **kwargs))
+            else:
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def record_span(self, name: str, start: float, end: Optional[float] = None, **attributes):
+        """Adds an already timed span (e.g. a queue wait measured elsewhere) under the active span."""
+        current = _current.get()
+        if current is None:
+            return
+        trace, parent = current
+        span = Span(name, parent.id, start, attributes)
+        span.end = end if end is not None else time.time()
+        trace.add(span)
+
+    @staticmethod
+    def current_trace_id() -> Optional[str]:
+        current = _current.get()
+        return current[0].id if current else None
+
+    def trace_webdriver(self, driver):
+        """Records every WebDriver command sent through ``driver`` as a span."""
+        execute = getattr(driver, 'execute', None)
+        if not self.enabled or execute is None:
+            return driver
+
+        def traced_execute(driver_command, params=None):
+            with self.span(f'webdriver.{driver_command}'):
+                return execute(driver_command, params)
+
+        driver.execute = traced_execute
+        return driver
+
+    # --- Lookup ---
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        """The trace as a span tree, from memory or the exported files; None if unknown."""
+        with self._lock:
+            trace = self._recent.get(trace_id)
+        if trace is not None:
+            return span_tree(trace.to_dict())
+        exported = self._find_exported(trace_id)
+        return span_tree(exported) if exported else None
+
+    def _find_exported(self, trace_id: str) -> Optional[dict]:
+        if not self.path:
+            return None
+        needle = f'"trace_id": "{trace_id}"'
+        candidates = [self.path] + [f'{self.path}.{n}' for n in range(1, 100)]
+        for path in candidates:
+            if not os.path.exists(path):
+                if path != self.path:
+                    break
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if needle in line:
+                        return json.loads(line)
+        return None
+
+
+tracer = Tracer.from_env()
@@ -1,13 +1,117 @@
-from flask import Blueprint, jsonify, request
+import io
+import csv
+import json
+from urllib.parse import urlencode
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 from models import User, db
 from sqlalchemy.exc import IntegrityError
 
 user_bp = Blueprint('user', __name__)
 
+USER_FIELDS = ('id', 'username', 'email')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows fetched per query while streaming NDJSON.
+STREAM_BATCH_SIZE = 500
+# Rows inserted per transaction by the bulk import.
+IMPORT_BATCH_SIZE = 1000
+
+def _validate_user_fields(username, email):
+    """Returns an error message for invalid username/email values, or None. Shared by create and import."""
+    if not isinstance(username, str) or not username.strip():
+        return 'username must be a non-empty string'
+    if not isinstance(email, str) or not email.strip():
+        return 'email must be a non-empty string'
+    return None
+
+def _parse_listing_args():
+    """
+    Reads ?after=<id>&limit=<n>&fields=a,b from the query string.
+    Returns (after, limit, fields, None) or (None, None, None, error_response).
+    """
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return None, None, None, (jsonify({'error': 'after and limit must be integers'}), 400)
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        return None, None, None, (jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400)
+    fields = [f.strip() for f in request.args.get('fields', ','.join(USER_FIELDS)).split(',') if f.strip()]
+    unknown = [f for f in fields if f not in USER_FIELDS]
+    if unknown or not fields:
+        return None, None, None, (jsonify({'error': f'fields must be a comma-separated subset of {", ".join(USER_FIELDS)}'}), 400)
+    return after, limit, fields, None
+
+def _user_rows(after, limit, fields):
+    """Keyset query: the next ``limit`` users with id > ``after``, selecting only the needed columns."""
+    columns = [User.id] + [getattr(User, f) for f in fields if f != 'id']
+    query = db.session.query(*columns).filter(User.id > after).order_by(User.id).limit(limit)
+    return [dict(zip(['id'] + [f for f in fields if f != 'id'], row)) for row in query]
+
+def _select(row, fields):
+    return {f: row[f] for f in fields}
+
+def _iter_users(after, limit, fields):
+    """Yields users with id > ``after``, fetching STREAM_BATCH_SIZE rows per query so memory use stays flat."""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        batch_size = STREAM_BATCH_SIZE if remaining is None else min(STREAM_BATCH_SIZE, remaining)
+        rows = _user_rows(after, batch_size, fields)
+        for row in rows:
+            yield _select(row, fields)
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]['id']
+        if remaining is not None:
+            remaining -= len(rows)
+
+def _stream_users(after, limit, fields):
+    for row in _iter_users(after, limit, fields):
+        yield json.dumps(row) + '\n'
+
+def _stream_users_csv(after, limit, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    for count, row in enumerate(_iter_users(after, limit, fields), 1):
+        writer.writerow(row)
+        if count % STREAM_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
 @user_bp.route('/users', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    """
+    Lists users ordered by id. Without ?limit or ?after every user is returned, as before; with
+    either, one page at a time: ?limit=<n> (default 100) and ?after=<cursor>. The next cursor, if
+    any, is in the X-Next-Cursor and Link headers. ?fields=id,username selects columns.
+    ?format=ndjson (or Accept: application/x-ndjson) streams every matching row instead.
+    """
+    after, limit, fields, error_response = _parse_listing_args()
+    if error_response:
+        return error_response
+
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        return Response(stream_with_context(_stream_users(after, limit, fields)), mimetype='application/x-ndjson')
+
+    if 'limit' not in request.args and 'after' not in request.args:
+        return jsonify(list(_iter_users(after, None, fields)))
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    # One extra row tells whether there is a next page.
+    rows = _user_rows(after, limit + 1, fields)
+    page = rows[:limit]
+    response = jsonify([_select(row, fields) for row in page])
+    if len(rows) > limit:
+        next_cursor = page[-1]['id']
+        args = {'after': next_cursor, 'limit': limit}
+        if 'fields' in request.args:
+            args['fields'] = ','.join(fields)
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
@@ -18,10 +122,9 @@ def create_user():
     username = data.get('username')
     email = data.get('email')
 
-    if not isinstance(username, str) or not username.strip():
-        return jsonify({'error': 'username must be a non-empty string'}), 400
-    if not isinstance(email, str) or not email.strip():
-        return jsonify({'error': 'email must be a non-empty string'}), 400
+    error = _validate_user_fields(username, email)
+    if error:
+        return jsonify({'error': error}), 400
 
     try:
         user = User(username=username.strip(), email=email.strip())
@@ -32,6 +135,124 @@ def create_user():
         db.session.rollback()
         return jsonify({'error': 'A user with this username or email already exists'}), 409 # Conflict
 
+def _read_import_rows(fmt):
+    """Yields (row_number, data_or_None, parse_error) from the request body, streamed line by line."""
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        # strict: bad quoting is reported instead of being read into the wrong columns.
+        for number, row in enumerate(csv.DictReader(lines, strict=True), 1):
+            yield number, row, None
+        return
+    number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield number, None, 'invalid JSON'
+            continue
+        yield number, data, None if isinstance(data, dict) else 'row must be a JSON object'
+
+def _import_batch(batch, errors):
+    """
+    Inserts one batch of validated rows in a single transaction. Rows that clash with an
+    existing user are reported in ``errors`` and skipped. Returns the number inserted.
+    """
+    usernames = [row['username'] for _, row in batch]
+    emails = [row['email'] for _, row in batch]
+    taken_usernames = {u for (u,) in db.session.query(User.username).filter(User.username.in_(usernames))}
+    taken_emails = {e for (e,) in db.session.query(User.email).filter(User.email.in_(emails))}
+    insertable = []
+    for number, row in batch:
+        if row['username'] in taken_usernames or row['email'] in taken_emails:
+            errors.append({'row': number, 'error': 'A user with this username or email already exists'})
+        else:
+            insertable.append((number, row))
+    if not insertable:
+        return 0
+    try:
+        db.session.execute(db.insert(User), [row for _, row in insertable])
+        db.session.commit()
+        return len(insertable)
+    except IntegrityError:
+        # A concurrent writer took some of the names: fall back to row by row for this batch.
+        db.session.rollback()
+    inserted = 0
+    for number, row in insertable:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(User), [row])
+            inserted += 1
+        except IntegrityError:
+            errors.append({'row': number, 'error': 'A user with this username or email already exists'})
+    db.session.commit()
+    return inserted
+
+@user_bp.route('/users/import', methods=['POST'])
+def import_users():
+    """
+    Bulk-creates users from NDJSON (one {"username", "email"} object per line) or CSV with a
+    username,email header; pick with ?format=csv|ndjson or the Content-Type. Rows are validated
+    like POST /users and inserted IMPORT_BATCH_SIZE per transaction. Invalid or conflicting rows
+    are reported by row number without aborting the rest of the import. A body that is not
+    UTF-8 or not parseable CSV stops the import with a 400; the rows of batches committed
+    before that point stay imported and are counted in "imported".
+    """
+    fmt = request.args.get('format') or ('csv' if 'csv' in (request.content_type or '') else 'ndjson')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+    imported, errors, batch = 0, [], []
+    seen_usernames, seen_emails = set(), set()
+    try:
+        for number, data, parse_error in _read_import_rows(fmt):
+            if parse_error:
+                errors.append({'row': number, 'error': parse_error})
+                continue
+            username, email = data.get('username'), data.get('email')
+            error = _validate_user_fields(username, email)
+            if error:
+                errors.append({'row': number, 'error': error})
+                continue
+            username, email = username.strip(), email.strip()
+            if username in seen_usernames or email in seen_emails:
+                errors.append({'row': number, 'error': 'Duplicate username or email within the import'})
+                continue
+            seen_usernames.add(username)
+            seen_emails.add(email)
+            batch.append((number, {'username': username, 'email': email}))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                imported += _import_batch(batch, errors)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as body_error:
+        errors.sort(key=lambda e: e['row'])
+        message = ('Request body is not valid UTF-8' if isinstance(body_error, UnicodeDecodeError)
+                   else f'Invalid CSV: {body_error}')
+        return jsonify({'error': message, 'imported': imported, 'failed': len(errors), 'errors': errors}), 400
+    if batch:
+        imported += _import_batch(batch, errors)
+
+    errors.sort(key=lambda e: e['row'])
+    return jsonify({'imported': imported, 'failed': len(errors), 'errors': errors})
+
+@user_bp.route('/users/export', methods=['GET'])
+def export_users():
+    """Streams all users (or ?after=<id>, ?fields=...) as NDJSON, or CSV with ?format=csv."""
+    after, limit, fields, error_response = _parse_listing_args()
+    if error_response:
+        return error_response
+    fmt = request.args.get('format', 'ndjson')
+    if fmt == 'csv':
+        body, mimetype = _stream_users_csv(after, limit, fields), 'text/csv'
+    elif fmt == 'ndjson':
+        body, mimetype = _stream_users(after, limit, fields), 'application/x-ndjson'
+    else:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=users.{fmt}'})
+
 @user_bp.route('/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
     user = User.query.get_or_404(user_id)